@@ -0,0 +1,357 @@
+"""
+Offline benchmarks for the pipeline hot paths, on synthetic corpora.
+
+python3 -m benchmarks.bench                       # 1k and 100k turns, compare to baselines
+python3 -m benchmarks.bench --scales 1k,100k,1m   # include the 1M turn corpus
+python3 -m benchmarks.bench --update-baselines    # record this machine's numbers
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from src.backend.server import render_markdown
+from src.ml.model import LlamaModel
+from src.ml.compaction import CompactConversation, compact_conversation
+from src.ml.prompt_ollama import find_evidence_in_conversation
+from src.ml.retrieval import LOCAL_EMBED_MODEL, QUESTION_EXEMPLARS, TurnRetriever
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baselines.json"
+)
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+SPEAKERS = ["Alex", "Jordan", "Sam", "Taylor"]
+WORDS = (
+    "hey what are you doing today lol yeah school was fine my mom said "
+    "maybe later we could talk about the game tonight did you see that "
+    "video it was so funny i dont know honestly whatever sounds good"
+).split()
+# Turns that the evidence prompts would quote back
+EVIDENCE = [
+    "I am 14 and in ninth grade",
+    "How old are you anyway?",
+    "We should meet at the mall on Saturday",
+    "I sent you a gift card for your birthday",
+    "Can you send me a picture of you?",
+]
+
+
+def _load_report():
+    # evaluation/ is a script directory, not a package
+    spec = importlib.util.spec_from_file_location(
+        "report", os.path.join(ROOT, "evaluation", "report.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_turns(n_turns: int, seed: int = 0) -> List[Dict[str, str]]:
+    """Chat turns of 3-15 filler words with about 1% evidence turns mixed in."""
+    rng = random.Random(seed)
+    turns = []
+    for _ in range(n_turns):
+        if rng.random() < 0.01:
+            text = rng.choice(EVIDENCE)
+        else:
+            text = " ".join(rng.choices(WORDS, k=rng.randint(3, 15)))
+        turns.append({"speaker": rng.choice(SPEAKERS), "text": text})
+    return turns
+
+
+def _question(number: int, answer: str, evidence: str) -> Dict[str, str]:
+    return {
+        "question_number": str(number),
+        "question": f"Question {number}",
+        "answer": answer,
+        "evidence": evidence,
+    }
+
+
+def make_model_outputs(n: int, seed: int = 0) -> List[str]:
+    """
+    Raw LlamaModel responses in the shapes the cleanup ladder sees in
+    practice: chatter around the JSON, raw newlines and stray backslashes,
+    quotes joined with "and", and missing commas.
+    """
+    rng = random.Random(seed)
+    outputs = []
+    for _ in range(n):
+        questions = [
+            _question(
+                i,
+                *(
+                    ("YES", f'"{EVIDENCE[i - 1]}"')
+                    if rng.random() < 0.2
+                    else ("NO", "No evidence found in conversation")
+                ),
+            )
+            for i in range(1, 6)
+        ]
+        text = json.dumps({"analysis": {"questions": questions}}, indent=4)
+        shape = rng.randrange(5)
+        if shape == 1:
+            text = (
+                "Here is my analysis of the conversation:\n" + text + "\nLet me know!"
+            )
+        elif shape == 2:
+            text = text.replace('"answer"', '"answer\\\n"')
+        elif shape == 3:
+            text = text.replace(
+                '"answer"',
+                '"instances": ["I\'m 14" and "ninth grade"],\n            "answer"',
+                1,
+            )
+        elif shape == 4:
+            # Not recoverable by any single cleanup, so it walks the whole ladder
+            text = text.replace('",\n', '"\n', 1)
+        outputs.append(text)
+    return outputs
+
+
+class ReplayClient:
+    """Stands in for LLMClient and answers with canned responses in turn."""
+
+    def __init__(self, responses: List[str]):
+        self.responses = responses
+        self.index = 0
+
+    def generate(self, model="", prompt="", **kwargs):
+        response = self.responses[self.index % len(self.responses)]
+        self.index += 1
+        return {"response": response}
+
+
+def bench_find_evidence(n_turns: int, seed: int) -> Callable[[], None]:
+    turns = make_turns(n_turns, seed)
+    evidence = [f'Sam: "{text}"' for text in EVIDENCE]
+
+    def run():
+        for text in evidence:
+            find_evidence_in_conversation(text, turns)
+
+    return run
+
+
+def bench_compact_conversation(n_turns: int, seed: int) -> Callable[[], None]:
+    conversation = {"turns": make_turns(n_turns, seed)}
+    return lambda: compact_conversation(conversation)
+
+
+def bench_narrow_conversation(n_turns: int, seed: int) -> Callable[[], None]:
+    """Embed every turn with the local stand-in and pick turns for each question."""
+    prepared = CompactConversation.unchanged({"turns": make_turns(n_turns, seed)})
+
+    def run():
+        # A fresh cache, so every run embeds the conversation once
+        retriever = TurnRetriever(LOCAL_EMBED_MODEL)
+        for qid in QUESTION_EXEMPLARS:
+            retriever.narrow(prepared, qid)
+
+    return run
+
+
+def bench_split_text(n_turns: int, seed: int) -> Callable[[], None]:
+    model = LlamaModel(client=ReplayClient([""]))
+    text = "\n".join(str(turn) for turn in make_turns(n_turns, seed))
+    return lambda: model._split_text(text)
+
+
+def bench_cleanup_ladder(n_turns: int, seed: int) -> Callable[[], None]:
+    outputs = make_model_outputs(max(1, n_turns // 100), seed)
+    model = LlamaModel(client=ReplayClient(outputs))
+
+    def run():
+        model.client.index = 0
+        for _ in outputs:
+            try:
+                model._generate_response("")
+            except ValueError:
+                pass
+
+    return run
+
+
+def bench_clean_and_format(n_turns: int, seed: int) -> Callable[[], None]:
+    model = LlamaModel(client=ReplayClient([""]))
+    results = []
+    for text in make_model_outputs(max(1, n_turns // 100), seed):
+        results.append(text[text.find("{") : text.rfind("}") + 1])
+    return lambda: model.clean_and_format_response(results, "synthetic.csv")
+
+
+def bench_render_markdown(n_turns: int, seed: int) -> Callable[[], None]:
+    turns = make_turns(n_turns, seed)
+    df = pd.DataFrame(
+        {
+            "Timestamp": [f"2024-01-01 00:{i % 60:02d}:00" for i in range(n_turns)],
+            "Speaker": [turn["speaker"] for turn in turns],
+            "Message": [turn["text"] for turn in turns],
+        }
+    )
+    results = {}
+    for i, evidence in enumerate(EVIDENCE, 1):
+        lines = find_evidence_in_conversation(evidence, turns)
+        results[f"Q{i}"] = {
+            "answer": "YES" if lines else "NO",
+            "evidence": evidence,
+            "evidence_lines": lines,
+        }
+    return lambda: render_markdown("synthetic.csv", df, results)
+
+
+def bench_analyze_questions(n_turns: int, seed: int) -> Callable[[], None]:
+    report = _load_report()
+    rng = np.random.default_rng(seed)
+    answers = np.array(["YES", "NO", "yes", "No", "ERROR"], dtype=object)
+    columns = {"id": np.arange(n_turns).astype(str)}
+    for q in report.QUESTIONS:
+        columns[f"{q}_labeled"] = answers[rng.choice(4, n_turns)]
+        columns[f"{q}_conv"] = answers[
+            rng.choice(5, n_turns, p=[0.2, 0.6, 0.05, 0.1, 0.05])
+        ]
+    merged = pd.DataFrame(columns)
+    return lambda: report.analyze_questions(merged)
+
+
+BENCHMARKS = {
+    "find_evidence": bench_find_evidence,
+    "compact_conversation": bench_compact_conversation,
+    "narrow_conversation": bench_narrow_conversation,
+    "split_text": bench_split_text,
+    "cleanup_ladder": bench_cleanup_ladder,
+    "clean_and_format": bench_clean_and_format,
+    "render_markdown": bench_render_markdown,
+    "analyze_questions": bench_analyze_questions,
+}
+
+
+def time_best(fn: Callable[[], None], repeat: int) -> float:
+    """Best wall time of `repeat` runs, the least noisy estimate of the cost."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def load_baselines(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline hot paths")
+    parser.add_argument(
+        "--scales",
+        default="1k,100k",
+        help=f"Comma separated corpus sizes in turns: {', '.join(SCALES)} (default: 1k,100k)",
+    )
+    parser.add_argument(
+        "--only",
+        default=None,
+        help=f"Comma separated benchmarks to run: {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per benchmark; the best is kept"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Fail when a benchmark is this much slower than its baseline (default: 0.25 = 25%%)",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.005,
+        help="Ignore slowdowns smaller than this many seconds, which are timer noise (default: 0.005)",
+    )
+    parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="Write the measured times to the baselines file instead of comparing",
+    )
+    args = parser.parse_args()
+
+    scales = [s.strip().lower() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        parser.error(f"Unknown scales: {', '.join(unknown)}")
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    # The cleanup ladder logs every response it gives up on
+    logging.disable(logging.ERROR)
+
+    baselines = load_baselines(args.baselines)
+    baseline_times = baselines.get("results", {})
+    measured = {}
+    regressions = []
+
+    print(f"{'benchmark':<28} {'seconds':>10} {'baseline':>10} {'ratio':>7}")
+    for scale in scales:
+        for name in names:
+            key = f"{name}@{scale}"
+            fn = BENCHMARKS[name](SCALES[scale], args.seed)
+            seconds = time_best(fn, args.repeat)
+            measured[key] = round(seconds, 6)
+
+            baseline = baseline_times.get(key)
+            if baseline:
+                ratio = seconds / baseline
+                regressed = (
+                    ratio > 1 + args.threshold and seconds - baseline > args.min_delta
+                )
+                flag = " REGRESSION" if regressed else ""
+                if flag:
+                    regressions.append(key)
+                print(
+                    f"{key:<28} {seconds:>10.4f} {baseline:>10.4f} {ratio:>6.2f}x{flag}"
+                )
+            else:
+                print(f"{key:<28} {seconds:>10.4f} {'-':>10} {'-':>7}")
+
+    if args.update_baselines:
+        baseline_times.update(measured)
+        baselines = {
+            "machine": f"{platform.machine()} {platform.processor() or platform.system()}",
+            "python": platform.python_version(),
+            "results": dict(sorted(baseline_times.items())),
+        }
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+        print(f"\nBaselines written to {args.baselines}")
+        return
+
+    if regressions:
+        print(
+            f"\n{len(regressions)} benchmark(s) more than {args.threshold:.0%} slower "
+            f"than baseline: {', '.join(regressions)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
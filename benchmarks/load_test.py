@@ -0,0 +1,482 @@
+"""
+End-to-end load test of the /analyzer endpoint against the mock Ollama server.
+
+python3 -m benchmarks.load_test --rates 1,2,4,8 --duration 30 --output load_results.json
+python3 -m benchmarks.load_test --rates 2,4 --file-sizes 20:0.7,2000:0.3 --mock-latency fixed:0.2 --mock-slots 2
+python3 -m benchmarks.load_test --rates 1,2,4,8 --compare load_results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import requests
+
+from src.mock.ollama_server import start_in_thread
+
+from .bench import ROOT, make_turns
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+# Markdown the analyzer returns with HTTP 200 when a file could not be analyzed
+FAILURE_MARKERS = ["Analysis Failed", "## Error Processing"]
+
+
+def parse_file_sizes(spec: str) -> Tuple[List[int], List[float]]:
+    """Parse "ROWS:WEIGHT,..." (weight optional) into sizes and weights."""
+    sizes, weights = [], []
+    for item in spec.split(","):
+        rows, _, weight = item.strip().partition(":")
+        sizes.append(int(rows))
+        weights.append(float(weight) if weight else 1.0)
+    return sizes, weights
+
+
+def write_conversation_csv(path: str, n_rows: int, seed: int) -> None:
+    """A synthetic upload in the analyzer's Timestamp,Speaker,Message format."""
+    turns = make_turns(n_rows, seed)
+    pd.DataFrame(
+        {
+            "Timestamp": [
+                f"2024-10-06 {(i // 60) % 24:02d}:{i % 60:02d}" for i in range(n_rows)
+            ],
+            "Speaker": [turn["speaker"] for turn in turns],
+            "Message": [turn["text"] for turn in turns],
+        }
+    ).to_csv(path, index=False)
+
+
+def arrival_times(
+    rate: float, duration: float, arrivals: str, rng: random.Random
+) -> List[float]:
+    """Offsets in seconds at which requests are sent during one step."""
+    times = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate) if arrivals == "poisson" else 1.0 / rate
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """Samples the server's RSS on a background thread, tagged with the current step."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Dict] = []
+        self.step: Optional[float] = None
+        self._start = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append(
+                    {
+                        "t": round(time.perf_counter() - self._start, 3),
+                        "rate": self.step,
+                        "rss_mb": round(rss, 1),
+                    }
+                )
+            self._stop.wait(self.interval)
+
+    def start(self) -> "RssSampler":
+        if self.pid is not None:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def peak(self, rate: float) -> Optional[float]:
+        values = [s["rss_mb"] for s in self.samples if s["rate"] == rate]
+        return max(values) if values else None
+
+
+def send_request(url: str, path: str, scheduled: float, timeout: float) -> Dict:
+    """
+    POST one file to the analyzer. Latency is measured from the scheduled send
+    time, so time spent waiting for a free client thread counts against the
+    server instead of being silently dropped.
+    """
+    payload = {"inputs": {"inputs": {"files": [{"path": path}]}}, "parameters": {}}
+    error = None
+    try:
+        response = requests.post(url, json=payload, timeout=timeout)
+        if response.status_code != 200:
+            error = f"HTTP {response.status_code}"
+        else:
+            body = response.json()
+            text = f"{body.get('title', '')}\n{body.get('value', '')}"
+            if any(marker in text for marker in FAILURE_MARKERS):
+                error = "analysis failed"
+    except requests.RequestException as e:
+        error = type(e).__name__
+    return {"latency": time.perf_counter() - scheduled, "error": error}
+
+
+def run_step(
+    url: str,
+    rate: float,
+    duration: float,
+    arrivals: str,
+    sizes: List[int],
+    weights: List[float],
+    work_dir: str,
+    timeout: float,
+    max_in_flight: int,
+    seed: int,
+) -> Dict:
+    """Offer `rate` requests/sec for `duration` seconds and summarize the responses."""
+    rng = random.Random(seed)
+    offsets = arrival_times(rate, duration, arrivals, rng)
+
+    # Every request gets its own file so the server's response cache never hits
+    paths = []
+    for i in range(len(offsets)):
+        path = os.path.join(work_dir, f"load_{rate:g}_{i}.csv")
+        write_conversation_csv(path, rng.choices(sizes, weights)[0], seed * 100003 + i)
+        paths.append(path)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = []
+        for offset, path in zip(offsets, paths):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(
+                executor.submit(send_request, url, path, start + offset, timeout)
+            )
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    for path in paths:
+        os.remove(path)
+
+    latencies = np.array([r["latency"] for r in results if r["error"] is None])
+    errors = [r["error"] for r in results if r["error"] is not None]
+    percentiles = (
+        [round(float(p), 4) for p in np.percentile(latencies, [50, 95, 99])]
+        if len(latencies)
+        else [None] * 3
+    )
+    return {
+        "rate": rate,
+        # Realized arrival rate, which differs from `rate` by Poisson noise
+        "offered": round(len(results) / duration, 3),
+        "requests": len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "errors": sorted(set(errors)),
+        "p50": percentiles[0],
+        "p95": percentiles[1],
+        "p99": percentiles[2],
+    }
+
+
+def saturation_rate(
+    steps: List[Dict], max_error_rate: float, slo_p95: Optional[float]
+) -> Optional[float]:
+    """
+    First offered rate the server cannot keep up with: it completes less than
+    90% of the requests that arrived per second, errors too often, or misses
+    the p95 objective.
+    """
+    for step in steps:
+        if (
+            step["throughput"] < 0.9 * step["offered"]
+            or step["error_rate"] > max_error_rate
+            or (slo_p95 is not None and (step["p95"] is None or step["p95"] > slo_p95))
+        ):
+            return step["rate"]
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, ollama_url: str, log_path: str) -> subprocess.Popen:
+    """Run the real analyzer server in a subprocess, pointed at the mock Ollama."""
+    env = dict(os.environ, OLLAMA_HOST=ollama_url, PYTHONUNBUFFERED="1")
+    env.pop("OLLAMA_HOSTS", None)
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.backend.server", "--port", str(port)],
+        cwd=ROOT,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    log.close()
+    return process
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/api/routes", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} not ready after {timeout:.0f}s")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _cell(value, spec: str, width: int) -> str:
+    return f"{value:{width}{spec}}" if value is not None else f"{'-':>{width}}"
+
+
+def print_curve(steps: List[Dict], baseline: Optional[Dict] = None) -> None:
+    base_steps = {s["rate"]: s for s in (baseline or {}).get("steps", [])}
+    header = (
+        f"{'rate':>6} {'req':>5} {'thrpt':>7} {'err%':>6} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8} {'rss_mb':>8}"
+    )
+    if base_steps:
+        header += f" {'p95 base':>9} {'thrpt base':>11}"
+    print(header)
+    for step in steps:
+        line = " ".join(
+            [
+                _cell(step["rate"], "g", 6),
+                _cell(step["requests"], "d", 5),
+                _cell(step["throughput"], ".2f", 7),
+                _cell(step["error_rate"] * 100, ".1f", 6),
+                _cell(step["p50"], ".3f", 8),
+                _cell(step["p95"], ".3f", 8),
+                _cell(step["p99"], ".3f", 8),
+                _cell(step.get("peak_rss_mb"), ".1f", 8),
+            ]
+        )
+        base = base_steps.get(step["rate"])
+        if base:
+            line += " " + _cell(base["p95"], ".3f", 9)
+            line += " " + _cell(base["throughput"], ".2f", 11)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the /analyzer endpoint against a mock LLM"
+    )
+    parser.add_argument(
+        "--rates",
+        default="0.5,1,2,4",
+        help="Comma separated offered loads in requests/sec, one step each (default: 0.5,1,2,4)",
+    )
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per step")
+    parser.add_argument(
+        "--arrivals", choices=["poisson", "constant"], default="poisson"
+    )
+    parser.add_argument(
+        "--file-sizes",
+        default="20:0.6,200:0.3,2000:0.1",
+        help="Mix of uploaded file sizes as ROWS:WEIGHT (default: 20:0.6,200:0.3,2000:0.1)",
+    )
+    parser.add_argument(
+        "--server-url",
+        default=None,
+        help="Test an already running server instead of starting one (its Ollama host is up to you)",
+    )
+    parser.add_argument(
+        "--server-pid",
+        type=int,
+        default=None,
+        help="PID to sample RSS from with --server-url",
+    )
+    parser.add_argument(
+        "--mock-latency",
+        default="lognormal:-3,0.5",
+        help="Mock Ollama latency per call, see src/mock/ollama_server.py (default: about 50ms)",
+    )
+    parser.add_argument("--mock-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--mock-slots", type=int, default=4)
+    parser.add_argument("--mock-failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--mock-script",
+        default=None,
+        help="Scripted mock answers, as for the mock server",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300.0, help="Per request timeout"
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=256, help="Client threads sending requests"
+    )
+    parser.add_argument(
+        "--sample-interval", type=float, default=0.5, help="RSS sampling period"
+    )
+    parser.add_argument(
+        "--slo-p95", type=float, default=None, help="p95 latency objective in seconds"
+    )
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=0.01,
+        help="Error rate that counts as saturated (default: 0.01)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    parser.add_argument(
+        "--compare", default=None, help="Earlier --output JSON to print alongside"
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the work directory (uploaded files and the server log)",
+    )
+    args = parser.parse_args()
+
+    rates = [float(r) for r in args.rates.split(",") if r.strip()]
+    sizes, weights = parse_file_sizes(args.file_sizes)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix="analyzer_load_")
+    mock_server = process = None
+    if args.server_url:
+        base_url = args.server_url.rstrip("/")
+        pid = args.server_pid
+    else:
+        script = None
+        if args.mock_script:
+            with open(args.mock_script) as f:
+                script = json.load(f)
+        mock_server, ollama_url = start_in_thread(
+            port=0,
+            latency=args.mock_latency,
+            tokens_per_second=args.mock_tokens_per_second,
+            slots=args.mock_slots,
+            failure_rate=args.mock_failure_rate,
+            script=script,
+            seed=args.seed,
+        )
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server_log = os.path.join(work_dir, "server.log")
+        process = start_server(port, ollama_url, server_log)
+        pid = process.pid
+        logging.info(f"Mock Ollama at {ollama_url}, server log at {server_log}")
+
+    sampler = None
+    try:
+        if process:
+            wait_until_ready(base_url, process, timeout=60)
+        sampler = RssSampler(pid, args.sample_interval).start()
+        steps = []
+        for i, rate in enumerate(rates):
+            sampler.step = rate
+            logging.info(
+                f"Step {i + 1}/{len(rates)}: {rate:g} req/s for {args.duration:g}s"
+            )
+            step = run_step(
+                f"{base_url}/analyzer",
+                rate,
+                args.duration,
+                args.arrivals,
+                sizes,
+                weights,
+                work_dir,
+                args.timeout,
+                args.max_in_flight,
+                args.seed + i,
+            )
+            step["peak_rss_mb"] = sampler.peak(rate)
+            steps.append(step)
+        sampler.step = None
+    finally:
+        if sampler:
+            sampler.stop()
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        if mock_server:
+            mock_server.shutdown()
+        if args.keep:
+            logging.info(f"Work directory kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    saturated = saturation_rate(steps, args.max_error_rate, args.slo_p95)
+    print("\n=== Saturation Curve ===")
+    print_curve(steps, baseline)
+    if saturated is None:
+        print(f"\nNot saturated up to {rates[-1]:g} req/s")
+    else:
+        print(f"\nSaturated at {saturated:g} req/s")
+
+    if args.output:
+        config = vars(args)
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "config": config,
+                    "steps": steps,
+                    "saturation_rate": saturated,
+                    "rss": sampler.samples,
+                },
+                f,
+                indent=2,
+            )
+        logging.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
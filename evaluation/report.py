@@ -1,15 +1,19 @@
 """
-python3 evaluation/report.py --labeled-data "src/data_processing/cornell_movie_dialogs/labeled_csv/labeled_data_1-1000.csv" --conv-pattern "evaluation/conversations_part_*.csv" --output "evaluation/results.csv"
+python3 -m evaluation.report --labeled-data "src/data_processing/cornell_movie_dialogs/labeled_csv/labeled_data_1-1000.csv" --conv-pattern "evaluation/conversations_part_*.csv" --output "evaluation/results.csv"
 """
 
 import argparse
 import glob
 import os
+import sqlite3
 from collections import defaultdict
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 
+# The cascade's cost model, so reported costs match what runs were charged
+from src.ml.model_costs import model_cost
+
 
 def load_labeled_data(filepath: str) -> pd.DataFrame:
     """Load and prepare the labeled data file"""
@@ -29,19 +33,76 @@ def load_labeled_data(filepath: str) -> pd.DataFrame:
     return labeled_df
 
 
-def load_conversation_file(filepath: str) -> pd.DataFrame:
-    """Load and prepare a conversation data file"""
+# Per-conversation cost columns recorded by the CLI and batch clients
+USAGE_COLUMNS = ["latency_seconds", "llm_calls", "prompt_tokens", "eval_tokens"]
+
+
+# Result stores written with --result_store (src/ml/result_store.py)
+RESULT_STORE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+
+def load_result_store(filepath: str, model: Optional[str] = None) -> pd.DataFrame:
+    """One row of answers and cost per conversation from a SQLite result store.
+
+    The answers are pivoted from the verdicts table in SQL. A store holding
+    several models needs `model`.
+    """
+    with sqlite3.connect(f"file:{filepath}?mode=ro", uri=True) as db:
+        models = [row[0] for row in db.execute("SELECT DISTINCT model FROM analyses")]
+        if model is None:
+            if len(models) > 1:
+                raise ValueError(
+                    f"{filepath} holds several models ({', '.join(models)}); "
+                    f"pick one with --store-model"
+                )
+            model = models[0] if models else ""
+        answers = ", ".join(
+            f"MAX(CASE WHEN v.question = 'Q{i}' THEN v.answer END) AS Q{i}"
+            for i in range(1, 6)
+        )
+        store_df = pd.read_sql_query(
+            f"SELECT v.conversation_id AS id, {answers}, "
+            f"a.latency_seconds, a.llm_calls, a.prompt_tokens, a.eval_tokens "
+            f"FROM verdicts v JOIN analyses a "
+            f"ON a.conversation_id = v.conversation_id AND a.model = v.model "
+            f"WHERE v.model = ? GROUP BY v.conversation_id",
+            db,
+            params=(model,),
+        )
+    # IDs are stored as text; numeric ones must match the labeled integer IDs
+    try:
+        store_df["id"] = pd.to_numeric(store_df["id"])
+    except ValueError:
+        pass
+    return store_df
+
+
+def load_conversation_file(filepath: str, model: Optional[str] = None) -> pd.DataFrame:
+    """Load and prepare a conversation data file (CSV, typed Parquet or a result store)"""
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Conversation file not found: {filepath}")
+    if filepath.lower().endswith(RESULT_STORE_EXTENSIONS):
+        return load_result_store(filepath, model)
+    if filepath.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        # Answers are already booleans; the evidence columns are not needed
+        available = pq.read_schema(filepath).names
+        columns = ["id"] + [f"Q{i}" for i in range(1, 6)]
+        columns += [c for c in USAGE_COLUMNS + ["cost"] if c in available]
+        return pd.read_parquet(filepath, columns=columns)
     return pd.read_csv(filepath)
 
 
 import argparse
 import glob
 import os
+import threading
 from collections import defaultdict
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 # [前面的 load_labeled_data 和 load_conversation_file 函數保持不變]
@@ -84,53 +145,83 @@ def calculate_metrics_yes_only(true_pos: int, false_neg: int, total_yes: int) ->
     }
 
 
-def analyze_questions(merged_df: pd.DataFrame) -> Tuple[Dict, Dict, Dict]:
-    """Analyze each question separately and return metrics along with raw numbers"""
+# Answer codes used by the confusion-matrix engine
+NO, YES, OTHER = 0, 1, 2
+QUESTIONS = [f"Q{q_num}" for q_num in range(1, 6)]
+
+
+def encode_answers(column: pd.Series) -> np.ndarray:
+    """Encode an answer column once into uint8 NO/YES/OTHER codes.
+
+    Strings follow the report's rules: YES if it starts with "yes", NO if it
+    is exactly "no" (case-insensitive), OTHER for anything else such as
+    "ERROR" or a missing value. Booleans (Parquet output) are YES or NO, and
+    a null answer (a failed analysis) is OTHER; with nulls the column comes
+    back as object or pandas "boolean" dtype instead of bool. Only the
+    distinct values are classified, so the cost is one hash pass over the
+    column.
+    """
+    if pd.api.types.is_bool_dtype(column) and not column.hasnans:
+        return column.to_numpy(dtype=np.uint8)
+
+    def classify(value) -> int:
+        if isinstance(value, (bool, np.bool_)):
+            return YES if value else NO
+        lowered = str(value).lower()
+        return YES if lowered.startswith("yes") else NO if lowered == "no" else OTHER
+
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    classes = np.array(
+        [classify(value) for value in uniques] + [OTHER],
+        dtype=np.uint8,
+    )
+    # The sentinel -1 for missing values indexes the trailing OTHER entry
+    return classes[codes]
+
+
+def confusion_counts(labels: np.ndarray, predictions: np.ndarray) -> np.ndarray:
+    """Count every (label, prediction) pair for all questions in one bincount.
+
+    Takes (rows, questions) code arrays and returns (questions, 3, 3) counts
+    indexed as [question, label, prediction].
+    """
+    n_questions = labels.shape[1]
+    cells = labels.astype(np.intp) * 3 + predictions
+    cells += np.arange(n_questions, dtype=np.intp) * 9
+    counts = np.bincount(cells.ravel(), minlength=n_questions * 9)
+    return counts.reshape(n_questions, 3, 3)
+
+
+def encode_merged(merged_df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode the labeled and predicted answer columns of a merged frame"""
+    labels = np.column_stack(
+        [encode_answers(merged_df[f"{q}_labeled"]) for q in QUESTIONS]
+    )
+    predictions = np.column_stack(
+        [encode_answers(merged_df[f"{q}_conv"]) for q in QUESTIONS]
+    )
+    return labels, predictions
+
+
+def metrics_from_counts(counts: np.ndarray) -> Tuple[Dict, Dict, Dict]:
+    """Turn (questions, 3, 3) confusion counts into the report's metric dicts"""
     all_metrics = {}
     yes_only_metrics = {}
     raw_counts = {}
 
-    for q_num in range(1, 6):
-        q_label = f"Q{q_num}"
-        labeled_col = f"{q_label}_labeled"
-        conv_col = f"{q_label}_conv"
-
-        # Get raw counts first
-        yes_cases = merged_df[merged_df[labeled_col].str.lower().str.startswith("yes")]
-        no_cases = merged_df[merged_df[labeled_col].str.lower() == "no"]
-
-        true_pos = len(
-            merged_df[
-                (merged_df[labeled_col].str.lower().str.startswith("yes"))
-                & (merged_df[conv_col].str.lower().str.startswith("yes"))
-            ]
-        )
-        true_neg = len(
-            merged_df[
-                (merged_df[labeled_col].str.lower() == "no")
-                & (merged_df[conv_col].str.lower() == "no")
-            ]
-        )
-        false_pos = len(
-            merged_df[
-                (merged_df[labeled_col].str.lower() == "no")
-                & (merged_df[conv_col].str.lower().str.startswith("yes"))
-            ]
-        )
-        false_neg = len(
-            merged_df[
-                (merged_df[labeled_col].str.lower().str.startswith("yes"))
-                & (merged_df[conv_col].str.lower() == "no")
-            ]
-        )
+    for q_index, q_label in enumerate(QUESTIONS):
+        matrix = counts[q_index]
+        total = int(matrix.sum())
+        true_pos = int(matrix[YES, YES])
+        true_neg = int(matrix[NO, NO])
+        false_pos = int(matrix[NO, YES])
+        false_neg = int(matrix[YES, NO])
+        total_yes = int(matrix[YES].sum())
 
-        total_yes = len(yes_cases)
-
-        # Store raw counts
         raw_counts[q_label] = {
-            "total_cases": len(merged_df),
+            "total_cases": total,
             "total_yes_cases": total_yes,
-            "total_no_cases": len(no_cases),
+            "total_no_cases": int(matrix[NO].sum()),
             "true_positive": true_pos,
             "true_negative": true_neg,
             "false_positive": false_pos,
@@ -139,7 +230,7 @@ def analyze_questions(merged_df: pd.DataFrame) -> Tuple[Dict, Dict, Dict]:
 
         # Calculate metrics with all cases
         all_metrics[q_label] = calculate_metrics_all_cases(
-            true_pos, false_pos, false_neg, true_neg, len(merged_df)
+            true_pos, false_pos, false_neg, true_neg, total
         )
 
         # Calculate metrics with only yes cases
@@ -150,6 +241,555 @@ def analyze_questions(merged_df: pd.DataFrame) -> Tuple[Dict, Dict, Dict]:
     return all_metrics, yes_only_metrics, raw_counts
 
 
+def analyze_questions(merged_df: pd.DataFrame) -> Tuple[Dict, Dict, Dict]:
+    """Analyze each question separately and return metrics along with raw numbers"""
+    labels, predictions = encode_merged(merged_df)
+    return metrics_from_counts(confusion_counts(labels, predictions))
+
+
+METRICS = ["accuracy", "precision", "recall", "f1"]
+
+
+def _metric_arrays(
+    tp: np.ndarray,
+    fp: np.ndarray,
+    fn: np.ndarray,
+    tn: np.ndarray,
+    total: np.ndarray,
+    undefined: float = 0.0,
+) -> Dict[str, np.ndarray]:
+    """Vectorized calculate_metrics_all_cases over arrays of counts (in %)
+
+    A metric whose denominator is zero is `undefined`: 0 like the scalar
+    version by default, NaN for bootstrap resamples.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = np.where(total > 0, (tp + tn) / total, undefined)
+        precision = np.where(tp + fp > 0, tp / (tp + fp), undefined)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), undefined)
+        f1 = np.where(
+            precision + recall > 0,
+            2 * precision * recall / (precision + recall),
+            0.0,
+        )
+        # No positive labels or predictions at all
+        f1 = np.where(2 * tp + fp + fn > 0, f1, undefined)
+    return {
+        "accuracy": accuracy * 100,
+        "precision": precision * 100,
+        "recall": recall * 100,
+        "f1": f1 * 100,
+    }
+
+
+def _outcome_masks(labels: np.ndarray, predictions: np.ndarray) -> np.ndarray:
+    """(4, rows, questions) float32 indicators for TP, FP, FN, TN"""
+    return np.stack(
+        [
+            (labels == YES) & (predictions == YES),
+            (labels == NO) & (predictions == YES),
+            (labels == YES) & (predictions == NO),
+            (labels == NO) & (predictions == NO),
+        ]
+    ).astype(np.float32)
+
+
+def _resample_weights(
+    n_rows: int, n_resamples: int, rng: np.random.Generator, max_cells: int
+):
+    """Yield (chunk, rows) multinomial resample counts in memory-bounded chunks"""
+    chunk = max(1, min(n_resamples, max_cells // max(n_rows, 1)))
+    pvals = np.full(n_rows, 1.0 / n_rows)
+    done = 0
+    while done < n_resamples:
+        size = min(chunk, n_resamples - done)
+        yield rng.multinomial(n_rows, pvals, size=size).astype(np.float32)
+        done += size
+
+
+def _bootstrap_metric_arrays(
+    prediction_sets: List[np.ndarray],
+    labels: np.ndarray,
+    n_resamples: int,
+    seed: int,
+    max_cells: int = 20_000_000,
+) -> List[Dict[str, np.ndarray]]:
+    """Metrics for (resamples, questions) for each prediction set.
+
+    Every prediction set is scored on the same resamples, so differences
+    between sets are paired. Each resample's counts are one matrix product
+    of the resample weights with the outcome indicators. A metric is NaN in
+    a degenerate resample, e.g. precision when nothing was predicted YES.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = labels.shape[0]
+    masks = [_outcome_masks(labels, predictions) for predictions in prediction_sets]
+    results = [[] for _ in prediction_sets]
+
+    for weights in _resample_weights(n_rows, n_resamples, rng, max_cells):
+        total = weights.sum(axis=1, keepdims=True)
+        for result, outcome in zip(results, masks):
+            tp, fp, fn, tn = (weights @ outcome[i] for i in range(4))
+            result.append(_metric_arrays(tp, fp, fn, tn, total, np.nan))
+
+    return [
+        {metric: np.concatenate([r[metric] for r in result]) for metric in METRICS}
+        for result in results
+    ]
+
+
+def _point_metrics(labels: np.ndarray, predictions: np.ndarray) -> Dict:
+    counts = confusion_counts(labels, predictions).astype(np.float64)
+    return _metric_arrays(
+        counts[:, YES, YES],
+        counts[:, NO, YES],
+        counts[:, YES, NO],
+        counts[:, NO, NO],
+        counts.sum(axis=(1, 2)),
+    )
+
+
+def _percentile_interval(values: np.ndarray, tail: float) -> Tuple[float, float]:
+    """Percentile interval of the non-degenerate (non-NaN) resamples"""
+    if np.isnan(values).all():
+        return np.nan, np.nan
+    low, high = np.nanpercentile(values, [tail, 100 - tail])
+    return low, high
+
+
+def bootstrap_confidence_intervals(
+    labels: np.ndarray,
+    predictions: np.ndarray,
+    n_resamples: int = 1000,
+    ci: float = 95.0,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Percentile bootstrap intervals for every metric and question
+
+    Degenerate counts the resamples where the metric is undefined; they are
+    left out of the interval and the standard deviation.
+    """
+    point = _point_metrics(labels, predictions)
+    (samples,) = _bootstrap_metric_arrays([predictions], labels, n_resamples, seed)
+    tail = (100 - ci) / 2
+
+    rows = []
+    for q_index, q_label in enumerate(QUESTIONS):
+        for metric in METRICS:
+            values = samples[metric][:, q_index]
+            low, high = _percentile_interval(values, tail)
+            degenerate = int(np.isnan(values).sum())
+            std = np.nanstd(values) if degenerate < len(values) else np.nan
+            rows.append(
+                {
+                    "Question": q_label,
+                    "Metric": metric,
+                    "Value": f"{point[metric][q_index]:.2f}%",
+                    "CI_Low": f"{low:.2f}%",
+                    "CI_High": f"{high:.2f}%",
+                    "Std": f"{std:.2f}",
+                    "Degenerate": degenerate,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def paired_bootstrap(
+    labels: np.ndarray,
+    predictions_a: np.ndarray,
+    predictions_b: np.ndarray,
+    n_resamples: int = 1000,
+    ci: float = 95.0,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Bootstrap the difference A - B of every metric on shared resamples.
+
+    P_Value is the two-sided share of resamples where the difference
+    crosses zero. Resamples where the metric is undefined for A or B are
+    left out and counted in Degenerate.
+    """
+    point_a = _point_metrics(labels, predictions_a)
+    point_b = _point_metrics(labels, predictions_b)
+    samples_a, samples_b = _bootstrap_metric_arrays(
+        [predictions_a, predictions_b], labels, n_resamples, seed
+    )
+    tail = (100 - ci) / 2
+
+    rows = []
+    for q_index, q_label in enumerate(QUESTIONS):
+        for metric in METRICS:
+            delta = samples_a[metric][:, q_index] - samples_b[metric][:, q_index]
+            low, high = _percentile_interval(delta, tail)
+            valid = delta[~np.isnan(delta)]
+            p_value = (
+                min(1.0, 2 * min((valid <= 0).mean(), (valid >= 0).mean()))
+                if len(valid)
+                else np.nan
+            )
+            rows.append(
+                {
+                    "Question": q_label,
+                    "Metric": metric,
+                    "A": f"{point_a[metric][q_index]:.2f}%",
+                    "B": f"{point_b[metric][q_index]:.2f}%",
+                    "Delta": f"{point_a[metric][q_index] - point_b[metric][q_index]:+.2f}",
+                    "CI_Low": f"{low:+.2f}",
+                    "CI_High": f"{high:+.2f}",
+                    "P_Value": f"{p_value:.3f}",
+                    "Degenerate": len(delta) - len(valid),
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def load_predictions(pattern: str) -> pd.DataFrame:
+    """Concatenate every prediction file matching a glob pattern"""
+    files = sorted(glob.glob(pattern))
+    if not files:
+        raise FileNotFoundError(f"No files found matching pattern: {pattern}")
+    return pd.concat([load_conversation_file(f) for f in files])
+
+
+class LabelIndex:
+    """Labeled answers encoded once, with a hashed ID -> row index"""
+
+    def __init__(self, labeled_df: pd.DataFrame):
+        self.ids = pd.Index(labeled_df["id"])
+        self.codes = np.column_stack([encode_answers(labeled_df[q]) for q in QUESTIONS])
+        self.labeled_df = labeled_df.rename(
+            columns={q: f"{q}_labeled" for q in QUESTIONS}
+        ).reset_index(drop=True)
+
+    def lookup(self, ids: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (label row positions, prediction row positions) of every match
+
+        An ID labeled more than once matches each of its label rows, as in
+        the in-memory pd.merge.
+        """
+        if self.ids.is_unique:
+            positions = self.ids.get_indexer(ids)
+            rows = np.flatnonzero(positions >= 0)
+            return positions[rows], rows
+        # One entry per match, or a single -1 for an unlabeled ID, in ID order
+        positions, _ = self.ids.get_indexer_non_unique(ids)
+        matches = pd.Series(ids).map(self.ids.value_counts()).fillna(0).to_numpy()
+        rows = np.repeat(np.arange(len(ids)), np.maximum(matches, 1).astype(int))
+        found = positions >= 0
+        return positions[found], rows[found]
+
+
+def iter_prediction_chunks(
+    filepath: str, chunk_size: int, store_model: Optional[str] = None
+) -> Iterator[pd.DataFrame]:
+    """Read only the id and answer columns of a prediction file, chunk by chunk
+
+    `store_model` picks the model's answers out of a result store holding
+    several.
+    """
+    columns = ["id"] + QUESTIONS
+    if filepath.lower().endswith(RESULT_STORE_EXTENSIONS):
+        # Already one aggregated row per conversation
+        yield load_result_store(filepath, store_model)[columns]
+    elif filepath.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(filepath).iter_batches(
+            batch_size=chunk_size, columns=columns
+        ):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(
+            filepath, usecols=lambda c: c in columns, chunksize=chunk_size
+        )
+
+
+def stream_file(
+    filepath: str,
+    label_index: LabelIndex,
+    chunk_size: int,
+    merged_writer: Optional["MergedWriter"] = None,
+    store_model: Optional[str] = None,
+) -> np.ndarray:
+    """Confusion counts for one prediction file, updated chunk by chunk"""
+    counts = np.zeros((len(QUESTIONS), 3, 3), dtype=np.int64)
+    for chunk in iter_prediction_chunks(filepath, chunk_size, store_model):
+        positions, rows = label_index.lookup(chunk["id"])
+        if not len(positions):
+            continue
+        chunk = chunk.iloc[rows]
+        predictions = np.column_stack([encode_answers(chunk[q]) for q in QUESTIONS])
+        counts += confusion_counts(label_index.codes[positions], predictions)
+
+        if merged_writer is not None:
+            merged = label_index.labeled_df.iloc[positions].reset_index(drop=True)
+            for q in QUESTIONS:
+                merged[f"{q}_conv"] = chunk[q].to_numpy()
+            merged_writer.write(merged)
+    return counts
+
+
+class MergedWriter:
+    """Appends merged chunks to one CSV; safe to share between file workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._header = True
+
+    def write(self, merged: pd.DataFrame) -> None:
+        with self._lock:
+            merged.to_csv(
+                self.path,
+                mode="w" if self._header else "a",
+                header=self._header,
+                index=False,
+            )
+            self._header = False
+
+
+def stream_evaluate(
+    labeled_df: pd.DataFrame,
+    files: List[str],
+    chunk_size: int = 100_000,
+    workers: int = 1,
+    merged_path: Optional[str] = None,
+    store_model: Optional[str] = None,
+) -> np.ndarray:
+    """Score prediction files without holding them in memory.
+
+    Labels are indexed once; each file is read in chunks (files in parallel
+    with workers > 1) and only the running (questions, 3, 3) confusion counts
+    are kept, so memory stays flat as the corpus grows.
+    """
+    label_index = LabelIndex(labeled_df)
+    merged_writer = MergedWriter(merged_path) if merged_path else None
+    counts = np.zeros((len(QUESTIONS), 3, 3), dtype=np.int64)
+
+    def score(filepath: str) -> np.ndarray:
+        print(f"\nProcessing file: {filepath}")
+        try:
+            return stream_file(
+                filepath, label_index, chunk_size, merged_writer, store_model
+            )
+        except Exception as e:
+            print(f"Error processing file {filepath}: {str(e)}")
+            return np.zeros_like(counts)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for file_counts in executor.map(score, files):
+            counts += file_counts
+    return counts
+
+
+def compare_runs(labeled_df: pd.DataFrame, runs: Dict[str, str]) -> pd.DataFrame:
+    """Score several prediction sets and report accuracy next to average cost.
+
+    Runs with a `cost` column (cascade outputs) use its mean; single-model runs
+    cost one call per question to the model the run is named after, priced
+    like the cascade prices it (src/ml/model_costs.py).
+    """
+    rows = []
+    for name, pattern in runs.items():
+        try:
+            conv_df = load_predictions(pattern)
+        except FileNotFoundError as e:
+            print(f"Warning: {name}: {e}")
+            continue
+        merged_df = pd.merge(
+            labeled_df, conv_df, on="id", how="inner", suffixes=("_labeled", "_conv")
+        )
+        all_metrics, _, _ = analyze_questions(merged_df)
+
+        if "cost" in merged_df.columns:
+            avg_cost = merged_df["cost"].mean()
+        else:
+            avg_cost = 5 * model_cost(name)
+
+        def macro(metric: str) -> str:
+            values = [metrics[metric] for metrics in all_metrics.values()]
+            return f"{sum(values) / len(values):.2f}%"
+
+        rows.append(
+            {
+                "Run": name,
+                "Conversations": len(merged_df),
+                "Accuracy": macro("accuracy"),
+                "Macro_Recall": macro("recall"),
+                "Macro_F1": macro("f1"),
+                "Avg_Cost_Per_Conversation": round(avg_cost, 2),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def discover_model_runs(models_dir: str) -> Dict[str, str]:
+    """Map every sub-directory holding conversations_part_* files to its glob"""
+    runs = {}
+    for entry in sorted(os.listdir(models_dir)):
+        run_dir = os.path.join(models_dir, entry)
+        if not os.path.isdir(run_dir):
+            continue
+        for ext in ("csv", "parquet"):
+            pattern = os.path.join(run_dir, f"conversations_part_*.{ext}")
+            if glob.glob(pattern):
+                runs[entry] = pattern
+                break
+    return runs
+
+
+def pareto_frontier(f1: np.ndarray, seconds: np.ndarray) -> np.ndarray:
+    """Mask of runs no other run beats on both F1 (higher) and seconds (lower)"""
+    known = ~np.isnan(seconds)
+    frontier = np.zeros(len(f1), dtype=bool)
+    for i in np.flatnonzero(known):
+        dominated = (
+            known
+            & (f1 >= f1[i])
+            & (seconds <= seconds[i])
+            & ((f1 > f1[i]) | (seconds < seconds[i]))
+        )
+        frontier[i] = not dominated.any()
+    return frontier
+
+
+def model_comparison(
+    labeled_df: pd.DataFrame,
+    runs: Dict[str, str],
+    seconds_overrides: Optional[Dict[str, float]] = None,
+    recall_floor: Optional[float] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Score every run against one label index and place it on F1 vs seconds.
+
+    Seconds and tokens per conversation are the means of the recorded usage
+    columns; runs recorded before those existed can be given a value via
+    `seconds_overrides`, otherwise they are left off the frontier.
+    """
+    label_index = LabelIndex(labeled_df)
+    seconds_overrides = seconds_overrides or {}
+    per_question = []
+    summary = []
+
+    for name, pattern in runs.items():
+        try:
+            conv_df = load_predictions(pattern)
+        except FileNotFoundError as e:
+            print(f"Warning: {name}: {e}")
+            continue
+        positions, rows = label_index.lookup(conv_df["id"])
+        conv_df = conv_df.iloc[rows]
+        predictions = np.column_stack([encode_answers(conv_df[q]) for q in QUESTIONS])
+        counts = confusion_counts(label_index.codes[positions], predictions)
+        all_metrics, _, _ = metrics_from_counts(counts)
+
+        for q_label, metrics in all_metrics.items():
+            per_question.append(
+                {
+                    "Model": name,
+                    "Question": q_label,
+                    "Precision": round(metrics["precision"], 2),
+                    "Recall": round(metrics["recall"], 2),
+                    "F1": round(metrics["f1"], 2),
+                }
+            )
+
+        def mean_of(column: str) -> float:
+            if column not in conv_df.columns:
+                return np.nan
+            return float(pd.to_numeric(conv_df[column], errors="coerce").mean())
+
+        seconds = seconds_overrides.get(name, mean_of("latency_seconds"))
+        tokens = mean_of("prompt_tokens") + mean_of("eval_tokens")
+        summary.append(
+            {
+                "Model": name,
+                "Conversations": len(conv_df),
+                "Macro_Precision": np.mean(
+                    [m["precision"] for m in all_metrics.values()]
+                ),
+                "Macro_Recall": np.mean([m["recall"] for m in all_metrics.values()]),
+                "Macro_F1": np.mean([m["f1"] for m in all_metrics.values()]),
+                "Seconds_Per_Conversation": seconds,
+                "Tokens_Per_Conversation": tokens,
+            }
+        )
+
+    summary_df = pd.DataFrame(summary)
+    if summary_df.empty:
+        return pd.DataFrame(per_question), summary_df
+
+    summary_df["Pareto"] = pareto_frontier(
+        summary_df["Macro_F1"].to_numpy(),
+        summary_df["Seconds_Per_Conversation"].to_numpy(dtype=float),
+    )
+    if recall_floor is not None:
+        summary_df["Meets_Recall_Floor"] = summary_df["Macro_Recall"] >= recall_floor
+    summary_df = summary_df.sort_values("Seconds_Per_Conversation", na_position="last")
+    return pd.DataFrame(per_question), summary_df.round(2)
+
+
+def retrieval_recall_loss(
+    labeled_df: pd.DataFrame, full_df: pd.DataFrame, retrieval_df: pd.DataFrame
+) -> pd.DataFrame:
+    """Recall lost per question by answering from retrieved turns only.
+
+    Compares a run with --retrieval against a run on whole conversations,
+    over the conversations both answered. Lost positives are labeled YES
+    cases the full run found and the retrieval run missed; the full run's
+    misses that retrieval found count as recovered. Prompt tokens per
+    conversation are included when both runs recorded them.
+    """
+    label_index = LabelIndex(labeled_df)
+    paired = pd.merge(full_df, retrieval_df, on="id", suffixes=("_full", "_retrieval"))
+    positions, rows = label_index.lookup(paired["id"])
+    paired = paired.iloc[rows]
+    labels = label_index.codes[positions]
+    full = np.column_stack([encode_answers(paired[f"{q}_full"]) for q in QUESTIONS])
+    retrieval = np.column_stack(
+        [encode_answers(paired[f"{q}_retrieval"]) for q in QUESTIONS]
+    )
+
+    positive = labels == YES
+    full_hit = positive & (full == YES)
+    retrieval_hit = positive & (retrieval == YES)
+    positives = positive.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recall_full = np.where(positives > 0, full_hit.sum(axis=0) / positives, 0.0)
+        recall_retrieval = np.where(
+            positives > 0, retrieval_hit.sum(axis=0) / positives, 0.0
+        )
+
+    rows = []
+    for q_index, q_label in enumerate(QUESTIONS):
+        rows.append(
+            {
+                "Question": q_label,
+                "Conversations": len(paired),
+                "Positives": int(positives[q_index]),
+                "Recall_Full": round(recall_full[q_index] * 100, 2),
+                "Recall_Retrieval": round(recall_retrieval[q_index] * 100, 2),
+                "Recall_Loss": round(
+                    (recall_full[q_index] - recall_retrieval[q_index]) * 100, 2
+                ),
+                "Lost_Positives": int(
+                    (full_hit[:, q_index] & ~retrieval_hit[:, q_index]).sum()
+                ),
+                "Recovered_Positives": int(
+                    (retrieval_hit[:, q_index] & ~full_hit[:, q_index]).sum()
+                ),
+            }
+        )
+    loss_df = pd.DataFrame(rows)
+
+    if {"prompt_tokens_full", "prompt_tokens_retrieval"} <= set(paired.columns):
+        tokens = {
+            run: pd.to_numeric(paired[f"prompt_tokens_{run}"], errors="coerce").mean()
+            for run in ("full", "retrieval")
+        }
+        loss_df["Prompt_Tokens_Full"] = round(tokens["full"], 1)
+        loss_df["Prompt_Tokens_Retrieval"] = round(tokens["retrieval"], 1)
+    return loss_df
+
+
 def create_results_tables(
     all_metrics: Dict, yes_only_metrics: Dict, raw_counts: Dict
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -208,6 +848,91 @@ def create_results_tables(
     )
 
 
+def save_results_tables(
+    all_metrics: Dict, yes_only_metrics: Dict, raw_counts: Dict, output: str
+) -> None:
+    """Print the three results tables and save them next to `output`"""
+    # Create results tables
+    raw_df, all_cases_df, yes_only_df = create_results_tables(
+        all_metrics, yes_only_metrics, raw_counts
+    )
+
+    # Display results
+    print("\nRaw Counts:")
+    print("=" * 100)
+    print(raw_df.to_string(index=False))
+
+    print("\nAll Cases Metrics:")
+    print("=" * 100)
+    print(all_cases_df.to_string(index=False))
+
+    print("\nYes Only Metrics:")
+    print("=" * 100)
+    print(yes_only_df.to_string(index=False))
+
+    # Save results
+    raw_df.to_csv(output.replace(".csv", "_raw_counts.csv"), index=False)
+    all_cases_df.to_csv(output.replace(".csv", "_all_cases.csv"), index=False)
+    yes_only_df.to_csv(output.replace(".csv", "_yes_only.csv"), index=False)
+
+
+def report_models(labeled_df: pd.DataFrame, args: argparse.Namespace) -> None:
+    """Print and save the cross-model comparison and Pareto frontier"""
+    runs = discover_model_runs(args.models_dir)
+    if not runs:
+        print(f"Warning: No model directories found in {args.models_dir}")
+        return
+    seconds = {
+        name: float(value)
+        for name, value in (item.split("=", 1) for item in args.seconds)
+    }
+    per_question_df, summary_df = model_comparison(
+        labeled_df, runs, seconds, args.recall_floor
+    )
+
+    print("\nPer-Question Metrics by Model:")
+    print("=" * 100)
+    print(
+        per_question_df.pivot(
+            index="Question", columns="Model", values=["Recall", "F1"]
+        )
+        .round(2)
+        .to_string()
+    )
+
+    print("\nAccuracy vs Cost (sorted by seconds per conversation):")
+    print("=" * 100)
+    print(summary_df.to_string(index=False))
+
+    frontier = summary_df[summary_df["Pareto"]]
+    print(
+        f"\nPareto frontier (F1 vs seconds): {', '.join(frontier['Model']) or 'none'}"
+    )
+    if summary_df["Seconds_Per_Conversation"].isna().any():
+        missing = summary_df[summary_df["Seconds_Per_Conversation"].isna()]["Model"]
+        print(
+            f"No recorded latency for: {', '.join(missing)} (use --seconds NAME=SECONDS)"
+        )
+    if args.recall_floor is not None:
+        meets_floor = summary_df[summary_df["Meets_Recall_Floor"]]
+        eligible = meets_floor[meets_floor["Seconds_Per_Conversation"].notna()]
+        if meets_floor.empty:
+            print(f"No model meets the {args.recall_floor:g}% recall floor")
+        elif eligible.empty:
+            print(
+                f"Models meeting the {args.recall_floor:g}% recall floor but with "
+                f"no recorded latency: {', '.join(meets_floor['Model'])}"
+            )
+        else:
+            print(
+                f"Cheapest model meeting the {args.recall_floor:g}% recall floor: "
+                f"{eligible.iloc[0]['Model']}"
+            )
+
+    per_question_df.to_csv(args.output.replace(".csv", "_models.csv"), index=False)
+    summary_df.to_csv(args.output.replace(".csv", "_pareto.csv"), index=False)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Analyze conversation data against labeled data."
@@ -221,8 +946,84 @@ def main():
     parser.add_argument(
         "--conv-pattern",
         type=str,
-        required=True,
-        help='Pattern to match conversation files (e.g., "conversations_part_*.csv")',
+        help='Pattern to match conversation files (e.g., "conversations_part_*.csv"), or a SQLite result store (e.g., "results.sqlite")',
+    )
+    parser.add_argument(
+        "--store-model",
+        type=str,
+        help="Model whose verdicts to score when a result store holds several",
+    )
+    parser.add_argument(
+        "--compare",
+        action="append",
+        default=[],
+        metavar="NAME=PATTERN",
+        help='Score several runs side by side with their average cost (e.g., "llama_3.2_1b=evaluation/llama_3.2_1b/conversations_part_*.csv"); repeatable',
+    )
+    parser.add_argument(
+        "--models-dir",
+        type=str,
+        help="Score every model sub-directory (e.g. evaluation/) and report the F1 vs seconds Pareto frontier",
+    )
+    parser.add_argument(
+        "--seconds",
+        action="append",
+        default=[],
+        metavar="NAME=SECONDS",
+        help="Seconds per conversation for a run without recorded latency; repeatable",
+    )
+    parser.add_argument(
+        "--recall-floor",
+        type=float,
+        help="Minimum macro recall in percent when picking the cheapest model",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Report bootstrap confidence intervals from N resamples (default: off)",
+    )
+    parser.add_argument(
+        "--ci",
+        type=float,
+        default=95.0,
+        help="Confidence level for --bootstrap in percent (default: 95)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed for --bootstrap"
+    )
+    parser.add_argument(
+        "--paired-pattern",
+        type=str,
+        help="Second set of prediction files to compare against --conv-pattern on the same bootstrap resamples",
+    )
+    parser.add_argument(
+        "--retrieval-pattern",
+        type=str,
+        help="Predictions made with --retrieval; reports the recall they lose against --conv-pattern (whole conversations)",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Score prediction files chunk by chunk with constant memory",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100_000,
+        help="Rows per chunk in --streaming mode (default: 100000)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Prediction files read in parallel in --streaming mode (default: 1)",
+    )
+    parser.add_argument(
+        "--write-merged",
+        action="store_true",
+        help="In --streaming mode, also stream the merged rows to *_merged.csv",
     )
     parser.add_argument(
         "--output",
@@ -232,9 +1033,27 @@ def main():
     )
 
     args = parser.parse_args()
+    if not (args.conv_pattern or args.compare or args.models_dir):
+        parser.error("one of --conv-pattern, --compare or --models-dir is required")
 
     try:
         labeled_df = load_labeled_data(args.labeled_data)
+
+        if args.compare:
+            runs = dict(item.split("=", 1) for item in args.compare)
+            compare_df = compare_runs(labeled_df, runs)
+            print("\nAccuracy vs Cost:")
+            print("=" * 100)
+            print(compare_df.to_string(index=False))
+            compare_df.to_csv(args.output.replace(".csv", "_compare.csv"), index=False)
+            if not args.conv_pattern:
+                return
+
+        if args.models_dir:
+            report_models(labeled_df, args)
+            if not args.conv_pattern:
+                return
+
         all_merged_data = []
 
         print("\nProcessing Files:")
@@ -245,10 +1064,33 @@ def main():
             print(f"Warning: No files found matching pattern: {args.conv_pattern}")
             return
 
+        if args.streaming:
+            if args.bootstrap or args.paired_pattern or args.retrieval_pattern:
+                print(
+                    "Error: --bootstrap, --paired-pattern and --retrieval-pattern "
+                    "need the in-memory mode"
+                )
+                return
+            merged_path = (
+                args.output.replace(".csv", "_merged.csv")
+                if args.write_merged
+                else None
+            )
+            counts = stream_evaluate(
+                labeled_df,
+                sorted(conversation_files),
+                args.chunk_size,
+                args.workers,
+                merged_path,
+                args.store_model,
+            )
+            save_results_tables(*metrics_from_counts(counts), args.output)
+            return
+
         for file in conversation_files:
             print(f"\nProcessing file: {file}")
             try:
-                conv_df = load_conversation_file(file)
+                conv_df = load_conversation_file(file, args.store_model)
                 merged_df = pd.merge(
                     labeled_df,
                     conv_df,
@@ -264,34 +1106,68 @@ def main():
         if all_merged_data:
             combined_df = pd.concat(all_merged_data)
             all_metrics, yes_only_metrics, raw_counts = analyze_questions(combined_df)
+            save_results_tables(all_metrics, yes_only_metrics, raw_counts, args.output)
+            combined_df.to_csv(args.output.replace(".csv", "_merged.csv"), index=False)
 
-            # Create results tables
-            raw_df, all_cases_df, yes_only_df = create_results_tables(
-                all_metrics, yes_only_metrics, raw_counts
-            )
-
-            # Display results
-            print("\nRaw Counts:")
-            print("=" * 100)
-            print(raw_df.to_string(index=False))
-
-            print("\nAll Cases Metrics:")
-            print("=" * 100)
-            print(all_cases_df.to_string(index=False))
+            if args.bootstrap:
+                labels, predictions = encode_merged(combined_df)
+                ci_df = bootstrap_confidence_intervals(
+                    labels, predictions, args.bootstrap, args.ci, args.seed
+                )
+                print(f"\nBootstrap {args.ci:g}% Confidence Intervals:")
+                print("=" * 100)
+                print(ci_df.to_string(index=False))
+                ci_df.to_csv(args.output.replace(".csv", "_bootstrap.csv"), index=False)
 
-            print("\nYes Only Metrics:")
-            print("=" * 100)
-            print(yes_only_df.to_string(index=False))
+            if args.paired_pattern:
+                paired_df = pd.merge(
+                    combined_df,
+                    load_predictions(args.paired_pattern).rename(
+                        columns={q: f"{q}_paired" for q in QUESTIONS}
+                    ),
+                    on="id",
+                    how="inner",
+                )
+                labels, predictions_a = encode_merged(paired_df)
+                predictions_b = np.column_stack(
+                    [encode_answers(paired_df[f"{q}_paired"]) for q in QUESTIONS]
+                )
+                delta_df = paired_bootstrap(
+                    labels,
+                    predictions_a,
+                    predictions_b,
+                    args.bootstrap or 1000,
+                    args.ci,
+                    args.seed,
+                )
+                print(
+                    f"\nPaired Comparison (A = --conv-pattern, B = --paired-pattern, "
+                    f"{len(paired_df)} shared conversations):"
+                )
+                print("=" * 100)
+                print(delta_df.to_string(index=False))
+                delta_df.to_csv(args.output.replace(".csv", "_paired.csv"), index=False)
 
-            # Save results
-            raw_df.to_csv(args.output.replace(".csv", "_raw_counts.csv"), index=False)
-            all_cases_df.to_csv(
-                args.output.replace(".csv", "_all_cases.csv"), index=False
-            )
-            yes_only_df.to_csv(
-                args.output.replace(".csv", "_yes_only.csv"), index=False
-            )
-            combined_df.to_csv(args.output.replace(".csv", "_merged.csv"), index=False)
+            if args.retrieval_pattern:
+                loss_df = retrieval_recall_loss(
+                    labeled_df,
+                    pd.concat(
+                        [
+                            load_conversation_file(f, args.store_model)
+                            for f in conversation_files
+                        ]
+                    ),
+                    load_predictions(args.retrieval_pattern),
+                )
+                print(
+                    "\nRetrieval Recall Loss (full = --conv-pattern, "
+                    "retrieval = --retrieval-pattern):"
+                )
+                print("=" * 100)
+                print(loss_df.to_string(index=False))
+                loss_df.to_csv(
+                    args.output.replace(".csv", "_retrieval.csv"), index=False
+                )
 
             print(f"\nResults have been saved to separate CSV files")
 
@@ -1,13 +1,4 @@
 model=gemma2
 out_dir=evaluation_new_prompts_gemma2
 in_dir=./src/data_processing/cornell_movie_dialogs/split_conversations
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_001.json --output_file $out_dir/conversations_part_001.csv --model=$model  
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_002.json --output_file $out_dir/conversations_part_002.csv --model=$model
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_003.json --output_file $out_dir/conversations_part_003.csv --model=$model  
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_004.json --output_file $out_dir/conversations_part_004.csv --model=$model 
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_005.json --output_file $out_dir/conversations_part_005.csv --model=$model 
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_006.json --output_file $out_dir/conversations_part_006.csv --model=$model 
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_007.json --output_file $out_dir/conversations_part_007.csv --model=$model 
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_008.json --output_file $out_dir/conversations_part_008.csv --model=$model
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_009.json --output_file $out_dir/conversations_part_009.csv --model=$model
-python3 -m src.client.cmd_client --input_file $in_dir/conversations_part_010.json --output_file $out_dir/conversations_part_010.csv --model=$model
\ No newline at end of file
+python3 -m src.client.batch_client --input_glob "$in_dir/conversations_part_00[1-9].json" "$in_dir/conversations_part_010.json" --output_dir $out_dir --model=$model --max_concurrency 16 --resume
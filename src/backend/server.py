@@ -1,10 +1,14 @@
+import argparse
+import csv
 import json
 import logging
 import os
 import tempfile
+import time
 from typing import List, Optional, TypedDict
 
 import pandas as pd
+from flask import jsonify
 from flask_ml.flask_ml_server import MLServer, load_file_as_string
 from flask_ml.flask_ml_server.models import (BatchFileInput, BatchFileResponse,
                                              FileResponse, FileType,
@@ -14,8 +18,16 @@ from flask_ml.flask_ml_server.models import (BatchFileInput, BatchFileResponse,
                                              TextParameterDescriptor)
 from pydantic import BaseModel
 
+from ..client.columnar import (RESULT_FIELDNAMES, ParquetResultWriter,
+                               csv_result_row, make_result_row)
+from ..ml.bulk import analyze_conversations, iter_conversations
+from ..ml.llm_client import default_client, track_usage
 from ..ml.model import LlamaModel
-from ..ml.prompt_ollama import get_all_answers  # Changed to prompt_ollama1
+from ..ml.prompt_ollama import PROMPT_REGISTRY, get_all_answers  # Changed to prompt_ollama1
+from ..ml.result_store import ResultStore, get_stored_results
+from ..ml.retrieval import create_retriever
+from ..ml.scheduler import request_context
+from ..ml.speculation import SPECULATION_STATS, likely_positive
 
 
 # Pydantic models for response structure
@@ -54,6 +66,17 @@ OUTPUT_DIR = os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "folder", "output"
 )
 
+# Compact conversations before prompting (see ml/compaction.py); set by --compact
+COMPACT_CONVERSATIONS = False
+# Few-shot examples in the question prompts (see ml/prompt_registry.py); set by --prompt_variant
+PROMPT_VARIANT = "full"
+# Narrow long conversations per question (see ml/retrieval.py); set by --retrieval
+RETRIEVER = None
+# Record verdicts and reuse them for files analyzed before (see ml/result_store.py); set by --result_store
+RESULT_STORE = None
+# Request evidence of likely positive questions with their YES/NO answer (see ml/speculation.py); set by --speculative
+SPECULATIVE = False
+
 def get_analyzer_task_schema():
     return TaskSchema(
         inputs=[
@@ -67,6 +90,63 @@ def get_analyzer_task_schema():
         parameters=[],
     )
 
+EMOJI_MAP = {
+    "Q1": "🟡",  # Age given
+    "Q2": "🟠",  # Age asked
+    "Q3": "🟢",  # Meet up
+    "Q4": "🔵",  # Gift/Purchase
+    "Q5": "🟣",  # Media
+}
+
+QUESTIONS_MAP = {
+    "Q1": "Has any person given their age? (and what age was given)",
+    "Q2": "Has any person asked the other for their age?",
+    "Q3": "Has any person asked to meet up in person? Where?",
+    "Q4": "Has any person given a gift to the other?",
+    "Q5": "Have any videos or photos been produced? Requested?",
+}
+
+def render_markdown(file_name: str, df: pd.DataFrame, results: dict) -> str:
+    """Render the summary table and the annotated conversation for one file"""
+    # Create markdown content
+    markdown_content = f"""## Analysis Results for {file_name}
+
+| Question | Answer | Evidence |
+|----------|---------|----------|
+"""
+    for qid, result_data in results.items():
+        question = QUESTIONS_MAP[qid]
+        emoji = EMOJI_MAP.get(qid, "")
+        answer = result_data["answer"]
+        evidence = result_data["evidence"]
+        markdown_content += f"| {emoji} {question} | {answer} | {evidence} |\n"
+
+    markdown_content += "\n### Full Conversation\n"
+    markdown_content += "| Time | Speaker | Message | Matches |\n"
+    markdown_content += "|------|---------|---------|----------|\n"
+
+    # Evidence lines per YES question, as sets so each row is a constant-time check
+    yes_lines = {
+        qid: set(result_data.get("evidence_lines", []))
+        for qid, result_data in results.items()
+        if result_data["answer"] == "YES"
+    }
+
+    # Add each message with any matches
+    for idx, row in df.iterrows():
+        matches = []
+        message_text = row["Message"]
+
+        # Check each question's evidence lines for matches
+        for qid, lines in yes_lines.items():
+            if idx in lines:
+                matches.append(EMOJI_MAP[qid])
+
+        match_indicators = " ".join(matches) if matches else ""
+        markdown_content += f"| {row['Timestamp']} | {row['Speaker']} | {message_text} | {match_indicators} |\n"
+
+    return markdown_content
+
 @server.route(
     "/analyzer",
     order=0,
@@ -93,13 +173,40 @@ def analyzer(inputs: AnalyzerInputs, parameters: AnalyzerParameters) -> Response
 
                 # Format conversation for prompt_ollama
                 conversation = {
+                    "conversation_id": file_input.path,
                     "turns": [
                         {"speaker": row["Speaker"], "text": row["Message"]}
                         for _, row in df.iterrows()
                     ]
                 }
                 
-                results, evidence_matches = get_all_answers(conversation, "llama3.1")
+                # Uploads are served ahead of batch runs sharing the backend,
+                # and fairly against each other
+                with request_context("interactive", flow=file_input.path), track_usage() as usage:
+                    if RESULT_STORE is not None:
+                        results = get_stored_results(
+                            conversation,
+                            "llama3.1",
+                            RESULT_STORE,
+                            compact=COMPACT_CONVERSATIONS,
+                            prompt_variant=PROMPT_VARIANT,
+                            retriever=RETRIEVER,
+                            speculative=SPECULATIVE,
+                        )
+                    else:
+                        results, evidence_matches = get_all_answers(
+                            conversation,
+                            "llama3.1",
+                            compact=COMPACT_CONVERSATIONS,
+                            prompt_variant=PROMPT_VARIANT,
+                            retriever=RETRIEVER,
+                            speculate=likely_positive(conversation) if SPECULATIVE else None,
+                        )
+                if COMPACT_CONVERSATIONS:
+                    logging.info(
+                        f"Compacted {os.path.basename(file_input.path)}: "
+                        f"{usage.conversation_tokens} -> {usage.compacted_tokens} tokens"
+                    )
                 
                 # Add debug printing
                 print("\nDEBUG - Raw results structure:", results)
@@ -108,51 +215,9 @@ def analyzer(inputs: AnalyzerInputs, parameters: AnalyzerParameters) -> Response
                         f"Processing{qid}: answer={result_data['answer']}, Evidence: {result_data['evidence']}"
                     )
 
-                # Create markdown content
-                markdown_content = f"""## Analysis Results for {os.path.basename(file_input.path)}
-
-| Question | Answer | Evidence |
-|----------|---------|----------|
-"""
-                emoji_map = {
-                    "Q1": "🟡",  # Age given
-                    "Q2": "🟠",  # Age asked
-                    "Q3": "🟢",  # Meet up
-                    "Q4": "🔵",  # Gift/Purchase
-                    "Q5": "🟣",  # Media
-                }
-                questions_map = {
-                    "Q1": "Has any person given their age? (and what age was given)",
-                    "Q2": "Has any person asked the other for their age?",
-                    "Q3": "Has any person asked to meet up in person? Where?",
-                    "Q4": "Has any person given a gift to the other?",
-                    "Q5": "Have any videos or photos been produced? Requested?",
-                }
-
-                for qid, result_data in results.items():
-                    question = questions_map[qid]
-                    emoji = emoji_map.get(qid, "")
-                    answer = result_data["answer"]
-                    evidence = result_data["evidence"]
-                    markdown_content += f"| {emoji} {question} | {answer} | {evidence} |\n"
-
-                markdown_content += "\n### Full Conversation\n"
-                markdown_content += "| Time | Speaker | Message | Matches |\n"
-                markdown_content += "|------|---------|---------|----------|\n"
-
-                # Add each message with any matches
-                for idx, row in df.iterrows():
-                    matches = []
-                    message_text = row["Message"]
-                    
-                    # Check each question's evidence lines for matches
-                    for qid, result_data in results.items():
-                        if result_data["answer"] == "YES":
-                            if idx in result_data.get("evidence_lines", []):
-                                matches.append(emoji_map[qid])
-
-                    match_indicators = " ".join(matches) if matches else ""
-                    markdown_content += f"| {row['Timestamp']} | {row['Speaker']} | {message_text} | {match_indicators} |\n"
+                markdown_content = render_markdown(
+                    os.path.basename(file_input.path), df, results
+                )
 
                 all_results.append(markdown_content)
 
@@ -188,6 +253,185 @@ Error: {str(e)}
             )
         )
 
+def get_bulk_task_schema():
+    return TaskSchema(
+        inputs=[
+            InputSchema(
+                key="inputs",
+                label="Conversation Files (JSON or JSON lines)",
+                inputType=InputType.BATCHFILE,
+                file_types=[FileType.JSON, FileType.TEXT],
+            )
+        ],
+        parameters=[],
+    )
+
+# Conversations listed per file in the bulk summary; all of them are in the results CSV
+FLAGGED_SHOWN = 50
+
+def analyze_bulk_file(path: str, writers: list) -> dict:
+    """Analyze every conversation in one JSON/JSONL file, writing result rows as they finish"""
+    name = os.path.basename(path)
+    summary = {
+        "file": name,
+        "conversations": 0,
+        "failed": 0,
+        "yes": {qid: 0 for qid in QUESTIONS_MAP},
+        "flagged": [],
+        "error": None,
+    }
+
+    def numbered(conversations):
+        for index, conversation in enumerate(conversations):
+            conversation.setdefault("conversation_id", f"{name}-{index}")
+            yield conversation
+
+    start = time.perf_counter()
+    # A bulk upload is a batch job: single-file uploads stay ahead of it
+    with request_context("batch", flow=path), track_usage() as usage:
+        try:
+            for outcome in analyze_conversations(
+                numbered(iter_conversations(path)),
+                "llama3.1",
+                workers=default_client.max_concurrency,
+                compact=COMPACT_CONVERSATIONS,
+                prompt_variant=PROMPT_VARIANT,
+                retriever=RETRIEVER,
+                result_store=RESULT_STORE,
+                speculative=SPECULATIVE,
+            ):
+                conversation_id = outcome["conversation"]["conversation_id"]
+                if outcome["error"] is not None:
+                    logging.error(f"Error analyzing conversation {conversation_id} in {name}: {outcome['error']}")
+                    summary["failed"] += 1
+                    continue
+                summary["conversations"] += 1
+                row = make_result_row(
+                    conversation_id,
+                    "llama3.1",
+                    outcome["results"],
+                    round(outcome["latency_seconds"], 3),
+                    outcome["usage"],
+                )
+                for writer in writers:
+                    writer.write(row)
+                answers = [qid for qid in QUESTIONS_MAP if row[qid]]
+                for qid in answers:
+                    summary["yes"][qid] += 1
+                if answers:
+                    summary["flagged"].append((conversation_id, answers))
+        except ValueError as e:
+            # Malformed JSON: keep what was analyzed before it
+            summary["error"] = str(e)
+    summary["elapsed_seconds"] = time.perf_counter() - start
+    summary["llm_calls"] = usage.calls
+    summary["prompt_tokens"] = usage.prompt_tokens
+    return summary
+
+def render_bulk_summary(summaries: list, results_paths: list) -> str:
+    """Summary markdown: YES counts per question and the flagged conversations of each file"""
+    markdown_content = "## Bulk Analysis Summary\n\n"
+    markdown_content += "| File | Conversations | Failed | " + " | ".join(f"{EMOJI_MAP[qid]} {qid}" for qid in QUESTIONS_MAP) + " | Seconds | Conversations/sec |\n"
+    markdown_content += "|------|---------------|--------|" + "----|" * len(QUESTIONS_MAP) + "---------|-------------------|\n"
+    for summary in summaries:
+        elapsed = summary["elapsed_seconds"]
+        rate = summary["conversations"] / elapsed if elapsed > 0 else 0
+        yes_counts = " | ".join(str(summary["yes"][qid]) for qid in QUESTIONS_MAP)
+        markdown_content += f"| {summary['file']} | {summary['conversations']} | {summary['failed']} | {yes_counts} | {elapsed:.1f} | {rate:.2f} |\n"
+
+    markdown_content += "\n" + "\n".join(f"* {EMOJI_MAP[qid]} {qid}: {question}" for qid, question in QUESTIONS_MAP.items()) + "\n"
+
+    for summary in summaries:
+        if summary["error"]:
+            markdown_content += f"\n**{summary['file']}** stopped at malformed JSON: {summary['error']}\n"
+        if summary["flagged"]:
+            markdown_content += f"\n### Flagged in {summary['file']} ({len(summary['flagged'])})\n"
+            markdown_content += "| Conversation | Matches |\n|--------------|---------|\n"
+            for conversation_id, answers in summary["flagged"][:FLAGGED_SHOWN]:
+                markdown_content += f"| {conversation_id} | {' '.join(EMOJI_MAP[qid] for qid in answers)} |\n"
+            if len(summary["flagged"]) > FLAGGED_SHOWN:
+                markdown_content += f"\n{len(summary['flagged']) - FLAGGED_SHOWN} more in the results file.\n"
+
+    markdown_content += "\nEvery verdict with its evidence: " + ", ".join(f"`{path}`" for path in results_paths) + "\n"
+    return markdown_content
+
+class CSVRowWriter:
+    """Writes result rows to the bulk results CSV"""
+
+    def __init__(self, csv_file):
+        self._writer = csv.DictWriter(csv_file, fieldnames=RESULT_FIELDNAMES, lineterminator="\n")
+        self._writer.writeheader()
+
+    def write(self, row: dict) -> None:
+        self._writer.writerow(csv_result_row(row))
+
+@server.route(
+    "/bulk_analyzer",
+    order=1,
+    short_title="Analyze Conversation Files",
+    task_schema_func=get_bulk_task_schema,
+)
+def bulk_analyzer(inputs: AnalyzerInputs, parameters: AnalyzerParameters) -> ResponseBody:
+    """Many conversations per file, in the JSON format the CLI reads or as JSON lines"""
+    try:
+        input_files = inputs.get("inputs")
+        if not input_files or not input_files.files:
+            return ResponseBody(
+                root=MarkdownResponse(
+                    title="Analysis Failed", value="No input files provided"
+                )
+            )
+
+        output_dir = os.path.join(OUTPUT_DIR, time.strftime("bulk-%Y%m%d-%H%M%S"))
+        os.makedirs(output_dir, exist_ok=True)
+        csv_path = os.path.join(output_dir, "results.csv")
+        parquet_path = os.path.join(output_dir, "results.parquet")
+        summary_path = os.path.join(output_dir, "summary.md")
+
+        summaries = []
+        with open(csv_path, "w", newline="", encoding="utf-8") as csv_file, ParquetResultWriter(parquet_path) as parquet_writer:
+            writers = [CSVRowWriter(csv_file), parquet_writer]
+            for file_input in input_files.files:
+                summaries.append(analyze_bulk_file(file_input.path, writers))
+                logging.info(
+                    f"Bulk analyzed {file_input.path}: {summaries[-1]['conversations']} conversations "
+                    f"in {summaries[-1]['elapsed_seconds']:.1f}s"
+                )
+
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(render_bulk_summary(summaries, [csv_path, parquet_path]))
+
+        return ResponseBody(
+            root=BatchFileResponse(
+                files=[
+                    FileResponse(file_type=FileType.MARKDOWN, path=summary_path, title="Bulk Analysis Summary"),
+                    FileResponse(file_type=FileType.CSV, path=csv_path, title="Results"),
+                ]
+            )
+        )
+
+    except Exception as e:
+        print(f"Global error in bulk analyzer: {str(e)}")
+        return ResponseBody(
+            root=MarkdownResponse(
+                title="Analysis Failed", value=f"Error during analysis: {str(e)}"
+            )
+        )
+
+@server.app.route("/metrics", methods=["GET"])
+def metrics():
+    """LLM usage, in-flight limit, queue depth, prompt prefill savings and speculative evidence"""
+    return jsonify(
+        {
+            "usage": default_client.stats.snapshot(),
+            **default_client.concurrency_metrics(),
+            "prefill": PROMPT_REGISTRY.totals(),
+            "prompts": PROMPT_REGISTRY.report(),
+            "retrieval": RETRIEVER.stats() if RETRIEVER else None,
+            "speculation": SPECULATION_STATS.snapshot(),
+        }
+    )
+
 # Add metadata about the app
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_info_path = os.path.join(current_dir, "app-info.md")
@@ -200,4 +444,43 @@ server.add_app_metadata(
 )
 
 if __name__ == "__main__":
-    server.run()
+    parser = argparse.ArgumentParser(description="Run the Message Analyzer server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compact conversations (speaker aliases, duplicate and noise removal) before prompting",
+    )
+    parser.add_argument(
+        "--prompt_variant",
+        choices=["full", "compact"],
+        default="full",
+        help="Question prompts with all few-shot examples, or the compact ones with two",
+    )
+    parser.add_argument(
+        "--retrieval",
+        type=str,
+        default=None,
+        metavar="EMBED_MODEL",
+        help='Send each question only the turns most similar to it, embedded with this Ollama model (or "hashing" for a local stand-in)',
+    )
+    parser.add_argument(
+        "--result_store",
+        type=str,
+        default=None,
+        help="Record every verdict in this SQLite database, and answer files analyzed before without the LLM",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Request the evidence of likely positive questions together with their YES/NO answer, saving a round trip on positives",
+    )
+    args = parser.parse_args()
+    COMPACT_CONVERSATIONS = args.compact
+    PROMPT_VARIANT = args.prompt_variant
+    RETRIEVER = create_retriever(args.retrieval, default_client)
+    SPECULATIVE = args.speculative
+    # Committed after every file, so reports see uploads right away
+    RESULT_STORE = ResultStore(args.result_store, batch_size=1) if args.result_store else None
+    server.run(host=args.host, port=args.port)
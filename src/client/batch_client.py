@@ -0,0 +1,516 @@
+"""
+python3 -m src.client.batch_client --input_glob "./src/data_processing/cornell_movie_dialogs/split_conversations/conversations_part_0*.json" --output_dir evaluation_new --model=llama3.1
+"""
+
+import argparse
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from ..ml.concurrency import MODEL_SWITCH_WAIT
+from ..ml.incremental import OVERLAP_TURNS, StateStore, get_incremental_answers
+from ..ml.llm_client import LLMClient, create_client
+from ..ml.prompt_ollama import (
+    CASCADE_FIELDNAMES,
+    PROMPT_REGISTRY,
+    get_cascade_answers,
+    get_yes_no_answers,
+    make_cascade_policies,
+)
+from ..ml.result_store import ResultStore, get_stored_answers
+from ..ml.retrieval import DEFAULT_TOP_K, TurnRetriever, create_retriever
+from ..ml.scheduler import request_context
+from ..ml.speculation import SPECULATION_STATS
+from .checkpoint import (
+    FIELDNAMES,
+    USAGE_FIELDNAMES,
+    CheckpointWriter,
+    answer_with_usage,
+    load_completed_ids,
+)
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+class Shard:
+    """One input part file and its checkpointed CSV output."""
+
+    def __init__(
+        self,
+        input_file: str,
+        output_file: str,
+        resume: bool,
+        fsync_every: int,
+        fieldnames: List[str] = FIELDNAMES,
+    ):
+        self.input_file = input_file
+        self.output_file = output_file
+
+        with open(input_file) as f:
+            conversations = json.load(f)
+
+        completed_ids = (
+            load_completed_ids(self.output_file, fieldnames) if resume else set()
+        )
+        self.pending = [
+            conv
+            for conv in conversations
+            if conv["conversation_id"] not in completed_ids
+        ]
+        self.skipped = len(conversations) - len(self.pending)
+        self.remaining = len(self.pending)
+        self.failed = 0
+
+        self._lock = threading.Lock()
+        self._writer = CheckpointWriter(
+            self.output_file,
+            fieldnames + USAGE_FIELDNAMES,
+            resume=resume,
+            fsync_every=fsync_every,
+        )
+
+    def record(self, row: Dict) -> bool:
+        """Write a finished row; return True once the whole shard is done."""
+        with self._lock:
+            if row is not None:
+                self._writer.write(row)
+            else:
+                self.failed += 1
+            self.remaining -= 1
+            if self.remaining == 0:
+                self._writer.close()
+                return True
+            return False
+
+    def close(self) -> None:
+        with self._lock:
+            self._writer.close()
+
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    files = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if path not in files:
+                files.append(path)
+    return files
+
+
+def output_paths(input_files: List[str], output_dir: str) -> Dict[str, str]:
+    """
+    The CSV output of each input: its full file name plus .csv, in the same
+    sub-directory of `output_dir` as the input is of the inputs' common
+    directory. a/part1.json, b/part1.json and a/part1.jsonl all get their
+    own output.
+    """
+    if not input_files:
+        return {}
+    paths = [os.path.abspath(path) for path in input_files]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return {
+        input_file: os.path.join(output_dir, os.path.relpath(path, root) + ".csv")
+        for input_file, path in zip(input_files, paths)
+    }
+
+
+def analyze(conversation: Dict, answer_fn: Callable[[Dict], Dict]) -> Optional[Dict]:
+    try:
+        return answer_with_usage(answer_fn, conversation)
+    except Exception as e:
+        logging.error(
+            f"Error analyzing conversation {conversation['conversation_id']}: {e}"
+        )
+        return None
+
+
+def run(
+    input_files: List[str],
+    output_dir: str,
+    model: str,
+    client: LLMClient,
+    resume: bool = False,
+    fsync_every: int = 10,
+    cascade_policies: Optional[Dict] = None,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever: Optional[TurnRetriever] = None,
+    state_store: Optional[StateStore] = None,
+    overlap: int = OVERLAP_TURNS,
+    reverify: bool = False,
+    result_store: Optional[ResultStore] = None,
+    speculative: bool = False,
+) -> Dict:
+    if cascade_policies:
+        fieldnames = CASCADE_FIELDNAMES
+        answer_fn = partial(
+            get_cascade_answers,
+            policies=cascade_policies,
+            client=client,
+            compact=compact,
+            prompt_variant=prompt_variant,
+            retriever=retriever,
+        )
+    elif state_store is not None:
+        fieldnames = FIELDNAMES
+        answer_fn = partial(
+            get_incremental_answers,
+            model=model,
+            store=state_store,
+            client=client,
+            overlap=overlap,
+            reverify=reverify,
+            compact=compact,
+            prompt_variant=prompt_variant,
+            retriever=retriever,
+            speculative=speculative,
+        )
+    elif result_store is not None:
+        fieldnames = FIELDNAMES
+        answer_fn = partial(
+            get_stored_answers,
+            model=model,
+            store=result_store,
+            client=client,
+            compact=compact,
+            prompt_variant=prompt_variant,
+            retriever=retriever,
+            speculative=speculative,
+        )
+    else:
+        fieldnames = FIELDNAMES
+        answer_fn = partial(
+            get_yes_no_answers,
+            model=model,
+            client=client,
+            compact=compact,
+            prompt_variant=prompt_variant,
+            retriever=retriever,
+        )
+        # Prefix token counts for this model, to report the prefill the cache saves
+        PROMPT_REGISTRY.try_measure(model, client, prompt_variant)
+
+    outputs = output_paths(input_files, output_dir)
+    shards = [
+        Shard(path, outputs[path], resume, fsync_every, fieldnames)
+        for path in input_files
+    ]
+    total = sum(len(shard.pending) for shard in shards)
+    logging.info(
+        f"{len(shards)} shards, {total} conversations to analyze, "
+        f"{sum(shard.skipped for shard in shards)} already done"
+    )
+
+    start = time.perf_counter()
+    completed = 0
+    failed = 0
+    conversation_tokens = 0
+    compacted_tokens = 0
+    # Incremental mode: turns in the conversations, and those analyzed this run
+    total_turns = 0
+    new_turns = 0
+    try:
+        # One worker per in-flight slot keeps the backend busy while rows are
+        # written, and the client's limit caps requests across all shards.
+        with ThreadPoolExecutor(max_workers=client.max_concurrency) as executor:
+            futures = {}
+            for shard in shards:
+                if not shard.pending:
+                    shard.close()
+                    logging.info(f"Shard already complete: {shard.output_file}")
+                for conv in shard.pending:
+                    # Workers keep the caller's priority and flow for scheduling
+                    ctx = contextvars.copy_context()
+                    futures[executor.submit(ctx.run, analyze, conv, answer_fn)] = shard
+
+            for future in as_completed(futures):
+                shard = futures[future]
+                row = future.result()
+                if row is None:
+                    failed += 1
+                else:
+                    completed += 1
+                    conversation_tokens += row["conversation_tokens"]
+                    compacted_tokens += row["compacted_tokens"]
+                    total_turns += row.get("total_turns", 0)
+                    new_turns += row.get("new_turns", 0)
+                if shard.record(row):
+                    logging.info(f"Finished shard {shard.output_file}")
+    finally:
+        for shard in shards:
+            shard.close()
+
+    elapsed = time.perf_counter() - start
+    stats = client.stats.snapshot()
+    tokens = stats["prompt_tokens"] + stats["eval_tokens"]
+    return {
+        "shards": len(shards),
+        "conversations": completed,
+        "failed": failed,
+        "elapsed_seconds": elapsed,
+        "conversations_per_second": completed / elapsed if elapsed > 0 else 0,
+        "tokens_per_second": tokens / elapsed if elapsed > 0 else 0,
+        "conversation_tokens": conversation_tokens,
+        "compacted_tokens": compacted_tokens,
+        "total_turns": total_turns,
+        "new_turns": new_turns,
+        "prefill": PROMPT_REGISTRY.totals(),
+        "retrieval": retriever.stats() if retriever else None,
+        "speculation": SPECULATION_STATS.snapshot(),
+        **stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyze many conversation part files in one process."
+    )
+    parser.add_argument(
+        "--input_glob",
+        nargs="+",
+        required=True,
+        help='One or more glob patterns of input JSON files (e.g., "conversations_part_*.json")',
+    )
+    parser.add_argument("--output_dir", required=True)
+    parser.add_argument("--model", default="llama3.1")
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=16,
+        help="Upper bound on LLM requests in flight across all shards; the adaptive limit stays at or below it (default: 16)",
+    )
+    parser.add_argument(
+        "--fixed_concurrency",
+        action="store_true",
+        help="Always keep --max_concurrency requests in flight instead of adapting to latency and errors",
+    )
+    parser.add_argument(
+        "--model_switch_wait",
+        type=float,
+        default=MODEL_SWITCH_WAIT,
+        help=f"Seconds queued requests for another model wait while the current model's queue drains; 0 serves in arrival order (default: {MODEL_SWITCH_WAIT:g})",
+    )
+    parser.add_argument(
+        "--hosts",
+        type=str,
+        default=None,
+        help="Comma separated Ollama hosts to load-balance across (default: OLLAMA_HOST)",
+    )
+    parser.add_argument(
+        "--cascade_models",
+        type=str,
+        default=None,
+        help="Comma separated models, cheapest first; enables cascade mode",
+    )
+    parser.add_argument(
+        "--cascade_policy",
+        type=str,
+        default=None,
+        help="JSON file with per-question cascade overrides",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compact conversations (speaker aliases, duplicate and noise removal) before prompting",
+    )
+    parser.add_argument(
+        "--prompt_variant",
+        choices=["full", "compact"],
+        default="full",
+        help="Question prompts with all few-shot examples, or the compact ones with two (default: full)",
+    )
+    parser.add_argument(
+        "--broker",
+        type=str,
+        default=os.environ.get("OLLAMA_BROKER"),
+        help="URL of a local LLM broker to send requests through (default: OLLAMA_BROKER)",
+    )
+    parser.add_argument(
+        "--job_name",
+        type=str,
+        default=f"batch-{os.getpid()}",
+        help="Flow name this run is scheduled under, fairly against other batch jobs",
+    )
+    parser.add_argument(
+        "--job_weight",
+        type=float,
+        default=1.0,
+        help="Share of batch capacity relative to other jobs (default: 1.0)",
+    )
+    parser.add_argument(
+        "--retrieval",
+        type=str,
+        default=None,
+        metavar="EMBED_MODEL",
+        help='Send each question only the turns most similar to it, embedded with this Ollama model (e.g. nomic-embed-text, or "hashing" for a local stand-in)',
+    )
+    parser.add_argument(
+        "--retrieval_top_k",
+        type=int,
+        default=DEFAULT_TOP_K,
+        help=f"Turns kept per question with --retrieval, plus their neighbours (default: {DEFAULT_TOP_K})",
+    )
+    parser.add_argument(
+        "--state_file",
+        type=str,
+        default=None,
+        help="Incremental mode: keep each conversation's verdicts in this JSON lines file and only analyze turns added since the last run",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=OVERLAP_TURNS,
+        help=f"Already analyzed turns sent before the new ones with --state_file (default: {OVERLAP_TURNS})",
+    )
+    parser.add_argument(
+        "--reverify",
+        action="store_true",
+        help="With --state_file, ask YES questions again about their evidence and the new turns",
+    )
+    parser.add_argument(
+        "--result_store",
+        type=str,
+        default=None,
+        help="Also record every verdict in this SQLite database, and answer conversations already in it without the LLM",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="With --state_file or --result_store, request the evidence of likely positive questions together with their YES/NO answer",
+    )
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--fsync_every", type=int, default=10)
+    args = parser.parse_args()
+    if args.state_file and args.cascade_models:
+        parser.error("--state_file does not support --cascade_models")
+    if args.result_store and (args.state_file or args.cascade_models):
+        parser.error("--result_store does not support --state_file or --cascade_models")
+
+    input_files = expand_inputs(args.input_glob)
+    if not input_files:
+        logging.error(f"No input files matched: {args.input_glob}")
+        return
+
+    cascade_policies = None
+    if args.cascade_models:
+        overrides = {}
+        if args.cascade_policy:
+            with open(args.cascade_policy) as f:
+                overrides = json.load(f)
+        cascade_policies = make_cascade_policies(
+            args.cascade_models.split(","), overrides
+        )
+
+    client = create_client(
+        args.hosts,
+        max_concurrency=args.max_concurrency,
+        adaptive=not args.fixed_concurrency,
+        broker=args.broker,
+        model_switch_wait=args.model_switch_wait,
+    )
+    state_store = StateStore(args.state_file) if args.state_file else None
+    result_store = ResultStore(args.result_store) if args.result_store else None
+    try:
+        with request_context("batch", args.job_name, args.job_weight):
+            summary = run(
+                input_files,
+                args.output_dir,
+                args.model,
+                client,
+                resume=args.resume,
+                fsync_every=args.fsync_every,
+                cascade_policies=cascade_policies,
+                compact=args.compact,
+                prompt_variant=args.prompt_variant,
+                retriever=create_retriever(
+                    args.retrieval, client, args.retrieval_top_k
+                ),
+                state_store=state_store,
+                overlap=args.overlap,
+                reverify=args.reverify,
+                result_store=result_store,
+                speculative=args.speculative,
+            )
+    finally:
+        if state_store is not None:
+            state_store.close()
+        if result_store is not None:
+            result_store.close()
+
+    print("\nBatch Summary:")
+    print("=" * 80)
+    print(f"Shards:            {summary['shards']}")
+    print(f"Conversations:     {summary['conversations']} ({summary['failed']} failed)")
+    print(f"Elapsed:           {summary['elapsed_seconds']:.1f}s")
+    print(
+        f"Throughput:        {summary['conversations_per_second']:.2f} conversations/sec"
+    )
+    print(f"Token throughput:  {summary['tokens_per_second']:.1f} tokens/sec")
+    if args.compact and summary["conversation_tokens"]:
+        saved = summary["conversation_tokens"] - summary["compacted_tokens"]
+        print(
+            f"Compaction:        {summary['conversation_tokens']} -> "
+            f"{summary['compacted_tokens']} conversation tokens "
+            f"({saved / summary['conversation_tokens']:.1%} fewer per prompt)"
+        )
+    if state_store is not None:
+        print(
+            f"Incremental:       {summary['new_turns']} of {summary['total_turns']} "
+            f"turns new since the last run ({len(state_store)} conversations in "
+            f"{args.state_file})"
+        )
+    retrieval = summary["retrieval"]
+    if retrieval and retrieval["tokens"]:
+        print(
+            f"Retrieval:         {retrieval['narrowed']} of {retrieval['conversations']} "
+            f"prompts narrowed, {retrieval['kept_tokens']} of {retrieval['tokens']} "
+            f"conversation tokens sent ({retrieval['embedded_turns']} turns embedded)"
+        )
+    speculation = summary["speculation"]
+    if speculation["speculated"]:
+        print(
+            f"Speculative:       {speculation['used']} of {speculation['speculated']} "
+            f"evidence requests used, {speculation['cancelled']} cancelled, "
+            f"{speculation['wasted_calls']} calls and "
+            f"{speculation['wasted_prompt_tokens'] + speculation['wasted_eval_tokens']} "
+            f"tokens wasted"
+        )
+    prefill = summary["prefill"]
+    if prefill["calls"]:
+        print(
+            f"Prompt prefixes:   {prefill['prefix_tokens_sent']} tokens sent, "
+            f"{prefill['saved_tokens']} reused from the backend's cache "
+            f"({prefill['saved_tokens'] / max(1, prefill['calls']):.0f} per call)"
+        )
+    print(
+        f"LLM calls:         {summary['calls']} ({summary['cache_hits']} cache hits, "
+        f"{summary['coalesced']} coalesced)"
+    )
+    print(
+        f"Model loads:       {summary['model_loads']} "
+        f"({summary['load_seconds']:.1f}s loading)"
+    )
+    print(f"Concurrency limit: {client.limiter.metrics()['limit']}")
+    if hasattr(client.backend, "status"):
+        for backend in client.backend.status():
+            print(
+                f"Backend {backend['host']}: {backend['completed']} completed, "
+                f"{backend['failures']} failures, concurrency limit {backend['limit']}"
+                + (
+                    f", {backend['model_loads']} model loads"
+                    if "model_loads" in backend
+                    else ""
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import csv
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Set
+
+from ..ml.llm_client import track_usage
+
+FIELDNAMES = ["id"] + [f"Q{i + 1}" for i in range(5)]
+
+# Per-conversation cost columns appended after the answer columns; the
+# conversation size is estimated before and after compaction (--compact)
+USAGE_FIELDNAMES = [
+    "latency_seconds",
+    "llm_calls",
+    "prompt_tokens",
+    "eval_tokens",
+    "conversation_tokens",
+    "compacted_tokens",
+]
+
+
+def _truncate_partial_line(path: str) -> None:
+    """Drop a trailing row that was cut off by a crash mid-write."""
+    with open(path, "rb+") as f:
+        data = f.read()
+        if not data or data.endswith(b"\n"):
+            return
+        last_newline = data.rfind(b"\n")
+        f.truncate(last_newline + 1)
+        logging.warning(f"Discarded partial trailing row in {path}")
+
+
+def load_completed_ids(path: str, fieldnames: List[str] = FIELDNAMES) -> Set[str]:
+    """Return the conversation IDs that already have a complete row in `path`."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return set()
+
+    _truncate_partial_line(path)
+
+    completed = set()
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            if row.get("id") and all(row.get(name) for name in fieldnames):
+                completed.add(row["id"])
+    return completed
+
+
+def _read_header(path: str) -> List[str]:
+    with open(path, "r", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def answer_with_usage(answer_fn: Callable[[Dict], Dict], conversation: Dict) -> Dict:
+    """Run `answer_fn` on one conversation and add its latency and token usage."""
+    start = time.perf_counter()
+    with track_usage() as usage:
+        row = answer_fn(conversation)
+    row["latency_seconds"] = round(time.perf_counter() - start, 3)
+    row["llm_calls"] = usage.calls
+    row["prompt_tokens"] = usage.prompt_tokens
+    row["eval_tokens"] = usage.eval_tokens
+    row["conversation_tokens"] = usage.conversation_tokens
+    row["compacted_tokens"] = usage.compacted_tokens
+    return row
+
+
+class CheckpointWriter:
+    """
+    Append-only CSV writer that flushes after every row and fsyncs every
+    `fsync_every` rows, so an interrupted run loses at most the row in flight.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fieldnames: List[str] = FIELDNAMES,
+        resume: bool = False,
+        fsync_every: int = 10,
+    ):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.rows_written = 0
+
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        append = resume and os.path.exists(path) and os.path.getsize(path) > 0
+        if append:
+            # Keep the columns of the file being resumed, e.g. one written
+            # before the usage columns existed
+            fieldnames = _read_header(path) or fieldnames
+        self._file = open(path, "a" if append else "w", newline="")
+        self._writer = csv.DictWriter(
+            self._file,
+            fieldnames=fieldnames,
+            lineterminator="\n",
+            extrasaction="ignore",
+        )
+        if not append:
+            self._writer.writeheader()
+            self._sync()
+
+    def write(self, row: Dict) -> None:
+        self._writer.writerow(row)
+        self._file.flush()
+        self.rows_written += 1
+        if self.rows_written % self.fsync_every == 0:
+            os.fsync(self._file.fileno())
+
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,24 +1,318 @@
 import argparse
 import json
+import logging
+import os
+import time
+from functools import partial
 
-import pandas as pd
+from ..ml.incremental import OVERLAP_TURNS, StateStore, get_incremental_answers
+from ..ml.llm_client import create_client, track_usage
+from ..ml.prompt_ollama import (
+    CASCADE_FIELDNAMES,
+    PROMPT_REGISTRY,
+    get_cascade_answers,
+    get_yes_no_answers,
+    make_cascade_policies,
+)
+from ..ml.result_store import ResultStore, get_stored_answers
+from ..ml.retrieval import DEFAULT_TOP_K, create_retriever
+from ..ml.scheduler import set_request_context
+from ..ml.speculation import SPECULATION_STATS
+from .checkpoint import (
+    FIELDNAMES,
+    USAGE_FIELDNAMES,
+    CheckpointWriter,
+    answer_with_usage,
+    load_completed_ids,
+)
+from .columnar import (
+    QUESTION_IDS,
+    ParquetResultWriter,
+    is_parquet_path,
+    make_result_row,
+)
 
-from ..ml.prompt_ollama import get_all_answers_for_conversations
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--input_file", type=str, required=True)
 parser.add_argument("--model", type=str, default="llama3.1")
-parser.add_argument("--output_file", type=str, required=True)
+parser.add_argument(
+    "--output_file",
+    type=str,
+    required=True,
+    help="CSV output, or typed columnar output if the name ends in .parquet",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Keep the existing output file and skip conversations already in it",
+)
+parser.add_argument(
+    "--fsync_every",
+    type=int,
+    default=10,
+    help="Force rows to disk after this many conversations (default: 10)",
+)
+parser.add_argument(
+    "--hosts",
+    type=str,
+    default=None,
+    help="Comma separated Ollama hosts to load-balance across (default: OLLAMA_HOST)",
+)
+parser.add_argument(
+    "--cascade_models",
+    type=str,
+    default=None,
+    help="Comma separated models, cheapest first; answers with a small-model-first cascade instead of --model",
+)
+parser.add_argument(
+    "--cascade_policy",
+    type=str,
+    default=None,
+    help='JSON file with per-question cascade overrides, e.g. {"Q3": {"min_confidence": 0.9}}',
+)
+parser.add_argument(
+    "--compact",
+    action="store_true",
+    help="Compact conversations (speaker aliases, duplicate and noise removal) before prompting",
+)
+parser.add_argument(
+    "--prompt_variant",
+    choices=["full", "compact"],
+    default="full",
+    help="Question prompts with all few-shot examples, or the compact ones with two (default: full)",
+)
+parser.add_argument(
+    "--retrieval",
+    type=str,
+    default=None,
+    metavar="EMBED_MODEL",
+    help='Send each question only the turns most similar to it, embedded with this Ollama model (e.g. nomic-embed-text, or "hashing" for a local stand-in)',
+)
+parser.add_argument(
+    "--retrieval_top_k",
+    type=int,
+    default=DEFAULT_TOP_K,
+    help=f"Turns kept per question with --retrieval, plus their neighbours (default: {DEFAULT_TOP_K})",
+)
+parser.add_argument(
+    "--state_file",
+    type=str,
+    default=None,
+    help="Incremental mode: keep each conversation's verdicts in this JSON lines file and only analyze turns added since the last run",
+)
+parser.add_argument(
+    "--overlap",
+    type=int,
+    default=OVERLAP_TURNS,
+    help=f"Already analyzed turns sent before the new ones with --state_file (default: {OVERLAP_TURNS})",
+)
+parser.add_argument(
+    "--reverify",
+    action="store_true",
+    help="With --state_file, ask YES questions again about their evidence and the new turns",
+)
+parser.add_argument(
+    "--result_store",
+    type=str,
+    default=None,
+    help="Also record every verdict in this SQLite database, and answer conversations already in it without the LLM",
+)
+parser.add_argument(
+    "--speculative",
+    action="store_true",
+    help="With --state_file or --result_store, request the evidence of likely positive questions together with their YES/NO answer",
+)
+parser.add_argument(
+    "--broker",
+    type=str,
+    default=os.environ.get("OLLAMA_BROKER"),
+    help="URL of a local LLM broker to send requests through (default: OLLAMA_BROKER)",
+)
+parser.add_argument(
+    "--job_name",
+    type=str,
+    default=f"batch-{os.getpid()}",
+    help="Flow name this run is scheduled under, fairly against other batch jobs",
+)
+parser.add_argument(
+    "--job_weight",
+    type=float,
+    default=1.0,
+    help="Share of batch capacity relative to other jobs (default: 1.0)",
+)
 args = parser.parse_args()
+if args.state_file and args.cascade_models:
+    parser.error("--state_file does not support --cascade_models")
+if args.result_store and (args.state_file or args.cascade_models):
+    parser.error("--result_store does not support --state_file or --cascade_models")
 
 input_file = args.input_file
 model = args.model
 output_file = args.output_file
+client = (
+    create_client(args.hosts, broker=args.broker) if args.hosts or args.broker else None
+)
+# Runs from the command line always yield to interactive uploads
+set_request_context("batch", args.job_name, args.job_weight)
+retriever = create_retriever(args.retrieval, client, args.retrieval_top_k)
+state_store = StateStore(args.state_file) if args.state_file else None
+result_store = ResultStore(args.result_store) if args.result_store else None
+columnar = is_parquet_path(output_file)
+if columnar and args.resume:
+    parser.error("--resume is only supported for CSV output")
 
 with open(input_file) as f:
     data = json.load(f)
 
-answers = get_all_answers_for_conversations(data, model)
+if not args.cascade_models:
+    # Prefix token counts for this model, to report the prefill the cache saves
+    PROMPT_REGISTRY.try_measure(model, client, args.prompt_variant)
 
-df = pd.DataFrame(answers)
-df.to_csv(output_file, index=False)
+if args.cascade_models:
+    overrides = {}
+    if args.cascade_policy:
+        with open(args.cascade_policy) as f:
+            overrides = json.load(f)
+    policies = make_cascade_policies(args.cascade_models.split(","), overrides)
+    fieldnames = CASCADE_FIELDNAMES
+else:
+    fieldnames = FIELDNAMES
+
+completed_ids = load_completed_ids(output_file, fieldnames) if args.resume else set()
+pending = [conv for conv in data if conv["conversation_id"] not in completed_ids]
+if completed_ids:
+    logging.info(
+        f"Resuming {output_file}: {len(data) - len(pending)} done, {len(pending)} to go"
+    )
+
+if args.cascade_models:
+    answer_fn = partial(
+        get_cascade_answers,
+        policies=policies,
+        client=client,
+        compact=args.compact,
+        prompt_variant=args.prompt_variant,
+        retriever=retriever,
+    )
+elif state_store is not None:
+    answer_fn = partial(
+        get_incremental_answers,
+        model=model,
+        store=state_store,
+        client=client,
+        overlap=args.overlap,
+        reverify=args.reverify,
+        compact=args.compact,
+        prompt_variant=args.prompt_variant,
+        retriever=retriever,
+        speculative=args.speculative,
+    )
+elif result_store is not None:
+    answer_fn = partial(
+        get_stored_answers,
+        model=model,
+        store=result_store,
+        client=client,
+        compact=args.compact,
+        prompt_variant=args.prompt_variant,
+        retriever=retriever,
+        speculative=args.speculative,
+    )
+else:
+    answer_fn = partial(
+        get_yes_no_answers,
+        model=model,
+        client=client,
+        compact=args.compact,
+        prompt_variant=args.prompt_variant,
+        retriever=retriever,
+    )
+
+
+def columnar_answers(row):
+    if state_store is not None:
+        # The state has the evidence for every verdict, old and new
+        return state_store.get(row["id"])["results"]
+    if result_store is not None:
+        return result_store.get(row["id"], model)
+    return {qid: {"answer": row[qid]} for qid in QUESTION_IDS}
+
+
+if columnar:
+    model_label = args.cascade_models or model
+    # Plain YES/NO and cascade runs have no evidence to write
+    with_evidence = state_store is not None or result_store is not None
+    with ParquetResultWriter(output_file, evidence=with_evidence) as writer:
+        for conv in pending:
+            start = time.perf_counter()
+            with track_usage() as usage:
+                try:
+                    answers = columnar_answers(answer_fn(conv))
+                except Exception as e:
+                    logging.error(
+                        f"Error analyzing conversation {conv['conversation_id']}: {e}"
+                    )
+                    # Null answers, not five NOs
+                    answers = None
+            writer.write(
+                make_result_row(
+                    conv["conversation_id"],
+                    model_label,
+                    answers,
+                    time.perf_counter() - start,
+                    usage,
+                )
+            )
+else:
+    with CheckpointWriter(
+        output_file,
+        fieldnames + USAGE_FIELDNAMES,
+        resume=args.resume,
+        fsync_every=args.fsync_every,
+    ) as writer:
+        for conv in pending:
+            try:
+                writer.write(answer_with_usage(answer_fn, conv))
+            except Exception as e:
+                # No row, so a --resume run retries the conversation
+                logging.error(
+                    f"Error analyzing conversation {conv['conversation_id']}: {e}"
+                )
+
+if state_store is not None:
+    state_store.close()
+    logging.info(
+        f"Saved the state of {len(state_store)} conversations to {args.state_file}"
+    )
+
+if result_store is not None:
+    result_store.close()
+    logging.info(f"Recorded the verdicts in {args.result_store}")
+
+if retriever:
+    retrieval = retriever.stats()
+    logging.info(
+        f"Retrieval: {retrieval['narrowed']} of {retrieval['conversations']} prompts "
+        f"narrowed, {retrieval['kept_tokens']} of {retrieval['tokens']} "
+        f"conversation tokens sent"
+    )
+
+speculation = SPECULATION_STATS.snapshot()
+if speculation["speculated"]:
+    logging.info(
+        f"Speculative evidence: {speculation['used']} of {speculation['speculated']} "
+        f"used, {speculation['wasted_calls']} calls and "
+        f"{speculation['wasted_prompt_tokens'] + speculation['wasted_eval_tokens']} "
+        f"tokens wasted"
+    )
+
+prefill = PROMPT_REGISTRY.totals()
+if prefill["calls"]:
+    logging.info(
+        f"Prompt prefixes: {prefill['prefix_tokens_sent']} tokens sent, "
+        f"{prefill['saved_tokens']} reused from the backend's cache"
+    )
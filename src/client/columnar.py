@@ -0,0 +1,155 @@
+import os
+from typing import Dict, List, Optional
+
+QUESTION_IDS = [f"Q{i + 1}" for i in range(5)]
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "Parquet output needs pyarrow: python3 -m pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def result_schema(evidence: bool = True):
+    """
+    Columns of make_result_row rows. Without `evidence` the per-question
+    evidence and line columns are left out, for runs that only get YES/NO.
+    """
+    pa = _require_pyarrow()
+    fields = [pa.field("id", pa.string()), pa.field("model", pa.string())]
+    for qid in QUESTION_IDS:
+        fields.append(pa.field(qid, pa.bool_()))
+        if evidence:
+            fields += [
+                pa.field(f"{qid}_evidence", pa.string()),
+                pa.field(f"{qid}_lines", pa.list_(pa.int32())),
+            ]
+    fields += [
+        pa.field("latency_seconds", pa.float64()),
+        pa.field("llm_calls", pa.int32()),
+        pa.field("prompt_tokens", pa.int64()),
+        pa.field("eval_tokens", pa.int64()),
+        pa.field("conversation_tokens", pa.int64()),
+        pa.field("compacted_tokens", pa.int64()),
+    ]
+    return pa.schema(fields)
+
+
+def make_result_row(
+    conversation_id: str,
+    model: str,
+    answers: Optional[Dict[str, Dict]],
+    latency_seconds: float,
+    usage=None,
+) -> Dict:
+    """
+    Flatten per-question results ({"Q1": {"answer", "evidence",
+    "evidence_lines"}, ...}) into one typed columnar row. `answers` of None
+    marks a failed analysis: its answers, evidence and lines are null, not NO.
+    """
+    row = {"id": conversation_id, "model": model}
+    for qid in QUESTION_IDS:
+        if answers is None:
+            row[qid] = row[f"{qid}_evidence"] = row[f"{qid}_lines"] = None
+            continue
+        result = answers.get(qid, {})
+        is_yes = result.get("answer") == "YES"
+        row[qid] = is_yes
+        row[f"{qid}_evidence"] = result.get("evidence") if is_yes else None
+        row[f"{qid}_lines"] = list(result.get("evidence_lines") or [])
+    row["latency_seconds"] = latency_seconds
+    row["llm_calls"] = usage.calls if usage else 0
+    row["prompt_tokens"] = usage.prompt_tokens if usage else 0
+    row["eval_tokens"] = usage.eval_tokens if usage else 0
+    row["conversation_tokens"] = usage.conversation_tokens if usage else 0
+    row["compacted_tokens"] = usage.compacted_tokens if usage else 0
+    return row
+
+
+# Columns of make_result_row, for the same rows written as CSV
+RESULT_FIELDNAMES = (
+    ["id", "model"]
+    + [
+        f"{qid}{suffix}"
+        for qid in QUESTION_IDS
+        for suffix in ("", "_evidence", "_lines")
+    ]
+    + [
+        "latency_seconds",
+        "llm_calls",
+        "prompt_tokens",
+        "eval_tokens",
+        "conversation_tokens",
+        "compacted_tokens",
+    ]
+)
+
+
+def csv_result_row(row: Dict) -> Dict:
+    """
+    A make_result_row row with YES/NO answers (ERROR for a failed analysis)
+    and space separated lines, for CSV.
+    """
+    row = dict(row)
+    for qid in QUESTION_IDS:
+        if row[qid] is None:
+            row[qid] = "ERROR"
+        else:
+            row[qid] = "YES" if row[qid] else "NO"
+        row[f"{qid}_lines"] = " ".join(map(str, row[f"{qid}_lines"] or []))
+    return row
+
+
+class ParquetResultWriter:
+    """
+    Writes result rows to a Parquet file one row group at a time, so a long
+    run keeps bounded memory. The file's footer is only written on close;
+    until then, or after a crash, the file cannot be read. Without
+    `evidence` the file has no evidence columns (see result_schema).
+    """
+
+    def __init__(self, path: str, row_group_size: int = 100, evidence: bool = True):
+        pa = _require_pyarrow()
+        self._pa = pa
+        self.path = path
+        self.row_group_size = max(1, row_group_size)
+        self.schema = result_schema(evidence)
+        self._rows: List[Dict] = []
+
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._writer = pa.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, row: Dict) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_parquet_path(path: Optional[str]) -> bool:
+    return bool(path) and path.lower().endswith(".parquet")
@@ -2,13 +2,17 @@ import argparse
 import csv
 import json
 import logging
+import time
 import warnings
 from pathlib import Path
 from typing import Any, Dict, List
 
 import pandas as pd
 
+from src.client.columnar import ParquetResultWriter, is_parquet_path, make_result_row
+from src.ml.llm_client import track_usage
 from src.ml.model import LlamaModel
+from src.ml.prompt_ollama import find_evidence_in_conversation
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -17,15 +21,52 @@ logging.basicConfig(
 
 class ConversationAnalyzer:
     def __init__(self, model_name: str):
+        self.model_name = model_name
         self.llama_model = LlamaModel(model_name)
 
+    def _ask(self, conversation: Dict[str, Any]) -> List[Dict[str, Any]]:
+        results = self.llama_model.ask_questions([conversation])
+        formatted_result = self.llama_model.clean_and_format_response(results, "")
+        return formatted_result["analysis"]["questions"]
+
+    def analyze_conversation_columnar(
+        self, conversation: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Analyze one conversation into a typed row for ParquetResultWriter."""
+        start = time.perf_counter()
+        answers = {}
+        with track_usage() as usage:
+            try:
+                for q in self._ask(conversation):
+                    evidence_lines = []
+                    if q["answer"] == "YES":
+                        evidence_lines = find_evidence_in_conversation(
+                            q["evidence"], conversation.get("turns", [])
+                        )
+                    answers[f"Q{q['question_number']}"] = {
+                        "answer": q["answer"],
+                        "evidence": q["evidence"],
+                        "evidence_lines": evidence_lines,
+                    }
+            except Exception as e:
+                logging.error(
+                    f"Error analyzing conversation {conversation['conversation_id']}: {e}"
+                )
+                # Null answers, like ERROR in the CSV output, not five NOs
+                answers = None
+        return make_result_row(
+            conversation["conversation_id"],
+            self.model_name,
+            answers,
+            time.perf_counter() - start,
+            usage,
+        )
+
     def analyze_conversation(self, conversation: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            results = self.llama_model.ask_questions([conversation])
             # Extract answers from the formatted response
-            formatted_result = self.llama_model.clean_and_format_response(results, "")
             answers = {}
-            for q in formatted_result["analysis"]["questions"]:
+            for q in self._ask(conversation):
                 question_num = f"Q{q['question_number']}"
                 if q["answer"] == "YES":
                     answers[question_num] = f"{q['answer']} - {q['evidence']}"
@@ -46,7 +87,11 @@ class ConversationAnalyzer:
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_file", required=True)
-    parser.add_argument("--output_file", default="results.csv")
+    parser.add_argument(
+        "--output_file",
+        default="results.csv",
+        help="CSV output, or typed columnar output if the name ends in .parquet",
+    )
     parser.add_argument("--model", default="llama2")
 
     args = parser.parse_args()
@@ -57,6 +102,13 @@ def main():
         with open(args.input_file, "r") as f:
             conversations = json.load(f)
 
+        if is_parquet_path(args.output_file):
+            with ParquetResultWriter(args.output_file) as writer:
+                for conv in conversations:
+                    writer.write(analyzer.analyze_conversation_columnar(conv))
+                    logging.info(f"Processed conversation {conv['conversation_id']}")
+            return
+
         fieldnames = ["id"] + [f"Q{i + 1}" for i in range(5)]
 
         with open(args.output_file, "w", newline="") as csvfile:
@@ -0,0 +1,532 @@
+"""
+Ingestion daemon: watches a directory for new or updated conversation files
+(CSV with Speaker/Message columns like RescueBox uploads, or cmd_client
+JSON and JSON lines) and analyzes them as they arrive.
+
+python3 -m src.client.watch_client --watch_dir incoming --output_dir results
+"""
+
+import argparse
+import contextvars
+import csv
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import select
+import signal
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from ..ml.bulk import analyze_conversations, iter_conversations
+from ..ml.concurrency import MODEL_SWITCH_WAIT
+from ..ml.incremental import StateStore
+from ..ml.llm_client import LLMClient, create_client, track_usage
+from ..ml.retrieval import DEFAULT_TOP_K, TurnRetriever, create_retriever
+from ..ml.scheduler import request_context
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+EXTENSIONS = (".csv", ".json", ".jsonl")
+RESULT_SUFFIX = ".results.json"
+STATE_FILE = "watch_state.jsonl"
+
+# inotify(7) event bits
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_input(name: str) -> bool:
+    """Conversation files, not our own results or editors' temporary files."""
+    return (
+        name.lower().endswith(EXTENSIONS)
+        and not name.endswith(RESULT_SUFFIX)
+        and not name.startswith((".", "~"))
+    )
+
+
+class PollingWatcher:
+    """Reports input files whose size or mtime changed since last poll."""
+
+    def __init__(self, directory: str, interval: float = 2.0):
+        self.directory = directory
+        self.interval = interval
+        self._seen: Dict[str, Tuple[int, int]] = {}
+
+    def poll(self, timeout: float) -> List[str]:
+        time.sleep(min(timeout, self.interval))
+        changed = []
+        current = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and is_input(entry.name):
+                stat = entry.stat()
+                current[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                if self._seen.get(entry.path) != current[entry.path]:
+                    changed.append(entry.path)
+        self._seen = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Linux inotify on the (non-recursive) directory through libc, so there
+    is no extra dependency. Raises OSError where inotify is unavailable.
+    """
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, directory.encode(), self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {directory}")
+
+    def poll(self, timeout: float) -> List[str]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            name = data[start : start + length].rstrip(b"\0").decode(errors="replace")
+            offset = start + length
+            if name and is_input(name):
+                changed.append(os.path.join(self.directory, name))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_watcher(directory: str, poll_interval: float, polling: bool = False):
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except OSError as e:
+            logging.warning(
+                f"inotify unavailable ({e}); polling every {poll_interval}s"
+            )
+    return PollingWatcher(directory, poll_interval)
+
+
+class Debouncer:
+    """
+    Holds back changed files until they have been quiet for `settle`
+    seconds and their size and modification time stopped changing, so a
+    file still being copied or written is not read half-way.
+    """
+
+    def __init__(self, settle: float = 2.0):
+        self.settle = settle
+        self._pending: Dict[str, Tuple[float, Optional[Tuple[int, int]]]] = {}
+
+    def touch(self, path: str, now: float) -> None:
+        self._pending[path] = (now, self._pending.get(path, (0.0, None))[1])
+
+    def ready(self, now: float) -> List[str]:
+        ready = []
+        for path, (last_event, last_stat) in list(self._pending.items()):
+            if now - last_event < self.settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != last_stat:
+                # Changed since the last look; wait another settle period
+                self._pending[path] = (now, current)
+                continue
+            del self._pending[path]
+            ready.append(path)
+        return ready
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+def file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_conversations(path: str) -> List[Dict]:
+    """
+    Conversations in a JSON or JSON lines file, or one per Speaker/Message
+    CSV. A CSV conversation's ID is its file name, extension included, so
+    it is not mixed up with a JSON file of the same stem.
+    """
+    if not path.lower().endswith(".csv"):
+        return list(iter_conversations(path))
+
+    with open(path, newline="", encoding="utf-8") as f:
+        turns = [
+            {"speaker": row["Speaker"], "text": row["Message"]}
+            for row in csv.DictReader(f)
+        ]
+    return [{"conversation_id": os.path.basename(path), "turns": turns}]
+
+
+def write_atomic(path: str, payload: Dict) -> None:
+    """Write JSON to a temporary file and rename it over `path`."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class WatchDaemon:
+    """
+    Analyzes settled input files on `workers` threads, and the
+    conversations within each file on as many threads as the client's
+    max concurrency; the client's limiter caps the LLM requests they make
+    together. Each file's result records the hash of the input it came
+    from, so files that are unchanged since their result was written are
+    skipped, also after a restart. Updated files only cost their new turns,
+    through the incremental state store.
+    """
+
+    def __init__(
+        self,
+        watch_dir: str,
+        output_dir: Optional[str],
+        model: str,
+        client: LLMClient,
+        store: StateStore,
+        workers: int = 4,
+        settle: float = 2.0,
+        poll_interval: float = 2.0,
+        polling: bool = False,
+        compact: bool = False,
+        prompt_variant: str = "full",
+        retriever: Optional[TurnRetriever] = None,
+        speculative: bool = False,
+    ):
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.model = model
+        self.client = client
+        self.store = store
+        self.compact = compact
+        self.prompt_variant = prompt_variant
+        self.retriever = retriever
+        self.speculative = speculative
+        self.watcher = create_watcher(watch_dir, poll_interval, polling)
+        self.debouncer = Debouncer(settle)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._lock = threading.Lock()
+        self._running: Set[str] = set()
+        # Files that changed again while being analyzed
+        self._dirty: Set[str] = set()
+        self._stop = threading.Event()
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def result_path(self, path: str) -> str:
+        # chat.csv and chat.json both in the directory get separate results
+        name = os.path.basename(path) + RESULT_SUFFIX
+        return os.path.join(self.output_dir or os.path.dirname(path), name)
+
+    def is_done(self, path: str, source_sha1: str) -> bool:
+        try:
+            with open(self.result_path(path), encoding="utf-8") as f:
+                return json.load(f).get("source_sha1") == source_sha1
+        except (OSError, ValueError):
+            return False
+
+    def submit(self, path: str) -> None:
+        if os.path.abspath(path) == os.path.abspath(self.store.path):
+            # The state file is JSON lines too, but not an input
+            return
+        with self._lock:
+            if path in self._running:
+                self._dirty.add(path)
+                return
+            self._running.add(path)
+        # Workers keep the daemon's priority and flow for scheduling
+        ctx = contextvars.copy_context()
+        self.executor.submit(ctx.run, self._process, path)
+
+    def _process(self, path: str) -> None:
+        try:
+            self.process(path)
+        except Exception as e:
+            self._count("failed")
+            logging.error(f"Failed to analyze {path}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(path)
+                if path in self._dirty:
+                    self._dirty.discard(path)
+                    self.debouncer.touch(path, time.monotonic())
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def process(self, path: str) -> None:
+        """Analyze one input file and write its result, unless already done."""
+        source_sha1 = file_sha1(path)
+        if self.is_done(path, source_sha1):
+            self._count("skipped")
+            logging.debug(f"Unchanged since its result was written: {path}")
+            return
+
+        start = time.perf_counter()
+        loaded = load_conversations(path)
+        conversations: List[Optional[Dict]] = [None] * len(loaded)
+        position = {id(conversation): i for i, conversation in enumerate(loaded)}
+        error = None
+        with track_usage() as usage:
+            for outcome in analyze_conversations(
+                loaded,
+                self.model,
+                self.client,
+                workers=self.client.max_concurrency,
+                compact=self.compact,
+                prompt_variant=self.prompt_variant,
+                retriever=self.retriever,
+                speculative=self.speculative,
+                state_store=self.store,
+            ):
+                conversation = outcome["conversation"]
+                if outcome["error"] is not None:
+                    # The others are in the state store, so a retry is cheap
+                    error = error or outcome["error"]
+                    continue
+                conversations[position[id(conversation)]] = {
+                    "conversation_id": conversation["conversation_id"],
+                    "total_turns": len(conversation["turns"]),
+                    "new_turns": outcome["new_turns"],
+                    "results": outcome["results"],
+                }
+        if error is not None:
+            raise error
+
+        write_atomic(
+            self.result_path(path),
+            {
+                "source": os.path.basename(path),
+                "source_sha1": source_sha1,
+                "model": self.model,
+                "analyzed_at": time.time(),
+                "latency_seconds": round(time.perf_counter() - start, 3),
+                "llm_calls": usage.calls,
+                "prompt_tokens": usage.prompt_tokens,
+                "eval_tokens": usage.eval_tokens,
+                "conversations": conversations,
+            },
+        )
+        self._count("processed")
+        new_turns = sum(c["new_turns"] for c in conversations)
+        logging.info(
+            f"Analyzed {os.path.basename(path)}: {len(conversations)} conversations, "
+            f"{new_turns} new turns, {usage.calls} LLM calls"
+        )
+
+    def scan(self) -> None:
+        """Queue every input already there (e.g. left from before a restart)."""
+        now = time.monotonic()
+        with self._lock:
+            for entry in os.scandir(self.watch_dir):
+                if entry.is_file() and is_input(entry.name):
+                    # Already settled if nothing touches them during one period
+                    self.debouncer.touch(entry.path, now)
+
+    def run(self) -> None:
+        logging.info(
+            f"Watching {self.watch_dir} ({type(self.watcher).__name__}), "
+            f"results to {self.output_dir or 'the input directory'}"
+        )
+        self.scan()
+        try:
+            while not self._stop.is_set():
+                changed = self.watcher.poll(timeout=0.5)
+                now = time.monotonic()
+                with self._lock:
+                    for path in changed:
+                        self.debouncer.touch(path, now)
+                    ready = self.debouncer.ready(now)
+                for path in ready:
+                    self.submit(path)
+        finally:
+            self.watcher.close()
+            self.executor.shutdown(wait=True)
+            logging.info(
+                f"Stopped: {self.processed} files analyzed, {self.skipped} unchanged, "
+                f"{self.failed} failed"
+            )
+
+    def stop(self, *args) -> None:
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Watch a directory and analyze conversation files as they arrive."
+    )
+    parser.add_argument("--watch_dir", type=str, required=True)
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help=f"Where *{RESULT_SUFFIX} results go (default: next to the inputs)",
+    )
+    parser.add_argument("--model", type=str, default="llama3.1")
+    parser.add_argument(
+        "--state_file",
+        type=str,
+        default=None,
+        help=f"Incremental state of every conversation (default: {STATE_FILE} in the output directory)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Files analyzed at once (default: 4); --max_concurrency caps their LLM requests",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="Seconds a file must stay unchanged before it is read (default: 2)",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=2.0,
+        help="Seconds between directory scans without inotify (default: 2)",
+    )
+    parser.add_argument(
+        "--polling", action="store_true", help="Poll even where inotify is available"
+    )
+    parser.add_argument(
+        "--hosts",
+        type=str,
+        default=None,
+        help="Comma separated Ollama hosts to load-balance across (default: OLLAMA_HOST)",
+    )
+    parser.add_argument(
+        "--broker",
+        type=str,
+        default=os.environ.get("OLLAMA_BROKER"),
+        help="URL of a local LLM broker to send requests through (default: OLLAMA_BROKER)",
+    )
+    parser.add_argument("--max_concurrency", type=int, default=16)
+    parser.add_argument(
+        "--model_switch_wait",
+        type=float,
+        default=MODEL_SWITCH_WAIT,
+        help=f"Seconds queued requests for another model wait while the current model's queue drains; 0 serves in arrival order (default: {MODEL_SWITCH_WAIT:g})",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compact conversations (speaker aliases, duplicate and noise removal) before prompting",
+    )
+    parser.add_argument(
+        "--prompt_variant",
+        choices=["full", "compact"],
+        default="full",
+        help="Question prompts with all few-shot examples, or the compact ones with two (default: full)",
+    )
+    parser.add_argument(
+        "--retrieval",
+        type=str,
+        default=None,
+        metavar="EMBED_MODEL",
+        help='Send each question only the turns most similar to it, embedded with this Ollama model (e.g. nomic-embed-text, or "hashing" for a local stand-in)',
+    )
+    parser.add_argument(
+        "--retrieval_top_k",
+        type=int,
+        default=DEFAULT_TOP_K,
+        help=f"Turns kept per question with --retrieval, plus their neighbours (default: {DEFAULT_TOP_K})",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Request the evidence of likely positive questions together with their YES/NO answer",
+    )
+    parser.add_argument(
+        "--job_name",
+        type=str,
+        default="watch",
+        help="Flow name the daemon is scheduled under, fairly against batch jobs",
+    )
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    state_file = args.state_file or os.path.join(
+        args.output_dir or args.watch_dir, STATE_FILE
+    )
+    client = create_client(
+        args.hosts,
+        max_concurrency=args.max_concurrency,
+        broker=args.broker,
+        model_switch_wait=args.model_switch_wait,
+    )
+
+    with StateStore(state_file) as store, request_context("batch", args.job_name):
+        daemon = WatchDaemon(
+            args.watch_dir,
+            args.output_dir,
+            args.model,
+            client,
+            store,
+            workers=args.workers,
+            settle=args.settle,
+            poll_interval=args.poll_interval,
+            polling=args.polling,
+            compact=args.compact,
+            prompt_variant=args.prompt_variant,
+            retriever=create_retriever(args.retrieval, client, args.retrieval_top_k),
+            speculative=args.speculative,
+        )
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        daemon.run()
+    client.log_summary()
+
+
+if __name__ == "__main__":
+    main()
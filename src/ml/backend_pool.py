@@ -0,0 +1,312 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+import ollama
+
+from .concurrency import (
+    MODEL_LOAD_THRESHOLD,
+    MODEL_SWITCH_WAIT,
+    AdaptiveLimiter,
+    ConcurrencyLimiter,
+    is_overload_error,
+    load_seconds,
+    service_seconds,
+)
+from .context_window import runner_key
+from .scheduler import estimate_cost
+
+
+def parse_hosts(hosts: Any) -> List[str]:
+    """Accept a comma separated string or a list of Ollama host URLs."""
+    if not hosts:
+        return []
+    if isinstance(hosts, str):
+        hosts = hosts.split(",")
+    return [host.strip() for host in hosts if host and host.strip()]
+
+
+class Backend:
+    """One Ollama endpoint and what the pool knows about it."""
+
+    def __init__(
+        self,
+        host: str,
+        timeout: Optional[float] = None,
+        limiter: Optional[ConcurrencyLimiter] = None,
+    ):
+        self.host = host
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.limiter = limiter or ConcurrencyLimiter(16)
+        self.outstanding = 0
+        self.healthy = True
+        self.loaded_models: Set[str] = set()
+        self.completed = 0
+        self.failures = 0
+        self.model_loads = 0
+        self.load_seconds = 0.0
+
+    def has_model(self, model: str) -> bool:
+        # Ollama reports loaded models with their tag, e.g. "llama3.1:latest"
+        return model in self.loaded_models or f"{model}:latest" in self.loaded_models
+
+
+class PooledStream:
+    """
+    A streamed response that holds its endpoint's slot in the pool until the
+    stream is exhausted, fails or is closed (also when it is garbage
+    collected unread). Ollama streams only connect once read, so unlike
+    other requests a stream does not move on to another endpoint.
+    """
+
+    def __init__(
+        self, pool: "BackendPool", backend: Backend, model: str, chunks, start: float
+    ):
+        self._released = False
+        self._pool = pool
+        self._backend = backend
+        self._model = model
+        self._chunks = iter(chunks)
+        self._start = start
+        self._last = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        if self._released:
+            raise StopIteration
+        try:
+            self._last = next(self._chunks)
+        except StopIteration:
+            # The final chunk carries the timings of the whole response
+            self._release(
+                latency=time.perf_counter() - self._start,
+                service=service_seconds(self._last),
+                loading=load_seconds(self._last),
+            )
+            raise
+        except (httpx.TransportError, ConnectionError):
+            self._release(failed=True)
+            raise
+        except Exception as e:
+            self._release(overload=is_overload_error(e))
+            raise
+        return self._last
+
+    def close(self) -> None:
+        if not self._released:
+            # Closed early: no latency worth learning from
+            self._release()
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+
+    def __del__(self):
+        self.close()
+
+    def _release(
+        self,
+        latency: Optional[float] = None,
+        service: Optional[float] = None,
+        loading: float = 0.0,
+        overload: bool = False,
+        failed: bool = False,
+    ) -> None:
+        self._released = True
+        if failed:
+            self._backend.limiter.release(overload=True)
+            self._pool._release(self._backend, failed=True)
+        elif latency is not None:
+            self._backend.limiter.release(latency, service_seconds=service)
+            self._pool._release(self._backend, self._model, loading=loading)
+        else:
+            self._backend.limiter.release(overload=overload)
+            self._pool._release(self._backend)
+
+
+class BackendPool:
+    """
+    Routes `generate` and `embed` calls across several Ollama endpoints.
+
+    Each request goes to the healthy endpoint with the most spare capacity,
+    i.e. the lowest outstanding requests minus its in-flight limit. With
+    `adaptive`, every endpoint learns its own limit (see AdaptiveLimiter).
+    Endpoints that already have the model loaded are preferred unless their
+    queue is more than `load_penalty` requests longer, since a model load
+    costs far more than waiting for a couple of requests. For the same
+    reason each endpoint's queue is grouped by model (`model_switch_wait`).
+    Streamed responses keep their slot until they are read (PooledStream).
+    Exposes the same `generate` and `embed` signatures as the `ollama`
+    module, so it can be used as the backend of an LLMClient.
+    """
+
+    # Endpoints are limited individually; the client only caps the total
+    manages_concurrency = True
+
+    def __init__(
+        self,
+        hosts: List[str],
+        health_interval: float = 30.0,
+        load_penalty: int = 2,
+        timeout: Optional[float] = None,
+        max_concurrency: int = 16,
+        adaptive: bool = True,
+        model_switch_wait: Optional[float] = MODEL_SWITCH_WAIT,
+    ):
+        hosts = parse_hosts(hosts)
+        if not hosts:
+            raise ValueError("BackendPool needs at least one host")
+        self.backends = [
+            Backend(
+                host,
+                timeout,
+                (
+                    AdaptiveLimiter(
+                        initial_limit=min(4, max_concurrency),
+                        max_limit=max_concurrency,
+                        model_switch_wait=model_switch_wait,
+                    )
+                    if adaptive
+                    else ConcurrencyLimiter(max_concurrency, model_switch_wait)
+                ),
+            )
+            for host in hosts
+        ]
+        self.health_interval = health_interval
+        self.load_penalty = load_penalty
+        self._lock = threading.Lock()
+        # Probed on the first dispatch, not here: the default client is
+        # built at import time and must not block on /api/ps
+        self._last_health_check = float("-inf")
+
+    def check_health(self) -> None:
+        """Refresh liveness and loaded models of every endpoint via /api/ps."""
+        for backend in self.backends:
+            try:
+                response = backend.client.ps()
+                loaded = {m.model or m.name for m in response.models}
+                with self._lock:
+                    backend.healthy = True
+                    backend.loaded_models = loaded
+            except Exception as e:
+                with self._lock:
+                    if backend.healthy:
+                        logging.warning(f"Ollama backend {backend.host} unhealthy: {e}")
+                    backend.healthy = False
+        self._last_health_check = time.monotonic()
+
+    def _maybe_check_health(self) -> None:
+        with self._lock:
+            if time.monotonic() - self._last_health_check < self.health_interval:
+                return
+            # Claim this round so concurrent callers don't all probe at once
+            self._last_health_check = time.monotonic()
+        self.check_health()
+
+    def _score(self, backend: Backend, model: str) -> int:
+        return (
+            backend.outstanding
+            - backend.limiter.current_limit
+            + (0 if backend.has_model(model) else self.load_penalty)
+        )
+
+    def _acquire(self, model: str, exclude: Set[str]) -> Backend:
+        with self._lock:
+            candidates = [
+                b for b in self.backends if b.healthy and b.host not in exclude
+            ]
+            if not candidates:
+                # Everything looks down; try the untried endpoints anyway
+                candidates = [b for b in self.backends if b.host not in exclude]
+            if not candidates:
+                raise ConnectionError("No Ollama backend available")
+            backend = min(candidates, key=lambda b: self._score(b, model))
+            backend.outstanding += 1
+            return backend
+
+    def _release(
+        self,
+        backend: Backend,
+        model: Optional[str] = None,
+        failed: bool = False,
+        loading: float = 0.0,
+    ) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if failed:
+                backend.failures += 1
+                backend.healthy = False
+            elif model:
+                backend.completed += 1
+                backend.loaded_models.add(model)
+                if loading > MODEL_LOAD_THRESHOLD:
+                    backend.model_loads += 1
+                    backend.load_seconds += loading
+
+    def generate(self, model: str = "", prompt: str = "", **kwargs) -> Any:
+        return self._dispatch(
+            "generate", model, estimate_cost(prompt), prompt=prompt, **kwargs
+        )
+
+    def embed(self, model: str = "", input: Any = "", **kwargs) -> Any:
+        texts = [input] if isinstance(input, str) else list(input)
+        return self._dispatch(
+            "embed", model, estimate_cost("".join(texts)), input=input, **kwargs
+        )
+
+    def _dispatch(self, method: str, model: str, cost: float, **kwargs) -> Any:
+        """Call `method` on the best endpoint, moving on if it cannot be reached."""
+        self._maybe_check_health()
+        tried: Set[str] = set()
+        while True:
+            backend = self._acquire(model, tried)
+            tried.add(backend.host)
+            backend.limiter.acquire(cost, runner_key(model, kwargs.get("options")))
+            start = time.perf_counter()
+            try:
+                response = getattr(backend.client, method)(model=model, **kwargs)
+            except (httpx.TransportError, ConnectionError) as e:
+                backend.limiter.release(overload=True)
+                self._release(backend, failed=True)
+                logging.warning(f"Ollama backend {backend.host} failed: {e}")
+                if len(tried) >= len(self.backends):
+                    raise
+                continue
+            except Exception as e:
+                # The endpoint answered; the request itself was bad
+                backend.limiter.release(overload=is_overload_error(e))
+                self._release(backend)
+                raise
+            if kwargs.get("stream"):
+                return PooledStream(self, backend, model, response, start)
+            backend.limiter.release(
+                time.perf_counter() - start, service_seconds=service_seconds(response)
+            )
+            self._release(backend, model, loading=load_seconds(response))
+            return response
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            status = [
+                {
+                    "host": b.host,
+                    "healthy": b.healthy,
+                    "outstanding": b.outstanding,
+                    "completed": b.completed,
+                    "failures": b.failures,
+                    "model_loads": b.model_loads,
+                    "load_seconds": b.load_seconds,
+                    "loaded_models": sorted(b.loaded_models),
+                }
+                for b in self.backends
+            ]
+        for entry, backend in zip(status, self.backends):
+            limiter = backend.limiter.metrics()
+            entry["limit"] = limiter["limit"]
+            entry["queued"] = limiter["queued"]
+            entry["active_model"] = limiter["active_model"]
+            entry["model_switches"] = limiter["model_switches"]
+        return status
@@ -0,0 +1,229 @@
+"""
+Local LLM broker: one process that owns the connection to Ollama and
+schedules every tool's requests by priority and fair share.
+
+python3 -m src.ml.broker --port 11500 --hosts http://gpu1:11434,http://gpu2:11434
+OLLAMA_BROKER=http://127.0.0.1:11500 python3 -m src.backend.server          # interactive
+python3 -m src.client.batch_client ... --broker http://127.0.0.1:11500      # batch
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import httpx
+import ollama
+
+from .concurrency import MODEL_SWITCH_WAIT
+from .scheduler import DEFAULT_PRIORITY, PRIORITIES, current_request, request_context
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+PRIORITY_HEADER = "X-LLM-Priority"
+FLOW_HEADER = "X-LLM-Flow"
+WEIGHT_HEADER = "X-LLM-Weight"
+
+
+class BrokerBackend:
+    """
+    LLMClient backend that sends `generate` and `embed` calls to a broker,
+    tagged with the priority, flow and weight of the calling context.
+    """
+
+    # The broker limits and schedules requests; the client only caps them
+    manages_concurrency = True
+
+    def __init__(self, url: str, timeout: Optional[float] = None):
+        self.url = url.rstrip("/")
+        self._client = httpx.Client(base_url=self.url, timeout=timeout)
+
+    def generate(
+        self,
+        model: str = "",
+        prompt: str = "",
+        stream: bool = False,
+        options: Optional[Dict] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        if stream:
+            raise ValueError("The broker does not stream responses")
+        body = {"model": model, "prompt": prompt, "stream": False, **kwargs}
+        if options:
+            body["options"] = options
+        return self._post("/api/generate", body)
+
+    def embed(self, model: str = "", input: Any = "", **kwargs) -> Dict[str, Any]:
+        return self._post("/api/embed", {"model": model, "input": input, **kwargs})
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        priority, flow, weight = current_request()
+        response = self._client.post(
+            path,
+            json=body,
+            headers={
+                PRIORITY_HEADER: priority,
+                FLOW_HEADER: flow,
+                WEIGHT_HEADER: str(weight),
+            },
+        )
+        if response.status_code != 200:
+            # Same exception as the ollama client, so callers handle both alike
+            raise ollama.ResponseError(response.text, response.status_code)
+        return response.json()
+
+    def status(self) -> Any:
+        return self._client.get("/broker/stats").json().get("backends", [])
+
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    client = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _send_json(self, payload: Any, status: int = 200) -> None:
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/broker/stats":
+            self._send_json(
+                {
+                    "usage": self.client.stats.snapshot(),
+                    **self.client.concurrency_metrics(),
+                }
+            )
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-broker"})
+        elif self.path == "/":
+            self._send_json({"status": "Ollama is running"})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path not in ("/api/generate", "/api/embed"):
+            self._send_json({"error": "not found"}, 404)
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json({"error": "request body is not JSON"}, 400)
+            return
+        priority = self.headers.get(PRIORITY_HEADER, DEFAULT_PRIORITY)
+        if priority not in PRIORITIES:
+            self._send_json({"error": f"unknown priority {priority!r}"}, 400)
+            return
+        # Unlabelled clients (e.g. plain OLLAMA_HOST users) share per address
+        flow = self.headers.get(FLOW_HEADER) or self.client_address[0]
+        try:
+            weight = float(self.headers.get(WEIGHT_HEADER) or 1.0)
+        except ValueError:
+            weight = math.nan
+        if not (0 < weight < math.inf):
+            self._send_json(
+                {"error": f"{WEIGHT_HEADER} must be a positive number"}, 400
+            )
+            return
+        stream = request.pop("stream", True)
+        request.pop("keep_alive", None)
+
+        try:
+            with request_context(priority, flow, weight):
+                if self.path == "/api/embed":
+                    response = self.client.embed(**request)
+                    stream = False
+                else:
+                    response = self.client.generate(**request)
+        except Exception as e:
+            status = getattr(e, "status_code", 0) or 502
+            self._send_json({"error": str(e)}, status if status >= 400 else 502)
+            return
+
+        payload = (
+            response.model_dump() if hasattr(response, "model_dump") else dict(response)
+        )
+        if stream:
+            # Ollama clients stream by default; answer with a single final chunk
+            body = (json.dumps(payload, default=str) + "\n").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(payload)
+
+
+def create_broker_server(
+    client, host: str = "127.0.0.1", port: int = 11500
+) -> ThreadingHTTPServer:
+    """Create (but do not start) a broker serving `client`; port 0 picks a free port."""
+    handler = type("BoundBrokerHandler", (BrokerHandler,), {"client": client})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    from .llm_client import create_client
+
+    parser = argparse.ArgumentParser(description="Local LLM request broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument(
+        "--hosts",
+        default=os.environ.get("OLLAMA_HOSTS"),
+        help="Comma separated Ollama hosts (default: OLLAMA_HOSTS, else OLLAMA_HOST)",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=16,
+        help="Upper bound on requests in flight per Ollama host (default: 16)",
+    )
+    parser.add_argument("--fixed_concurrency", action="store_true")
+    parser.add_argument(
+        "--model_switch_wait",
+        type=float,
+        default=MODEL_SWITCH_WAIT,
+        help="Seconds requests for another model wait while the current model's queue drains",
+    )
+    args = parser.parse_args()
+
+    client = create_client(
+        args.hosts,
+        max_concurrency=args.max_concurrency,
+        adaptive=not args.fixed_concurrency,
+        model_switch_wait=args.model_switch_wait,
+    )
+    server = create_broker_server(client, args.host, args.port)
+    logging.info(f"LLM broker listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        client.log_summary()
+
+
+if __name__ == "__main__":
+    main()
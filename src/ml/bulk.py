@@ -0,0 +1,178 @@
+"""
+Bulk analysis of files with many conversations.
+
+Conversations are parsed one at a time from a JSON list (the format
+cmd_client reads), a single JSON object or JSON lines, so a large upload is
+never held in memory whole, and analyzed on a bounded pool of threads as
+they are parsed.
+"""
+
+import contextvars
+import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator
+
+from .incremental import get_incremental_answers
+from .llm_client import track_usage
+from .prompt_ollama import get_all_answers
+from .result_store import get_stored_results
+from .speculation import likely_positive
+
+READ_SIZE = 1 << 20
+
+# Whitespace and the commas between the conversations of a JSON list
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_conversations(path: str, read_size: int = READ_SIZE) -> Iterator[Dict]:
+    """
+    Yield the conversations in a JSON list, JSON object or JSON lines file
+    one by one, reading `read_size` characters at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer, pos = f.read(read_size), 0
+        eof = not buffer
+        started = False
+        while True:
+            pos = SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    return
+                buffer, pos = f.read(read_size), 0
+                eof = not buffer
+                continue
+            if not started:
+                started = True
+                if buffer[pos] == "[":
+                    pos += 1
+                    continue
+            if buffer[pos] == "]":
+                return
+            try:
+                conversation, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Conversation cut off by the end of the buffer; read at least
+                # as much again, so a huge one costs few retries
+                more = f.read(max(read_size, len(buffer) - pos))
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield conversation
+
+
+def analyze_conversations(
+    conversations: Iterable[Dict],
+    model: str,
+    client=None,
+    workers: int = 16,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever=None,
+    result_store=None,
+    speculative: bool = False,
+    state_store=None,
+) -> Iterator[Dict]:
+    """
+    Analyze conversations on `workers` threads, pulling more from the
+    iterable only as earlier ones finish. Yields {"conversation",
+    "results", "latency_seconds", "usage", "new_turns", "error"} in
+    completion order; a failed conversation has no results and the
+    exception as error. With an incremental `state_store` only the turns
+    added since a conversation's stored state are analyzed, and new_turns
+    counts them; otherwise it is None.
+    An error reading the iterable (e.g. malformed JSON) is raised after the
+    conversations already started are done. Workers keep the caller's
+    priority and flow for scheduling.
+    """
+
+    def analyze(conversation: Dict):
+        start = time.perf_counter()
+        new_turns = None
+        with track_usage() as usage:
+            if state_store is not None:
+                row = get_incremental_answers(
+                    conversation,
+                    model,
+                    state_store,
+                    client,
+                    compact=compact,
+                    prompt_variant=prompt_variant,
+                    retriever=retriever,
+                    speculative=speculative,
+                )
+                results = state_store.get(conversation["conversation_id"])["results"]
+                new_turns = row["new_turns"]
+            elif result_store is not None:
+                results = get_stored_results(
+                    conversation,
+                    model,
+                    result_store,
+                    client,
+                    compact,
+                    prompt_variant,
+                    retriever,
+                    speculative,
+                )
+            else:
+                results, _ = get_all_answers(
+                    conversation,
+                    model,
+                    client,
+                    compact,
+                    prompt_variant,
+                    retriever,
+                    speculate=likely_positive(conversation) if speculative else None,
+                )
+        return results, time.perf_counter() - start, usage, new_turns
+
+    workers = max(1, workers)
+    conversations = iter(conversations)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        exhausted = False
+        read_error = None
+        while futures or not exhausted:
+            # Twice the workers queued keeps them busy between refills
+            while not exhausted and len(futures) < 2 * workers:
+                try:
+                    conversation = next(conversations, None)
+                except Exception as e:
+                    read_error = e
+                    conversation = None
+                if conversation is None:
+                    exhausted = True
+                    break
+                ctx = contextvars.copy_context()
+                futures[executor.submit(ctx.run, analyze, conversation)] = conversation
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                conversation = futures.pop(future)
+                outcome = {
+                    "conversation": conversation,
+                    "results": None,
+                    "latency_seconds": 0.0,
+                    "usage": None,
+                    "new_turns": None,
+                    "error": None,
+                }
+                try:
+                    results, latency, usage, new_turns = future.result()
+                except Exception as e:
+                    outcome["error"] = e
+                else:
+                    outcome.update(
+                        results=results,
+                        latency_seconds=latency,
+                        usage=usage,
+                        new_turns=new_turns,
+                    )
+                yield outcome
+    if read_error is not None:
+        raise read_error
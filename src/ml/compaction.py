@@ -0,0 +1,197 @@
+import re
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+URL_RE = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+
+# Runs of three or more of the same symbol or emoji, optionally space separated
+REPEATED_SYMBOL_RE = re.compile(r"([^\w\s]+?)(?: *\1){2,}")
+
+ALIAS_PREFIX = "P"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4
+
+
+def format_turns(turns: Iterable[Dict]) -> str:
+    return "\n".join(f"{t['speaker']}: {t['text']}" for t in turns)
+
+
+class CompactConversation:
+    """
+    A conversation as it is sent to the model, together with what is needed
+    to map the model's answers back to the original: which original turns
+    each compact turn stands for, and the speaker aliases and shortened URLs
+    to restore in evidence text.
+    """
+
+    def __init__(
+        self,
+        turns: List[Dict],
+        sources: List[List[int]],
+        original_tokens: int,
+        aliases: Optional[Dict[str, str]] = None,
+        urls: Optional[Dict[str, str]] = None,
+    ):
+        self.turns = turns
+        self.sources = sources
+        self.aliases = aliases or {}
+        self.urls = urls or {}
+        self.text = format_turns(turns)
+        self.original_tokens = original_tokens
+        self.compact_tokens = estimate_tokens(self.text)
+        patterns = [re.escape(url) for url in sorted(self.urls, key=len, reverse=True)]
+        patterns += [rf"\b{re.escape(alias)}\b" for alias in self.aliases]
+        self._restore_re = re.compile("|".join(patterns)) if patterns else None
+
+    @classmethod
+    def unchanged(cls, conversation: Dict) -> "CompactConversation":
+        """The conversation as is, for callers that handle both cases alike."""
+        turns = conversation["turns"]
+        tokens = estimate_tokens(format_turns(turns))
+        return cls(list(turns), [[i] for i in range(len(turns))], tokens)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.compact_tokens
+
+    @property
+    def reduction(self) -> float:
+        """Share of the conversation's tokens removed by compaction."""
+        if not self.original_tokens:
+            return 0.0
+        return self.saved_tokens / self.original_tokens
+
+    def original_lines(self, lines: Iterable[int]) -> List[int]:
+        """Map compact turn indices (e.g. evidence lines) to original turn indices."""
+        return sorted({i for line in lines for i in self.sources[line]})
+
+    def restore(self, text: str) -> str:
+        """Put the original speaker names and full URLs back into model output."""
+        if self._restore_re is None:
+            return text
+
+        def replace(match):
+            value = match.group(0)
+            return self.aliases.get(value) or self.urls.get(value, value)
+
+        return self._restore_re.sub(replace, text)
+
+
+def _shorten_url(url: str, max_length: int) -> str:
+    """
+    Cut a URL longer than `max_length` to its host and as much of the start
+    of its path as fits; the query and fragment are dropped. The host is
+    kept whole even when it alone is longer.
+    """
+    if len(url) <= max_length:
+        return url
+    parts = urlsplit(url)
+    if parts.netloc:
+        host = f"{parts.scheme}://{parts.netloc}"
+    else:
+        # "www.example.com/path" has no scheme, so urlsplit sees only a path
+        parts = urlsplit("//" + url)
+        host = parts.netloc
+    path = parts.path[: max(0, max_length - len(host) - 1)]
+    return host + path + "…"
+
+
+def compact_conversation(
+    conversation: Dict,
+    max_url_length: int = 40,
+    min_alias_length: int = 4,
+) -> CompactConversation:
+    """
+    Cut the tokens a conversation costs in every prompt while keeping what
+    the questions depend on:
+
+    - speakers get short aliases (P1, P2, ...) in order of appearance, and
+      mentions of names of at least `min_alias_length` characters in the
+      messages use them too
+    - whitespace is collapsed and empty messages are dropped
+    - URLs longer than `max_url_length` keep only their host and the start
+      of the path
+    - runs of the same symbol or emoji are cut to one
+    - consecutive identical messages from the same speaker become one turn
+
+    The result maps every compact turn back to the original turns it
+    replaces, and restores aliases and URLs in evidence text.
+    """
+    turns = conversation["turns"]
+    original_tokens = estimate_tokens(format_turns(turns))
+
+    speakers = list(dict.fromkeys(str(turn["speaker"]) for turn in turns))
+    # Aliases are restored wherever they appear in evidence, so none may
+    # occur as a word in the speaker names or messages
+    taken = set(re.findall(r"\w+", "\n".join(speakers)))
+    taken.update(re.findall(r"\w+", "\n".join(str(turn["text"]) for turn in turns)))
+    aliases: Dict[str, str] = {}
+    number = 0
+    for speaker in speakers:
+        number += 1
+        alias = f"{ALIAS_PREFIX}{number}"
+        while alias in taken:
+            number += 1
+            alias = f"{ALIAS_PREFIX}{number}"
+        # Only alias speakers where that is actually shorter
+        if len(speaker) > len(alias):
+            aliases[speaker] = alias
+    mentions = sorted(
+        (
+            speaker
+            for speaker in aliases
+            if len(speaker) >= min_alias_length and "\n" not in speaker
+        ),
+        key=len,
+        reverse=True,
+    )
+    mention_re = (
+        re.compile(rf"(?<!\w)(?:{'|'.join(map(re.escape, mentions))})(?!\w)")
+        if mentions
+        else None
+    )
+
+    urls: Dict[str, str] = {}
+
+    def shorten(match):
+        url = match.group(0)
+        short = _shorten_url(url, max_url_length)
+        if short != url:
+            # Two URLs with the same start restore to the first one
+            urls.setdefault(short, url)
+        return short
+
+    # Messages are one line each once whitespace is collapsed, so the
+    # substitutions run once over all of them instead of once per turn
+    text = "\n".join(" ".join(str(turn["text"]).split()) for turn in turns)
+    text = URL_RE.sub(shorten, text)
+    text = REPEATED_SYMBOL_RE.sub(r"\1", text)
+    if mention_re is not None:
+        text = mention_re.sub(lambda m: aliases[m.group(0)], text)
+    texts = text.split("\n")
+
+    compact_turns: List[Dict] = []
+    sources: List[List[int]] = []
+    for index, (turn, text) in enumerate(zip(turns, texts)):
+        if not text:
+            continue
+        speaker = str(turn["speaker"])
+        speaker = aliases.get(speaker, speaker)
+
+        previous = compact_turns[-1] if compact_turns else None
+        if previous and previous["speaker"] == speaker and previous["text"] == text:
+            sources[-1].append(index)
+            continue
+        compact_turns.append({"speaker": speaker, "text": text})
+        sources.append([index])
+
+    return CompactConversation(
+        compact_turns,
+        sources,
+        original_tokens,
+        aliases={alias: speaker for speaker, alias in aliases.items()},
+        urls=urls,
+    )
@@ -0,0 +1,322 @@
+import heapq
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import ollama
+
+from .scheduler import PRIORITIES, FairQueue, current_request, priority_name
+
+# Seconds a request for another model waits before the endpoint switches to it
+MODEL_SWITCH_WAIT = 10.0
+
+# A response whose load took longer than this had to load the model; a loaded
+# model still reports a few milliseconds
+MODEL_LOAD_THRESHOLD = 0.25
+
+
+def is_overload_error(error: Exception) -> bool:
+    """
+    Whether a failed call suggests the endpoint is overloaded (timeouts,
+    dropped connections, 5xx and 429), as opposed to a bad request.
+    """
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of requests in flight. Callers beyond the limit wait in
+    `acquire` and get slots in FairQueue order: interactive before batch,
+    and fairly across the flows of each class (see `request_context`). How
+    many are waiting is reported as the queue depth.
+
+    With `model_switch_wait`, waiting requests are also grouped by model:
+    within a priority class, requests for the model that was dispatched last
+    go first, so its queue drains before the endpoint has to load another
+    model. A switch happens when that queue is empty, or once a request for
+    another model has waited `model_switch_wait` seconds. Callers pass the
+    runner key (see `context_window.runner_key`), so requests for the same
+    model with another context size count as another model.
+    """
+
+    def __init__(self, limit: int = 4, model_switch_wait: Optional[float] = None):
+        self.limit = float(max(1, limit))
+        self.model_switch_wait = model_switch_wait
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.failures = 0
+        self.active_model: Optional[str] = None
+        self.model_switches = 0
+        self._active_since = 0.0
+        self._cond = threading.Condition()
+        self._fair_queue = FairQueue()
+        self._waiting: List[tuple] = []
+        # Model and enqueue time of each waiting tag, by its sequence number
+        self._waiting_models: Dict[int, Tuple[Optional[str], float]] = {}
+        self._next: Optional[tuple] = None
+
+    @property
+    def current_limit(self) -> int:
+        return max(1, int(self.limit))
+
+    def acquire(self, cost: float = 1.0, model: Optional[str] = None) -> None:
+        """
+        Wait for a slot for a request of `cost` (e.g. its prompt tokens) to
+        `model`, in the priority and flow of the calling context.
+        """
+        with self._cond:
+            priority, flow, weight = current_request()
+            tag = self._fair_queue.tag(priority, flow, weight, cost)
+            heapq.heappush(self._waiting, tag)
+            self._waiting_models[tag[2]] = (model, time.monotonic())
+            self.queued += 1
+            self._select_next()
+            try:
+                while self.in_flight >= self.current_limit or self._next is not tag:
+                    # Whoever changes the queue picks the next request, except
+                    # a forced model switch, which is due after a while
+                    if not self._cond.wait(self._switch_check_interval()):
+                        self._select_next()
+            except BaseException:
+                self._waiting.remove(tag)
+                heapq.heapify(self._waiting)
+                del self._waiting_models[tag[2]]
+                self._select_next()
+                self._cond.notify_all()
+                raise
+            finally:
+                self.queued -= 1
+            if self._waiting[0] is tag:
+                heapq.heappop(self._waiting)
+            else:
+                self._waiting.remove(tag)
+                heapq.heapify(self._waiting)
+            del self._waiting_models[tag[2]]
+            if model is not None and model != self.active_model:
+                if self.active_model is not None:
+                    self.model_switches += 1
+                self.active_model = model
+                self._active_since = time.monotonic()
+            self._fair_queue.dispatched(tag)
+            self.in_flight += 1
+            self._select_next()
+            # The next in line may fit under the limit too
+            self._cond.notify_all()
+
+    def _switch_check_interval(self) -> Optional[float]:
+        if self.model_switch_wait is None or len(self._waiting_models) < 2:
+            return None
+        return max(0.05, self.model_switch_wait / 4)
+
+    def _select_next(self) -> None:
+        """Pick the waiting request that gets the next free slot."""
+        if not self._waiting:
+            self._next = None
+            return
+        head = self._waiting[0]
+        head_model = self._waiting_models[head[2]][0]
+        if (
+            self.model_switch_wait is None
+            or self.active_model is None
+            or head_model in (None, self.active_model)
+        ):
+            self._next = head
+            return
+
+        # The best request of the same class for the active model, unless a
+        # request for another model has waited too long. Waiting only counts
+        # from the last switch, so each model keeps the endpoint for at
+        # least `model_switch_wait` while it has work.
+        now = time.monotonic()
+        best = None
+        for tag in self._waiting:
+            model, since = self._waiting_models[tag[2]]
+            if tag[0] != head[0]:
+                continue
+            if model not in (None, self.active_model):
+                if now - max(since, self._active_since) >= self.model_switch_wait:
+                    self._next = head
+                    return
+            elif best is None or tag < best:
+                best = tag
+        self._next = best if best is not None else head
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        overload: bool = False,
+        service_seconds: Optional[float] = None,
+    ) -> None:
+        """
+        Free a slot. Pass the call's latency (and the backend's reported
+        compute time, if any) when it succeeded, or `overload=True` when it
+        failed in a way that suggests overload.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if overload:
+                self.failures += 1
+            elif latency is not None:
+                self.completed += 1
+            self._update(latency, overload)
+            # The limit may have grown, so wake everyone to re-check it
+            self._cond.notify_all()
+
+    def _update(self, latency: Optional[float], overload: bool) -> None:
+        pass
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            queued_by_priority = {name: 0 for name in PRIORITIES}
+            queued_by_model: Dict[str, int] = {}
+            for tag in self._waiting:
+                queued_by_priority[priority_name(tag[0])] += 1
+                model = self._waiting_models[tag[2]][0] or ""
+                queued_by_model[model] = queued_by_model.get(model, 0) + 1
+            return {
+                "limit": self.current_limit,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "queued_by_priority": queued_by_priority,
+                "queued_by_model": queued_by_model,
+                "active_model": self.active_model,
+                "model_switches": self.model_switches,
+                "completed": self.completed,
+                "failures": self.failures,
+            }
+
+
+class AdaptiveLimiter(ConcurrencyLimiter):
+    """
+    Finds the number of in-flight requests an endpoint handles best with
+    AIMD on latency and errors.
+
+    Each successful call gives a delay sample: its latency divided by the
+    compute time Ollama reports for it, so about 1.0 when the request did not
+    wait for a slot no matter how long the prompt or answer (plain latency
+    when the backend reports no timings). While callers are queueing for a
+    slot and the smoothed sample stays within `latency_tolerance` times the
+    best seen, the limit grows by about one per `limit` calls. Beyond that
+    tolerance, which is what happens once Ollama queues requests internally,
+    the limit shrinks in proportion (at least `latency_backoff`); a call that
+    fails with an overload error multiplies it by `backoff`. After a cut the
+    next one waits for `limit` more completions, so one burst of slow
+    responses only counts once. At `min_limit` the limiter cannot be causing
+    the delay itself, so the baseline is reset there; that is how a lasting
+    change in the workload is learned again.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        backoff: float = 0.5,
+        latency_backoff: float = 0.9,
+        latency_tolerance: float = 1.5,
+        smoothing: float = 0.2,
+        model_switch_wait: Optional[float] = None,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        super().__init__(
+            min(max(initial_limit, self.min_limit), self.max_limit), model_switch_wait
+        )
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.delay: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self._cooldown = 0
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        overload: bool = False,
+        service_seconds: Optional[float] = None,
+    ) -> None:
+        if latency is not None and service_seconds:
+            latency = latency / service_seconds
+        super().release(latency, overload)
+
+    def _decrease(self, factor: float) -> None:
+        if self._cooldown > 0:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+        self._cooldown = self.current_limit
+
+    def _update(self, sample: Optional[float], overload: bool) -> None:
+        if self._cooldown > 0:
+            self._cooldown -= 1
+        if overload:
+            self._decrease(self.backoff)
+            return
+        if sample is None:
+            return
+
+        if self.delay is None:
+            self.delay = self.baseline = sample
+        else:
+            self.delay += self.smoothing * (sample - self.delay)
+            if self.current_limit <= self.min_limit:
+                self.baseline = self.delay
+            else:
+                self.baseline = min(self.baseline, self.delay)
+
+        target = self.latency_tolerance * self.baseline
+        if self.delay > target:
+            self._decrease(
+                max(self.backoff, min(self.latency_backoff, target / self.delay))
+            )
+        elif self.queued > 0 and self.limit < self.max_limit:
+            # Only grow when the limit is what holds callers back
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics = super().metrics()
+        with self._cond:
+            metrics.update(
+                {
+                    "min_limit": self.min_limit,
+                    "max_limit": self.max_limit,
+                    "delay": self.delay,
+                    "baseline_delay": self.baseline,
+                    "increases": self.increases,
+                    "decreases": self.decreases,
+                }
+            )
+        return metrics
+
+
+def load_seconds(response: Any) -> float:
+    """Time Ollama reports spending on loading the model for a response."""
+    try:
+        return (response.get("load_duration") or 0) / 1e9
+    except AttributeError:
+        return 0.0
+
+
+def service_seconds(response: Any) -> Optional[float]:
+    """
+    Time Ollama reports working on a response (loading the model, prefill
+    and generation), excluding any queueing.
+    """
+    try:
+        nanoseconds = sum(
+            response.get(key) or 0
+            for key in ("load_duration", "prompt_eval_duration", "eval_duration")
+        )
+    except AttributeError:
+        return None
+    return nanoseconds / 1e9 if nanoseconds else None
@@ -0,0 +1,121 @@
+"""
+Per-request context window (`num_ctx`) sizing.
+
+Ollama reserves the KV cache for the full `num_ctx` of every parallel slot,
+and silently drops the start of prompts that do not fit. Sizing each request
+from its prompt and expected output keeps short chats on small caches (more
+slots fit in memory) without cutting long ones. Sizes are rounded up to a
+few buckets because Ollama reloads a model whenever `num_ctx` changes.
+"""
+
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+NUM_CTX_BUCKETS: Tuple[int, ...] = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+# Deliberately below the usual ~4 characters per token: chat messages with
+# names, emoji and misspellings tokenize worse than prose
+CHARS_PER_TOKEN = 3.0
+
+# Chat template and special tokens around the prompt
+TEMPLATE_TOKENS = 64
+
+# Output reserved when the caller does not say how long answers run
+DEFAULT_OUTPUT_TOKENS = 256
+
+# Context length each model family was trained for; larger windows are
+# accepted by Ollama but the model does not make sense of them
+MODEL_CONTEXT = {
+    "llama2": 4096,
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "llama3.2": 131072,
+    "llama3.3": 131072,
+    "gemma2": 8192,
+}
+
+
+def max_context(model: str) -> int:
+    """Largest context window worth giving `model` (the largest bucket if unknown)."""
+    return MODEL_CONTEXT.get(model.split(":")[0], NUM_CTX_BUCKETS[-1])
+
+
+def estimate_prompt_tokens(prompt: str) -> int:
+    """Conservative token count of a prompt, template included."""
+    return int(len(prompt) / CHARS_PER_TOKEN) + TEMPLATE_TOKENS
+
+
+def num_ctx_for(
+    prompt: str,
+    output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+    limit: int = NUM_CTX_BUCKETS[-1],
+) -> int:
+    """
+    Smallest bucket that holds the prompt plus `output_tokens`. Requests too
+    long for `limit` get `limit` anyway and a warning: that Ollama will
+    truncate the prompt, or, when only the output does not fit, that the
+    output is capped.
+    """
+    prompt_tokens = estimate_prompt_tokens(prompt)
+    needed = prompt_tokens + output_tokens
+    for size in NUM_CTX_BUCKETS:
+        if size >= limit:
+            break
+        if needed <= size:
+            return size
+    if prompt_tokens > limit:
+        logging.warning(
+            f"Prompt needs about {prompt_tokens} tokens, more than the {limit} "
+            f"token context window; Ollama will truncate its start"
+        )
+    elif needed > limit:
+        logging.warning(
+            f"Prompt takes about {prompt_tokens} of the {limit} token context "
+            f"window; output capped at {limit - prompt_tokens} of the "
+            f"{output_tokens} tokens expected"
+        )
+    return limit
+
+
+def context_options(
+    model: str,
+    prompt: str,
+    options: Optional[Dict] = None,
+    output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+) -> Dict[str, Any]:
+    """
+    `options` with `num_ctx` sized for `prompt` on `model` plus the
+    `output_tokens` answers are expected to take. An explicit `num_ctx` is
+    kept. `num_predict` is only a cap on the output, so a smaller positive
+    one lowers the reservation but a larger one does not raise it.
+    """
+    options = dict(options or {})
+    if "num_ctx" not in options:
+        num_predict = options.get("num_predict") or 0
+        if num_predict > 0:
+            output_tokens = min(output_tokens, num_predict)
+        options["num_ctx"] = num_ctx_for(prompt, output_tokens, max_context(model))
+    return options
+
+
+def runner_key(model: str, options: Optional[Dict] = None) -> str:
+    """
+    What Ollama loads a runner for: the model, plus its context size when
+    set, since a different `num_ctx` reloads the model just like another
+    model would.
+    """
+    num_ctx = (options or {}).get("num_ctx")
+    return f"{model}@{num_ctx}" if num_ctx else model
+
+
+def is_truncated(response: Any, options: Optional[Dict] = None) -> bool:
+    """
+    Whether a response filled its whole context window, i.e. the prompt was
+    cut or the output ran out of room. Prompt cache hits lower
+    `prompt_eval_count`, so this can miss cases but not invent them.
+    """
+    num_ctx = (options or {}).get("num_ctx")
+    if not num_ctx:
+        return False
+    used = (response.get("prompt_eval_count") or 0) + (response.get("eval_count") or 0)
+    return used >= num_ctx
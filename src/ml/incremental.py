@@ -0,0 +1,299 @@
+"""
+Incremental re-analysis of conversations that keep growing, e.g. monitored
+chat logs.
+
+Each conversation's state (how many turns were analyzed, a fingerprint of
+those turns, and every question's verdict and evidence) is kept in a
+StateStore. A re-run sends only the new turns plus `overlap` turns before
+them, and skips questions that are already YES unless `reverify`, so its
+cost follows the new turns instead of the length of the whole log.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .prompt_ollama import YES_NO_PROMPTS, get_all_answers
+from .speculation import prescreen
+
+# Already analyzed turns sent before the new ones, so an exchange that
+# spans the boundary (a question before it, the answer after) is seen whole
+OVERLAP_TURNS = 10
+# Turns on either side of earlier evidence sent when re-verifying a YES
+EVIDENCE_CONTEXT = 2
+
+NO_EVIDENCE = "No evidence found in conversation"
+
+
+def fingerprint(turns: List[Dict]) -> str:
+    """Hash of the turns' speakers and texts, to notice edited or replaced history."""
+    digest = hashlib.sha1()
+    for turn in turns:
+        digest.update(f"{turn['speaker']}\x1f{turn['text']}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def empty_results() -> Dict[str, Dict]:
+    return {
+        qid: {"answer": "NO", "evidence": NO_EVIDENCE, "evidence_lines": []}
+        for qid in YES_NO_PROMPTS
+    }
+
+
+def answer_turns(
+    conversation: Dict,
+    indices: List[int],
+    questions: List[str],
+    model: str,
+    client=None,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever=None,
+    speculate=None,
+) -> Dict[str, Dict]:
+    """
+    Ask `questions` about the turns at `indices` only. Evidence lines refer
+    to the turns of the whole conversation.
+    """
+    turns = conversation["turns"]
+    part = {
+        "conversation_id": conversation.get("conversation_id"),
+        "turns": [turns[i] for i in indices],
+    }
+    results, _ = get_all_answers(
+        part, model, client, compact, prompt_variant, retriever, questions, speculate
+    )
+    for result in results.values():
+        result["evidence_lines"] = [indices[i] for i in result["evidence_lines"]]
+    return results
+
+
+def analyze_incremental(
+    conversation: Dict,
+    model: str,
+    state: Optional[Dict] = None,
+    client=None,
+    overlap: int = OVERLAP_TURNS,
+    reverify: bool = False,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever=None,
+    speculative: bool = False,
+) -> Dict:
+    """
+    Bring a conversation's state up to date and return the new state.
+
+    Without a usable `state` (none, another model, or history that no
+    longer matches its fingerprint) the whole conversation is analyzed.
+    Otherwise questions that are not YES yet are asked about the new turns
+    and the `overlap` before them; YES verdicts are kept, or with
+    `reverify` asked again about their evidence turns and the new turns,
+    and dropped if the model no longer sees them. With `speculative`,
+    evidence is requested early for pending questions the new turns
+    pre-screen as likely YES, and for every re-verified one.
+    """
+    turns = conversation["turns"]
+    total = len(turns)
+    start = 0
+    results = empty_results()
+    if state is not None:
+        analyzed = state["analyzed_turns"]
+        if (
+            state.get("model") == model
+            and analyzed <= total
+            and fingerprint(turns[:analyzed]) == state["fingerprint"]
+        ):
+            start = analyzed
+            results.update(copy.deepcopy(state["results"]))
+        else:
+            logging.info(
+                f"Conversation {conversation.get('conversation_id')} changed "
+                f"before turn {analyzed} or was analyzed with another model; "
+                f"analyzing it from the start"
+            )
+
+    window = list(range(max(0, start - overlap), total)) if total > start else []
+    confirmed = [qid for qid in YES_NO_PROMPTS if results[qid]["answer"] == "YES"]
+    pending = [qid for qid in YES_NO_PROMPTS if qid not in confirmed]
+
+    if window and pending:
+        found = answer_turns(
+            conversation,
+            window,
+            pending,
+            model,
+            client,
+            compact,
+            prompt_variant,
+            retriever,
+            prescreen([turns[i] for i in window]) if speculative else None,
+        )
+        for qid, result in found.items():
+            if result["answer"] == "YES":
+                results[qid] = result
+
+    if reverify:
+        for qid in confirmed:
+            around = {
+                i
+                for line in results[qid]["evidence_lines"]
+                for i in range(line - EVIDENCE_CONTEXT, line + EVIDENCE_CONTEXT + 1)
+                if 0 <= i < total
+            }
+            indices = sorted(around | set(window))
+            results.update(
+                answer_turns(
+                    conversation,
+                    indices,
+                    [qid],
+                    model,
+                    client,
+                    compact,
+                    prompt_variant,
+                    retriever,
+                    # Already YES once, so most likely YES again
+                    [qid] if speculative else None,
+                )
+            )
+
+    return {
+        "conversation_id": conversation.get("conversation_id"),
+        "model": model,
+        "analyzed_turns": total,
+        "fingerprint": fingerprint(turns),
+        "new_turns": total - start,
+        "results": results,
+        "updated_at": time.time(),
+    }
+
+
+class StateStore:
+    """
+    Conversation states in an append-only JSON lines file. Every save
+    appends the conversation's whole state and the last line per
+    conversation wins. Lines are flushed on write and fsynced every
+    `fsync_every` saves, so a crash loses at most the states since then;
+    a line cut off mid-write is dropped when the file is opened. Superseded
+    lines are compacted away on open once they outnumber the live ones.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 10):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict] = {}
+        self._saves = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = self._load()
+        if lines > 2 * len(self._states):
+            self._rewrite()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self) -> int:
+        """Read every state in the file; returns the number of lines."""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            data = f.read()
+        complete = data[: data.rfind(b"\n") + 1]
+        if len(complete) < len(data):
+            logging.warning(f"Discarded partial trailing state in {self.path}")
+            with open(self.path, "rb+") as f:
+                f.truncate(len(complete))
+
+        lines = complete.decode("utf-8").splitlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                state = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping unreadable line {number} of {self.path}")
+                continue
+            self._states[state["conversation_id"]] = state
+        return len(lines)
+
+    def _rewrite(self) -> None:
+        """Replace the file with one line per conversation, atomically."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for state in self._states.values():
+                f.write(json.dumps(state) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._states.get(conversation_id)
+
+    def put(self, state: Dict) -> None:
+        line = json.dumps(state) + "\n"
+        with self._lock:
+            self._states[state["conversation_id"]] = state
+            self._file.write(line)
+            self._file.flush()
+            self._saves += 1
+            if self._saves % self.fsync_every == 0:
+                os.fsync(self._file.fileno())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._states)
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_incremental_answers(
+    conversation: Dict,
+    model: str,
+    store: StateStore,
+    client=None,
+    overlap: int = OVERLAP_TURNS,
+    reverify: bool = False,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever=None,
+    speculative: bool = False,
+) -> Dict:
+    """
+    The YES/NO answer row for one conversation, analyzing only what changed
+    since its state in `store`, which is then updated. The row also carries
+    the conversation's total and newly analyzed turns.
+    """
+    conversation_id = conversation["conversation_id"]
+    state = analyze_incremental(
+        conversation,
+        model,
+        store.get(conversation_id),
+        client,
+        overlap,
+        reverify,
+        compact,
+        prompt_variant,
+        retriever,
+        speculative,
+    )
+    store.put(state)
+    row = {"id": conversation_id}
+    row.update((qid, result["answer"]) for qid, result in state["results"].items())
+    row["total_turns"] = state["analyzed_turns"]
+    row["new_turns"] = state["new_turns"]
+    return row
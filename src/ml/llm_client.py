@@ -0,0 +1,399 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Union
+
+import ollama
+
+from .backend_pool import BackendPool, parse_hosts
+from .broker import BrokerBackend
+from .concurrency import (
+    MODEL_LOAD_THRESHOLD,
+    MODEL_SWITCH_WAIT,
+    AdaptiveLimiter,
+    ConcurrencyLimiter,
+    is_overload_error,
+    load_seconds,
+    service_seconds,
+)
+from .context_window import is_truncated, runner_key
+from .scheduler import estimate_cost
+
+
+class UsageStats:
+    """Thread-safe counters for LLM calls made through an LLMClient."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+        self.busy_seconds = 0.0
+        self.model_loads = 0
+        self.load_seconds = 0.0
+        self.truncated = 0
+
+    def record_call(self, response: Any, seconds: float) -> None:
+        loading = load_seconds(response)
+        with self._lock:
+            self.calls += 1
+            self.busy_seconds += seconds
+            self.prompt_tokens += response.get("prompt_eval_count") or 0
+            self.eval_tokens += response.get("eval_count") or 0
+            if loading > MODEL_LOAD_THRESHOLD:
+                self.model_loads += 1
+                self.load_seconds += loading
+
+    def record_cache_hit(self) -> None:
+        with self._lock:
+            self.cache_hits += 1
+
+    def record_coalesced(self) -> None:
+        with self._lock:
+            self.coalesced += 1
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def record_truncated(self) -> None:
+        with self._lock:
+            self.truncated += 1
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.eval_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "cache_hits": self.cache_hits,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "eval_tokens": self.eval_tokens,
+                "busy_seconds": self.busy_seconds,
+                "model_loads": self.model_loads,
+                "load_seconds": self.load_seconds,
+                "truncated": self.truncated,
+            }
+
+
+class CallUsage:
+    """
+    Tokens and calls attributed to one unit of work, e.g. one conversation.
+    Everything added is also added to `parent`, the enclosing unit if any.
+    """
+
+    def __init__(self, parent: Optional["CallUsage"] = None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+        # Estimated tokens of the conversation before and after compaction
+        self.conversation_tokens = 0
+        self.compacted_tokens = 0
+
+    def add(self, response: Any) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += response.get("prompt_eval_count") or 0
+            self.eval_tokens += response.get("eval_count") or 0
+        if self.parent is not None:
+            self.parent.add(response)
+
+    def add_conversation(self, original_tokens: int, compacted_tokens: int) -> None:
+        with self._lock:
+            self.conversation_tokens += original_tokens
+            self.compacted_tokens += compacted_tokens
+        if self.parent is not None:
+            self.parent.add_conversation(original_tokens, compacted_tokens)
+
+
+class _Flight:
+    """One in-flight backend call that identical concurrent requests wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_current_usage: ContextVar = ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def track_usage():
+    """
+    Collect the usage of every call made in this context; nested contexts
+    count towards the enclosing ones too. Worker threads only inherit it
+    when run via `contextvars.copy_context().run`. Cache hits and coalesced
+    calls cost nothing and are not counted.
+    """
+    usage = CallUsage(parent=_current_usage.get())
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_conversation_tokens(original_tokens: int, compacted_tokens: int) -> None:
+    """Attribute a conversation's size, before and after compaction, to the current usage."""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add_conversation(original_tokens, compacted_tokens)
+
+
+class LLMClient:
+    """
+    Drop-in replacement for the `ollama` module's `generate` and `embed`
+    that adds a shared response cache, a limit on in-flight requests and
+    usage counters. One instance can be shared by every thread in a process.
+
+    Identical requests (same model, prompt, options and other arguments)
+    that arrive while one is already in flight wait for it and share its
+    response or error instead of calling the backend again; `stats.coalesced`
+    counts the calls saved this way.
+
+    With `adaptive`, the in-flight limit for a single host moves between 1
+    and `max_concurrency` based on observed latency and errors (see
+    AdaptiveLimiter). A BackendPool adapts per endpoint itself and a broker
+    schedules centrally, so the client then only caps the total at
+    `max_concurrency`. Waiting requests are served interactive first and
+    fairly across flows (see `scheduler.request_context`), and grouped by
+    model for a single host so it does not keep swapping models (see
+    ConcurrencyLimiter; `model_switch_wait=None` turns that off).
+    """
+
+    def __init__(
+        self,
+        backend: Any = None,
+        max_concurrency: int = 16,
+        cache_size: int = 10000,
+        adaptive: bool = True,
+        model_switch_wait: Optional[float] = MODEL_SWITCH_WAIT,
+    ):
+        self.backend = backend or ollama
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self.stats = UsageStats()
+        if getattr(self.backend, "manages_concurrency", False):
+            self.limiter = ConcurrencyLimiter(max_concurrency)
+        elif adaptive:
+            self.limiter = AdaptiveLimiter(
+                initial_limit=min(4, max_concurrency),
+                max_limit=max_concurrency,
+                model_switch_wait=model_switch_wait,
+            )
+        else:
+            self.limiter = ConcurrencyLimiter(max_concurrency, model_switch_wait)
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._flights: Dict[tuple, _Flight] = {}
+        self._flights_lock = threading.Lock()
+
+    @staticmethod
+    def _cache_key(
+        model: str, prompt: str, options: Optional[Dict], extra: Optional[Dict] = None
+    ) -> tuple:
+        key = (model, prompt, json.dumps(options or {}, sort_keys=True))
+        if extra:
+            # e.g. format= or system=, which change the response just as much
+            key += (json.dumps(extra, sort_keys=True, default=str),)
+        return key
+
+    def _cache_get(self, key: tuple) -> Any:
+        with self._cache_lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def _cache_put(self, key: tuple, response: Any) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def generate(
+        self,
+        model: str = "",
+        prompt: str = "",
+        stream: bool = False,
+        options: Optional[Dict] = None,
+        **kwargs,
+    ) -> Any:
+        # Streams are consumed by the caller, so they bypass the cache and limit
+        if stream:
+            return self.backend.generate(
+                model=model, prompt=prompt, stream=True, options=options, **kwargs
+            )
+
+        key = self._cache_key(model, prompt, options, kwargs)
+        cached = self._cache_get(key)
+        if cached is not None:
+            self.stats.record_cache_hit()
+            return cached
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            self.stats.record_coalesced()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+
+        try:
+            flight.response = self._call(key, model, prompt, options, **kwargs)
+            return flight.response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _call(
+        self,
+        key: tuple,
+        model: str,
+        prompt: str,
+        options: Optional[Dict],
+        **kwargs,
+    ) -> Any:
+        self.limiter.acquire(estimate_cost(prompt), runner_key(model, options))
+        start = time.perf_counter()
+        try:
+            response = self.backend.generate(
+                model=model, prompt=prompt, options=options, **kwargs
+            )
+        except Exception as e:
+            self.limiter.release(overload=is_overload_error(e))
+            self.stats.record_error()
+            raise
+        seconds = time.perf_counter() - start
+        self.limiter.release(seconds, service_seconds=service_seconds(response))
+        self.stats.record_call(response, seconds)
+        if is_truncated(response, options):
+            self.stats.record_truncated()
+            logging.warning(
+                f"{model} filled its {options['num_ctx']} token context window "
+                f"({response.get('prompt_eval_count')} prompt + "
+                f"{response.get('eval_count')} output tokens); the prompt or "
+                f"answer was probably truncated"
+            )
+
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add(response)
+
+        self._cache_put(key, response)
+        return response
+
+    def embed(self, model: str = "", input: Any = "", **kwargs) -> Any:
+        """
+        The `ollama` module's `embed` under the same limit and usage
+        counters as `generate`. Not cached; callers keep the vectors.
+        """
+        texts = [input] if isinstance(input, str) else list(input)
+        self.limiter.acquire(estimate_cost("".join(texts)), model)
+        start = time.perf_counter()
+        try:
+            response = self.backend.embed(model=model, input=input, **kwargs)
+        except Exception as e:
+            self.limiter.release(overload=is_overload_error(e))
+            self.stats.record_error()
+            raise
+        seconds = time.perf_counter() - start
+        self.limiter.release(seconds, service_seconds=service_seconds(response))
+        self.stats.record_call(response, seconds)
+
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add(response)
+        return response
+
+    def concurrency_metrics(self) -> Dict[str, Any]:
+        """Current in-flight limit and queue depth, overall and per backend."""
+        metrics = {"client": self.limiter.metrics()}
+        if hasattr(self.backend, "status"):
+            metrics["backends"] = self.backend.status()
+        return metrics
+
+    def log_summary(self) -> None:
+        stats = self.stats.snapshot()
+        limiter = self.limiter.metrics()
+        logging.info(
+            f"LLM calls: {stats['calls']}, cache hits: {stats['cache_hits']}, "
+            f"coalesced: {stats['coalesced']}, errors: {stats['errors']}, prompt tokens: {stats['prompt_tokens']}, "
+            f"output tokens: {stats['eval_tokens']}, "
+            f"model loads: {stats['model_loads']} ({stats['load_seconds']:.1f}s), "
+            f"truncated: {stats['truncated']}, "
+            f"concurrency limit: {limiter['limit']}"
+        )
+
+
+def create_client(
+    hosts: Union[str, List[str], None] = None,
+    max_concurrency: int = 16,
+    adaptive: bool = True,
+    broker: Optional[str] = None,
+    model_switch_wait: Optional[float] = MODEL_SWITCH_WAIT,
+    **kwargs,
+) -> LLMClient:
+    """
+    Build an LLMClient for one or more Ollama hosts. Several hosts are
+    load-balanced through a BackendPool; none means the default `ollama` host.
+    With `broker`, every call goes through the local broker at that URL
+    instead (see broker.py), which then owns the Ollama hosts.
+    """
+    hosts = parse_hosts(hosts)
+    if broker:
+        backend = BrokerBackend(broker)
+    elif hosts:
+        backend = BackendPool(
+            hosts,
+            max_concurrency=max_concurrency,
+            adaptive=adaptive,
+            model_switch_wait=model_switch_wait,
+        )
+    else:
+        backend = None
+    return LLMClient(
+        backend=backend,
+        max_concurrency=max_concurrency,
+        adaptive=adaptive,
+        model_switch_wait=model_switch_wait,
+        **kwargs,
+    )
+
+
+# Comma separated list of Ollama hosts, e.g. "http://gpu1:11434,http://gpu2:11434",
+# or the URL of a local broker shared with other tools
+default_client = create_client(
+    os.environ.get("OLLAMA_HOSTS"),
+    broker=os.environ.get("OLLAMA_BROKER"),
+    model_switch_wait=float(
+        os.environ.get("OLLAMA_MODEL_SWITCH_WAIT", MODEL_SWITCH_WAIT)
+    ),
+)
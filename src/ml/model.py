@@ -1,3 +1,4 @@
+import contextvars
 import json
 import logging
 import os
@@ -5,7 +6,8 @@ import re
 from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
 
-import ollama
+from .context_window import context_options
+from .llm_client import default_client
 
 # Initialize logging
 logging.basicConfig(
@@ -21,10 +23,15 @@ questions = """
 """
 
 
+# What the JSON analysis of all questions usually takes; num_predict below
+# only caps runaway answers and would size every context for its worst case
+ANALYSIS_OUTPUT_TOKENS = 1024
+
+
 class LlamaModel:
-    def __init__(self, model_name="llama3.1"):
+    def __init__(self, model_name="llama3.1", client=None):
         self.model_name = model_name
-        self.client = ollama
+        self.client = client or default_client
         self.chunk_size = 64000
         self.chunk_overlap = 100
         self.conversation_history = []
@@ -59,7 +66,12 @@ class LlamaModel:
                 model=self.model_name,
                 prompt=prompt,
                 stream=False,
-                options={"temperature": 0.6, "top_p": 0.9, "num_predict": 5000},
+                options=context_options(
+                    self.model_name,
+                    prompt,
+                    {"temperature": 0.6, "top_p": 0.9, "num_predict": 5000},
+                    output_tokens=ANALYSIS_OUTPUT_TOKENS,
+                ),
             )
 
             text = response["response"]
@@ -161,12 +173,20 @@ class LlamaModel:
         chunks = self._split_text(conversation_text)
         all_results = []
 
-        # Process chunks in parallel
-        with ThreadPoolExecutor(max_workers=4) as executor:
+        # Process chunks in parallel; the client's limiter decides how many
+        # requests are actually in flight, so only cap the threads here
+        max_workers = max(
+            1, min(len(chunks), getattr(self.client, "max_concurrency", 4))
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = []
             for chunk in chunks:
                 prompt = self._create_prompt(chunk)
-                futures.append(executor.submit(self._generate_response, prompt))
+                # Run in a copy of the caller's context so usage tracking follows
+                ctx = contextvars.copy_context()
+                futures.append(
+                    executor.submit(ctx.run, self._generate_response, prompt)
+                )
                 self.conversation_history.append(chunk)
 
             for future in futures:
@@ -0,0 +1,34 @@
+"""
+Relative cost of one LLM call per model, shared by the cascade (which
+totals it per conversation) and evaluation/report.py (which compares runs
+by it). Deliberately free of dependencies so the report can import it.
+"""
+
+import re
+from typing import Dict, Optional
+
+# Relative cost of one call, in billions of parameters. Used when the model
+# name carries no size tag such as "llama3.2:1b".
+MODEL_COSTS = {
+    "llama3.2": 3,
+    "llama3.1": 8,
+    "llama3.3": 70,
+    "llama2": 7,
+    "gemma2": 9,
+}
+
+
+def model_cost(model: str, costs: Optional[Dict[str, float]] = None) -> float:
+    """
+    Relative cost of one call to `model`, taken from its size tag if present
+    ("llama3.2:1b", or "llama_3.2_1b" as evaluation run directories name
+    it), else from MODEL_COSTS by model family; 1 for unknown models.
+    """
+    costs = {**MODEL_COSTS, **(costs or {})}
+    if model in costs:
+        return costs[model]
+    match = re.search(r"(\d+(?:\.\d+)?)b\b", model.lower().split(":")[-1])
+    if match:
+        return float(match.group(1))
+    family = model.split(":")[0]
+    return costs.get(family, costs.get(family.replace("_", ""), 1))
@@ -1,18 +1,20 @@
 import json
-import ollama
+import math
+
 import pandas as pd
 from tqdm import tqdm
 
+from .compaction import CompactConversation, compact_conversation
+from .context_window import context_options
+from .llm_client import default_client, record_conversation_tokens, track_usage
+from .model_costs import model_cost
+from .prompt_registry import REGISTRY as PROMPT_REGISTRY
 from .prompts import AGE_PROMPT as YES_NO_AGE_PROMPT
 from .prompts import AGE_REQUEST_PROMPT as YES_NO_AGE_REQUEST_PROMPT
 from .prompts import GIFT_PROMPT as YES_NO_GIFT_PROMPT
 from .prompts import MEDIA_PROMPT as YES_NO_MEDIA_PROMPT
 from .prompts import MEETUP_PROMPT as YES_NO_MEETUP_PROMPT
-from .prompts1 import AGE_PROMPT as EVIDENCE_AGE_PROMPT
-from .prompts1 import AGE_REQUEST_PROMPT as EVIDENCE_AGE_REQUEST_PROMPT
-from .prompts1 import GIFT_PROMPT as EVIDENCE_GIFT_PROMPT
-from .prompts1 import MEDIA_PROMPT as EVIDENCE_MEDIA_PROMPT
-from .prompts1 import MEETUP_PROMPT as EVIDENCE_MEETUP_PROMPT
+from .speculation import discard_speculative, start_speculative, use_speculative
 
 YES_NO_PROMPTS = {
     "Q1": YES_NO_AGE_PROMPT,
@@ -22,21 +24,46 @@ YES_NO_PROMPTS = {
     "Q5": YES_NO_MEDIA_PROMPT,
 }
 
-EVIDENCE_PROMPTS = {
-    "Q1": EVIDENCE_AGE_PROMPT,
-    "Q2": EVIDENCE_AGE_REQUEST_PROMPT,
-    "Q3": EVIDENCE_MEETUP_PROMPT,
-    "Q4": EVIDENCE_GIFT_PROMPT,
-    "Q5": EVIDENCE_MEDIA_PROMPT,
-}
+# Output tokens reserved in each request's context window (see
+# context_window.py); answers are a word, evidence a few quoted lines
+YES_NO_OUTPUT_TOKENS = 64
+EVIDENCE_OUTPUT_TOKENS = 512
 
-def format_conversation(conv):
+def format_conversation(conv, compact=False):
+    if compact:
+        return compact_conversation(conv).text
     return "\n".join([f"{t['speaker']}: {t['text']}" for t in conv["turns"]])
 
-def get_yes_no_answer(model, prompt):
-    response = ollama.generate(model, prompt)["response"]
+def prepare_conversation(conv, compact=False):
+    """
+    The conversation as it goes into the prompts, compacted or not, and
+    recorded in the current usage so runs can report the token reduction.
+    """
+    prepared = compact_conversation(conv) if compact else CompactConversation.unchanged(conv)
+    record_conversation_tokens(prepared.original_tokens, prepared.compact_tokens)
+    return prepared
+
+def question_conversation(prepared, qid, retriever=None):
+    """The prepared conversation, narrowed to the turns about `qid` if retrieving."""
+    return retriever.narrow(prepared, qid) if retriever else prepared
+
+def parse_yes_no(response):
     return "YES" if "YES" in response.upper() else "NO"
 
+def generate_compiled(model, prompt, conversation_text, client=None, output_tokens=YES_NO_OUTPUT_TOKENS):
+    """
+    Ask a compiled registry prompt about a formatted conversation and record
+    how much of its prefix the backend reused (cache hits are not counted).
+    """
+    client = client or default_client
+    text = prompt.render(conversation_text)
+    options = context_options(model, text, output_tokens=output_tokens)
+    with track_usage() as usage:
+        response = client.generate(model, text, options=options)
+    if usage.calls:
+        PROMPT_REGISTRY.record_call(prompt, model, conversation_text, usage.prompt_tokens)
+    return response["response"]
+
 def find_evidence_in_conversation(evidence_text, conversation_turns):
     """Find the actual conversation turn that contains the evidence."""
     matching_lines = []
@@ -56,8 +83,8 @@ def find_evidence_in_conversation(evidence_text, conversation_turns):
     
     return matching_lines
 
-def get_evidence(model, prompt, conversation_turns):
-    response = ollama.generate(model, prompt)["response"]
+def parse_evidence(response, conversation_turns):
+    """Evidence text from an evidence prompt's answer and the turns it matches."""
     if "Evidence:" not in response:
         return "No evidence found in conversation", []
         
@@ -69,22 +96,50 @@ def get_evidence(model, prompt, conversation_turns):
     
     return evidence_text, matching_line_indices
 
-def get_all_answers(conversation, model):
-    formatted_conv = format_conversation(conversation)
+def get_all_answers(conversation, model, client=None, compact=False, prompt_variant="full", retriever=None, questions=None, speculate=None):
+    """
+    Answers with evidence for every question, or only those in `questions`.
+    Evidence for the questions in `speculate` is requested together with
+    their YES/NO answer instead of after it (see ml/speculation.py).
+    """
+    full = prepare_conversation(conversation, compact)
     results = {}
     evidence_matches = {}
 
-    for qid in YES_NO_PROMPTS.keys():
+    for qid, yes_no_prompt in PROMPT_REGISTRY.prompts("yes_no", prompt_variant).items():
+        if questions is not None and qid not in questions:
+            continue
+        prepared = question_conversation(full, qid, retriever)
+        formatted_conv = prepared.text
+        evidence_prompt = PROMPT_REGISTRY.get("evidence", qid, prompt_variant)
+        speculative = None
+        if speculate and qid in speculate:
+            speculative = start_speculative(
+                generate_compiled, model, evidence_prompt, formatted_conv, client, EVIDENCE_OUTPUT_TOKENS
+            )
+
         # Get YES/NO
-        yes_no_prompt = YES_NO_PROMPTS[qid].format(conversation=formatted_conv)
-        answer = get_yes_no_answer(model, yes_no_prompt)
+        try:
+            answer = parse_yes_no(generate_compiled(model, yes_no_prompt, formatted_conv, client))
+        except BaseException:
+            if speculative is not None:
+                discard_speculative(speculative)
+            raise
 
         # Get evidence and matching lines if YES
         evidence_text = "No evidence found in conversation"
         matching_lines = []
+        if answer != "YES" and speculative is not None:
+            discard_speculative(speculative)
         if answer == "YES":
-            evidence_prompt = EVIDENCE_PROMPTS[qid].format(conversation=formatted_conv)
-            evidence_text, matching_lines = get_evidence(model, evidence_prompt, conversation["turns"])
+            if speculative is not None:
+                response = use_speculative(speculative)
+            else:
+                response = generate_compiled(model, evidence_prompt, formatted_conv, client, EVIDENCE_OUTPUT_TOKENS)
+            evidence_text, matching_lines = parse_evidence(response, prepared.turns)
+            # Back to the original speakers, URLs and turn indices
+            evidence_text = prepared.restore(evidence_text)
+            matching_lines = prepared.original_lines(matching_lines)
             
             # If we found no matching lines but got a YES, change to NO
             if not matching_lines:
@@ -102,22 +157,128 @@ def get_all_answers(conversation, model):
 
     return results, evidence_matches
 
-def get_all_prompts(conversation):
-    formatted_conv = format_conversation(conversation)
+def get_all_prompts(conversation, compact=False, prompt_variant="full", retriever=None):
+    prepared = prepare_conversation(conversation, compact)
     prompts = {}
 
-    for qid, prompt_template in YES_NO_PROMPTS.items():
-        prompts[qid] = prompt_template.format(conversation=formatted_conv)
+    for qid, prompt in PROMPT_REGISTRY.prompts("yes_no", prompt_variant).items():
+        prompts[qid] = prompt.render(question_conversation(prepared, qid, retriever).text)
 
     return prompts
 
-def get_all_answers_for_conversations(conversations, model):
-    results = []
+def get_yes_no_answers(conversation, model, client=None, compact=False, prompt_variant="full", retriever=None):
+    """Return the YES/NO answer row for a single conversation."""
+    prepared = prepare_conversation(conversation, compact)
+    answers = {
+        prompt_id: parse_yes_no(generate_compiled(
+            model, prompt, question_conversation(prepared, prompt_id, retriever).text, client
+        ))
+        for prompt_id, prompt in PROMPT_REGISTRY.prompts("yes_no", prompt_variant).items()
+    }
+    return {"id": conversation["conversation_id"], **answers}
+
+def iter_answers_for_conversations(conversations, model, client=None, compact=False, prompt_variant="full", retriever=None):
+    """Yield one YES/NO answer row per conversation as soon as it is done."""
     for conv in conversations:
-        prompts = get_all_prompts(conv)
-        answers = {
-            prompt_id: get_yes_no_answer(model, prompt)
-            for prompt_id, prompt in prompts.items()
-        }
-        results.append({"id": conv["conversation_id"], **answers})
-    return results
+        yield get_yes_no_answers(conv, model, client, compact, prompt_variant, retriever)
+
+def get_all_answers_for_conversations(conversations, model, client=None, compact=False, prompt_variant="full", retriever=None):
+    return list(iter_answers_for_conversations(conversations, model, client, compact, prompt_variant, retriever))
+
+
+# Cascade mode: a cheap model answers first and only YES verdicts or
+# low-confidence answers are escalated to the next, larger model.
+
+DEFAULT_CASCADE_POLICY = {
+    "models": ["llama3.2:1b", "llama3.1"],
+    # Always confirm positives with the larger model
+    "escalate_on_yes": True,
+    # Escalate when confidence in the cheap answer falls below this
+    "min_confidence": 0.75,
+    # "samples": agreement across two cheap samples; "logprobs": probability
+    # of the answer token when the backend returns logprobs
+    "confidence": "samples",
+    "sample_options": {"temperature": 0.8, "seed": 1},
+}
+
+# Per-question overrides on top of DEFAULT_CASCADE_POLICY
+CASCADE_POLICIES = {qid: {} for qid in YES_NO_PROMPTS}
+
+CASCADE_FIELDNAMES = (
+    ["id"]
+    + list(YES_NO_PROMPTS)
+    + [f"{qid}_model" for qid in YES_NO_PROMPTS]
+    + ["cost"]
+)
+
+def make_cascade_policies(models=None, overrides=None):
+    """Build one policy per question from the defaults plus per-question overrides."""
+    policies = {}
+    for qid in YES_NO_PROMPTS:
+        policy = {**DEFAULT_CASCADE_POLICY, **CASCADE_POLICIES.get(qid, {})}
+        if models:
+            policy["models"] = list(models)
+        policy.update((overrides or {}).get(qid, {}))
+        policies[qid] = policy
+    return policies
+
+def _logprob_confidence(response, answer):
+    """Probability of the first answer token, or None if logprobs are missing."""
+    logprobs = response.get("logprobs") if hasattr(response, "get") else None
+    if not logprobs:
+        return None
+    for entry in logprobs:
+        token = entry.get("token", "").strip().upper()
+        if token and (answer.startswith(token) or token.startswith(answer)):
+            return math.exp(entry["logprob"])
+    return None
+
+def get_cascade_answer(prompt, policy, client=None):
+    """
+    Walk the policy's models from cheapest to largest and stop at the first
+    confident answer. Returns the answer, the model that gave it and the
+    total cost of every call made.
+    """
+    client = client or default_client
+    models = policy["models"]
+    cost = 0
+    for level, model in enumerate(models):
+        options = context_options(model, prompt, output_tokens=YES_NO_OUTPUT_TOKENS)
+        response = client.generate(model, prompt, options=options)
+        cost += model_cost(model, policy.get("costs"))
+        answer = parse_yes_no(response["response"])
+        if level == len(models) - 1:
+            break
+        # Escalated whatever the confidence, so don't pay for measuring it
+        if answer == "YES" and policy["escalate_on_yes"]:
+            continue
+
+        confidence = None
+        if policy["confidence"] == "logprobs":
+            confidence = _logprob_confidence(response, answer)
+        if confidence is None:
+            sample = client.generate(
+                model, prompt, options={**options, **policy["sample_options"]}
+            )
+            cost += model_cost(model, policy.get("costs"))
+            confidence = 1.0 if parse_yes_no(sample["response"]) == answer else 0.5
+
+        if confidence < policy["min_confidence"]:
+            continue
+        break
+
+    return {"answer": answer, "model": model, "cost": cost}
+
+def get_cascade_answers(conversation, policies=None, client=None, compact=False, prompt_variant="full", retriever=None):
+    """Return the cascade YES/NO row, answering models and cost for one conversation."""
+    policies = policies or make_cascade_policies()
+    prompts = get_all_prompts(conversation, compact, prompt_variant, retriever)
+    row = {"id": conversation["conversation_id"]}
+    cost = 0
+    for qid, prompt in prompts.items():
+        result = get_cascade_answer(prompt, policies[qid], client)
+        row[qid] = result["answer"]
+        row[f"{qid}_model"] = result["model"]
+        cost += result["cost"]
+    row["cost"] = cost
+    return row
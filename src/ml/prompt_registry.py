@@ -0,0 +1,277 @@
+"""
+Question prompts compiled once into a static prefix, the conversation slot
+and a suffix, with the prefix's token count per model and the prefill the
+backend's prompt cache saved on each call.
+
+Every prompt for a question starts with the same text, so as long as it is
+sent unchanged (string concatenation instead of `str.format` on the whole
+template) Ollama can reuse the prefix's KV cache from the previous call and
+only prefill the conversation.
+"""
+
+import logging
+import random
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import prompts, prompts1
+from .context_window import context_options
+
+SLOT = "{conversation}"
+VARIANTS = ("full", "compact")
+EXAMPLE_RE = re.compile(r"^Example \d+:\n", re.MULTILINE)
+ANSWER_RE = re.compile(r"^Answer:\n(YES|NO)", re.MULTILINE)
+
+# Fallback when a model's prefixes have not been measured
+CHARS_PER_TOKEN = 4.0
+
+
+class CompiledPrompt:
+    """One question's template split around its conversation slot."""
+
+    def __init__(self, name: str, prefix: str, suffix: str, examples: int):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self.examples = examples
+
+    def render(self, conversation: str) -> str:
+        return self.prefix + conversation + self.suffix
+
+
+def split_template(template: str) -> Tuple[str, str]:
+    """Prefix and suffix of a `str.format` template with one {conversation} slot."""
+    prefix, slot, suffix = template.partition(SLOT)
+    if not slot or SLOT in suffix:
+        raise ValueError("Template needs exactly one {conversation} slot")
+    return (
+        prefix.replace("{{", "{").replace("}}", "}"),
+        suffix.replace("{{", "{").replace("}}", "}"),
+    )
+
+
+def select_examples(prefix: str, keep: int) -> Tuple[str, int]:
+    """
+    Keep `keep` of the prefix's few-shot examples (renumbered), at least one
+    YES and one NO when both exist. Returns the prefix and its example count.
+    """
+    parts = EXAMPLE_RE.split(prefix)
+    header, examples = parts[0], parts[1:]
+    if len(examples) <= keep:
+        return prefix, len(examples)
+
+    # The instructions after the last example belong to no example
+    last = examples[-1]
+    end = last.find("\n\n", ANSWER_RE.search(last).end())
+    examples[-1], tail = last[: end + 2], last[end + 2 :]
+
+    answers = [ANSWER_RE.search(example).group(1) for example in examples]
+    chosen = []
+    for answer in ("YES", "NO"):
+        if answer in answers:
+            chosen.append(answers.index(answer))
+    for index in range(len(examples)):
+        if len(chosen) >= keep:
+            break
+        if index not in chosen:
+            chosen.append(index)
+    chosen = sorted(chosen[:keep])
+
+    body = "".join(
+        f"Example {number}:\n{examples[index]}"
+        for number, index in enumerate(chosen, 1)
+    )
+    return header + body + tail, len(chosen)
+
+
+class PromptRegistry:
+    """
+    Compiled prompts by kind ("yes_no", "evidence"), question and variant
+    ("full", or "compact" with `compact_examples` few-shot examples), plus
+    per model the measured prefix tokens and per prompt the prefill savings.
+    """
+
+    def __init__(self, compact_examples: int = 2):
+        self.compact_examples = compact_examples
+        self._prompts: Dict[Tuple[str, str, str], CompiledPrompt] = {}
+        self._by_name: Dict[str, CompiledPrompt] = {}
+        self._lock = threading.Lock()
+        self._prefix_tokens: Dict[Tuple[str, str], int] = {}
+        self._stats: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def register(self, kind: str, qid: str, template: str) -> None:
+        prefix, suffix = split_template(template)
+        full_examples = len(EXAMPLE_RE.findall(prefix))
+        compact_prefix, compact_examples = select_examples(
+            prefix, self.compact_examples
+        )
+        for variant, text, examples in (
+            ("full", prefix, full_examples),
+            ("compact", compact_prefix, compact_examples),
+        ):
+            prompt = CompiledPrompt(f"{kind}/{qid}/{variant}", text, suffix, examples)
+            self._prompts[(kind, qid, variant)] = prompt
+            self._by_name[prompt.name] = prompt
+
+    def get(self, kind: str, qid: str, variant: str = "full") -> CompiledPrompt:
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown prompt variant {variant!r}, expected {VARIANTS}")
+        return self._prompts[(kind, qid, variant)]
+
+    def prompts(self, kind: str, variant: str = "full") -> Dict[str, CompiledPrompt]:
+        """The compiled prompts of one kind and variant, by question ID."""
+        return {
+            qid: self.get(kind, qid, variant)
+            for (k, qid, v) in self._prompts
+            if k == kind and v == variant
+        }
+
+    def prefix_tokens(self, prompt: CompiledPrompt, model: str) -> int:
+        """Measured prefix tokens for `model`, else an estimate."""
+        with self._lock:
+            measured = self._prefix_tokens.get((prompt.name, model))
+        if measured is not None:
+            return measured
+        return int(len(prompt.prefix) / self.chars_per_token(model))
+
+    def chars_per_token(self, model: str) -> float:
+        with self._lock:
+            measured = [
+                (len(self._by_name[name].prefix), tokens)
+                for (name, m), tokens in self._prefix_tokens.items()
+                if m == model and tokens > 0
+            ]
+        if not measured:
+            return CHARS_PER_TOKEN
+        return sum(chars for chars, _ in measured) / sum(t for _, t in measured)
+
+    def measure(self, model: str, client=None, variant: Optional[str] = None) -> None:
+        """
+        Record the prefix tokens of every prompt (of `variant`, or all) as
+        `model` tokenizes them. Each prefix goes after a random number so
+        the backend cannot serve any of it from its cache, and the count for
+        the number alone is subtracted, which also removes the chat
+        template's own tokens.
+        """
+        if client is None:
+            from .llm_client import default_client as client
+
+        def prompt_eval_count(text: str) -> int:
+            nonce = f"{random.randrange(10**8, 10**9)}\n"
+            prompt = nonce + text
+            response = client.generate(
+                model,
+                prompt,
+                options=context_options(model, prompt, {"num_predict": 1}),
+            )
+            return response.get("prompt_eval_count") or 0
+
+        base = prompt_eval_count("")
+        measured = {}
+        for prompt in self._prompts.values():
+            if variant in (None, prompt.name.rsplit("/", 1)[1]):
+                measured[(prompt.name, model)] = max(
+                    0, prompt_eval_count(prompt.prefix) - base
+                )
+        with self._lock:
+            self._prefix_tokens.update(measured)
+
+    def try_measure(
+        self, model: str, client=None, variant: Optional[str] = None
+    ) -> None:
+        """`measure`, falling back to estimates if the backend cannot be reached."""
+        try:
+            self.measure(model, client, variant)
+        except Exception as e:
+            logging.warning(f"Could not measure prompt prefixes for {model}: {e}")
+            return
+        for row in self.report():
+            if row["model"] == model and row["measured"]:
+                logging.info(
+                    f"Prompt {row['prompt']}: {row['prefix_tokens']} prefix tokens on {model}"
+                )
+
+    def record_call(
+        self,
+        prompt: CompiledPrompt,
+        model: str,
+        conversation: str,
+        prompt_eval_count: int,
+    ) -> int:
+        """
+        Count one backend call and return the prefill tokens the backend
+        reused from its cache, estimated as the tokens the full prompt should
+        take minus those it reports evaluating (at most the prefix).
+        """
+        prefix_tokens = self.prefix_tokens(prompt, model)
+        rest = len(conversation + prompt.suffix) / self.chars_per_token(model)
+        saved = int(
+            min(prefix_tokens, max(0.0, prefix_tokens + rest - prompt_eval_count))
+        )
+        with self._lock:
+            stats = self._stats.setdefault(
+                (prompt.name, model),
+                {
+                    "calls": 0,
+                    "prompt_eval_tokens": 0,
+                    "prefix_tokens_sent": 0,
+                    "saved_tokens": 0,
+                },
+            )
+            stats["calls"] += 1
+            stats["prompt_eval_tokens"] += prompt_eval_count
+            stats["prefix_tokens_sent"] += prefix_tokens
+            stats["saved_tokens"] += saved
+        logging.debug(
+            f"{prompt.name} on {model}: {prompt_eval_count} prompt tokens "
+            f"evaluated, {saved} of {prefix_tokens} prefix tokens reused"
+        )
+        return saved
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Per prompt and model: calls, prefix tokens and prefill saved."""
+        with self._lock:
+            measured = dict(self._prefix_tokens)
+            stats = {key: dict(value) for key, value in self._stats.items()}
+        rows = []
+        for name, model in sorted(set(measured) | set(stats)):
+            calls = stats.get((name, model), {})
+            rows.append(
+                {
+                    "prompt": name,
+                    "model": model,
+                    "prefix_tokens": self.prefix_tokens(self._by_name[name], model),
+                    "measured": (name, model) in measured,
+                    "calls": calls.get("calls", 0),
+                    "prompt_eval_tokens": calls.get("prompt_eval_tokens", 0),
+                    "saved_tokens": calls.get("saved_tokens", 0),
+                }
+            )
+        return rows
+
+    def totals(self) -> Dict[str, int]:
+        """Prefix tokens sent and reused from the cache, over all recorded calls."""
+        with self._lock:
+            stats = list(self._stats.values())
+        keys = ["calls", "prompt_eval_tokens", "prefix_tokens_sent", "saved_tokens"]
+        return {key: sum(s[key] for s in stats) for key in keys}
+
+
+def default_registry() -> PromptRegistry:
+    """The YES/NO (prompts.py) and evidence (prompts1.py) question prompts."""
+    registry = PromptRegistry()
+    names = [
+        "AGE_PROMPT",
+        "AGE_REQUEST_PROMPT",
+        "MEETUP_PROMPT",
+        "GIFT_PROMPT",
+        "MEDIA_PROMPT",
+    ]
+    for number, name in enumerate(names, 1):
+        registry.register("yes_no", f"Q{number}", getattr(prompts, name))
+        registry.register("evidence", f"Q{number}", getattr(prompts1, name))
+    return registry
+
+
+REGISTRY = default_registry()
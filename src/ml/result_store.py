@@ -0,0 +1,315 @@
+"""
+Indexed store of every verdict, in one SQLite file.
+
+One row per conversation, model and question holds the answer, evidence
+and evidence lines, plus the hash of the conversation's turns; one row per
+conversation and model holds what analyzing it cost. Conversations whose
+turns were already analyzed with the model, under any ID, are answered
+from the store without calling the LLM.
+
+The database runs in WAL mode, so reports can query it while a run is
+writing. Writes are batched into one transaction per `batch_size`
+conversations.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .incremental import fingerprint
+from .llm_client import track_usage
+from .prompt_ollama import get_all_answers
+from .speculation import likely_positive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    conversation_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    evidence TEXT,
+    evidence_lines TEXT,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, model, question)
+);
+-- "Which conversations are YES on Q3 with model X", without a table scan
+CREATE INDEX IF NOT EXISTS verdicts_by_answer
+    ON verdicts (model, question, answer, conversation_id);
+CREATE INDEX IF NOT EXISTS verdicts_by_content ON verdicts (content_hash, model);
+CREATE TABLE IF NOT EXISTS analyses (
+    conversation_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    turns INTEGER NOT NULL,
+    latency_seconds REAL,
+    llm_calls INTEGER,
+    prompt_tokens INTEGER,
+    eval_tokens INTEGER,
+    analyzed_at REAL NOT NULL,
+    PRIMARY KEY (conversation_id, model)
+);
+"""
+
+
+class ResultStore:
+    """
+    Verdicts in a SQLite database (see module docstring). Safe to share
+    between threads; `put` queues a conversation's results and every
+    `batch_size` queued conversations are committed together.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self._lock = threading.Lock()
+        # Queued, not yet committed: (conversation_id, model) -> record
+        self._pending: Dict[Tuple[str, str], Dict] = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Committed transactions survive a crash of the process; only a power
+        # loss can roll back the last ones
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def put(
+        self,
+        conversation_id: str,
+        content_hash: str,
+        model: str,
+        results: Dict[str, Dict],
+        turns: int = 0,
+        latency_seconds: Optional[float] = None,
+        usage=None,
+    ) -> None:
+        """Queue the results of one conversation, replacing any stored for it."""
+        record = {
+            "conversation_id": str(conversation_id),
+            "content_hash": content_hash,
+            "model": model,
+            "results": results,
+            "turns": turns,
+            "latency_seconds": latency_seconds,
+            "llm_calls": usage.calls if usage else 0,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "eval_tokens": usage.eval_tokens if usage else 0,
+            "analyzed_at": time.time(),
+        }
+        with self._lock:
+            self._pending[(record["conversation_id"], model)] = record
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        records = list(self._pending.values())
+        verdicts = [
+            (
+                record["conversation_id"],
+                record["model"],
+                qid,
+                result["answer"],
+                result.get("evidence"),
+                json.dumps(list(result.get("evidence_lines") or [])),
+                record["content_hash"],
+            )
+            for record in records
+            for qid, result in record["results"].items()
+        ]
+        analyses = [
+            (
+                record["conversation_id"],
+                record["model"],
+                record["content_hash"],
+                record["turns"],
+                record["latency_seconds"],
+                record["llm_calls"],
+                record["prompt_tokens"],
+                record["eval_tokens"],
+                record["analyzed_at"],
+            )
+            for record in records
+        ]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)", verdicts
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                analyses,
+            )
+        self._pending.clear()
+
+    @staticmethod
+    def _results(rows: List[Tuple]) -> Dict[str, Dict]:
+        return {
+            question: {
+                "answer": answer,
+                "evidence": evidence,
+                "evidence_lines": json.loads(lines or "[]"),
+            }
+            for question, answer, evidence, lines in rows
+        }
+
+    def get(self, conversation_id: str, model: str) -> Optional[Dict[str, Dict]]:
+        """Stored results of a conversation, or None."""
+        with self._lock:
+            record = self._pending.get((str(conversation_id), model))
+            if record is not None:
+                return record["results"]
+            rows = self._db.execute(
+                "SELECT question, answer, evidence, evidence_lines FROM verdicts "
+                "WHERE conversation_id = ? AND model = ?",
+                (str(conversation_id), model),
+            ).fetchall()
+        return self._results(rows) or None
+
+    def lookup(
+        self, content_hash: str, model: str
+    ) -> Optional[Tuple[str, Dict[str, Dict]]]:
+        """(ID, results) of a conversation with these turns, or None."""
+        with self._lock:
+            for record in self._pending.values():
+                if record["content_hash"] == content_hash and record["model"] == model:
+                    return record["conversation_id"], record["results"]
+            found = self._db.execute(
+                "SELECT conversation_id FROM verdicts "
+                "WHERE content_hash = ? AND model = ? LIMIT 1",
+                (content_hash, model),
+            ).fetchone()
+            if found is None:
+                return None
+            rows = self._db.execute(
+                "SELECT question, answer, evidence, evidence_lines FROM verdicts "
+                "WHERE conversation_id = ? AND model = ?",
+                (found[0], model),
+            ).fetchall()
+        return found[0], self._results(rows)
+
+    def query(
+        self, model: str, question: str, answer: str = "YES", limit: int = -1
+    ) -> List[str]:
+        """IDs of the conversations that got `answer` on `question` from `model`."""
+        self.flush()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT conversation_id FROM verdicts "
+                "WHERE model = ? AND question = ? AND answer = ? "
+                "ORDER BY conversation_id LIMIT ?",
+                (model, question, answer, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self) -> int:
+        """Stored conversation and model pairs."""
+        self.flush()
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_stored_results(
+    conversation: Dict,
+    model: str,
+    store: ResultStore,
+    client=None,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever=None,
+    speculative: bool = False,
+) -> Dict[str, Dict]:
+    """
+    Every question's result for a conversation, from `store` when its turns
+    were already analyzed with `model`, otherwise from the LLM and then
+    stored. Stored results are reused whatever compaction or prompt
+    variant they were made with. `speculative` requests the evidence of
+    likely positive questions early (see ml/speculation.py).
+    """
+    conversation_id = conversation["conversation_id"]
+    content_hash = fingerprint(conversation["turns"])
+    stored = store.lookup(content_hash, model)
+    if stored is not None:
+        stored_id, results = stored
+        logging.debug(f"Conversation {conversation_id} answered from the store")
+        if stored_id != str(conversation_id):
+            # A copy under another ID; costs nothing to record
+            store.put(
+                conversation_id,
+                content_hash,
+                model,
+                results,
+                len(conversation["turns"]),
+            )
+        return results
+
+    start = time.perf_counter()
+    with track_usage() as usage:
+        results, _ = get_all_answers(
+            conversation,
+            model,
+            client,
+            compact,
+            prompt_variant,
+            retriever,
+            speculate=likely_positive(conversation) if speculative else None,
+        )
+    store.put(
+        conversation_id,
+        content_hash,
+        model,
+        results,
+        len(conversation["turns"]),
+        time.perf_counter() - start,
+        usage,
+    )
+    return results
+
+
+def get_stored_answers(
+    conversation: Dict,
+    model: str,
+    store: ResultStore,
+    client=None,
+    compact: bool = False,
+    prompt_variant: str = "full",
+    retriever=None,
+    speculative: bool = False,
+) -> Dict:
+    """The YES/NO answer row for one conversation, through `store`."""
+    results = get_stored_results(
+        conversation,
+        model,
+        store,
+        client,
+        compact,
+        prompt_variant,
+        retriever,
+        speculative,
+    )
+    row = {"id": conversation["conversation_id"]}
+    row.update((qid, result["answer"]) for qid, result in results.items())
+    return row
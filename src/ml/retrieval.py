@@ -0,0 +1,291 @@
+"""
+Embedding retrieval that narrows long conversations to the turns each
+question is about before prompting.
+
+Turns are embedded in batches (Ollama `/api/embed`, or the local hashing
+stand-in) once per conversation. For each question, the `top_k` turns most
+similar to any of its exemplar messages are kept together with `window`
+turns on either side, so the model still sees the exchange around them.
+The result is a CompactConversation whose sources point at the original
+turns, so evidence lines map back exactly as with compaction.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .compaction import CompactConversation
+
+# Use the local stand-in instead of an Ollama embedding model
+LOCAL_EMBED_MODEL = "hashing"
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+
+DEFAULT_TOP_K = 8
+DEFAULT_WINDOW = 1
+# Conversations with at most this many turns are sent whole
+MIN_TURNS = 40
+EMBED_BATCH_SIZE = 64
+
+# Short messages of the kind each question looks for
+QUESTION_EXEMPLARS: Dict[str, List[str]] = {
+    "Q1": [
+        "I'm 14",
+        "im 13 years old",
+        "I just turned 15 last week",
+        "my age is 12",
+        "I'm in 8th grade",
+    ],
+    "Q2": [
+        "how old are you?",
+        "what's your age",
+        "asl?",
+        "how old r u",
+        "are you still in high school?",
+    ],
+    "Q3": [
+        "want to meet up this weekend?",
+        "let's meet at the mall",
+        "I can pick you up after school",
+        "come over to my place tonight",
+        "where do you live?",
+    ],
+    "Q4": [
+        "I'll buy you a new phone",
+        "send me your amazon wishlist",
+        "I sent you a gift card",
+        "I can get you that game if you want",
+        "did you get the present I mailed you?",
+    ],
+    "Q5": [
+        "send me a pic",
+        "can you send a photo of yourself",
+        "let's video chat",
+        "here's a selfie",
+        "I want to see a video of you",
+    ],
+}
+
+WORD_RE = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Local stand-in for an embedding model: hashed counts of the words and
+    character trigrams of each text. Catches shared words and spelling
+    variants ("pic", "pics"), not paraphrases.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+        # Chat vocabularies are small, so each word is hashed once; row i of
+        # the table holds word i's buckets, padded with -1
+        self._ids: Dict[str, int] = {}
+        self._buckets: List[List[int]] = []
+        self._table: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _add_word(self, word: str) -> int:
+        padded = f" {word} "
+        features = [word] + [padded[i : i + 3] for i in range(len(padded) - 2)]
+        self._buckets.append(
+            [zlib.crc32(f.encode()) % self.dimensions for f in features]
+        )
+        self._ids[word] = len(self._ids)
+        self._table = None
+        return self._ids[word]
+
+    def _bucket_table(self) -> np.ndarray:
+        if self._table is None:
+            width = max(map(len, self._buckets), default=1)
+            table = np.full((len(self._buckets), width), -1, dtype=np.int64)
+            for index, buckets in enumerate(self._buckets):
+                table[index, : len(buckets)] = buckets
+            self._table = table
+        return self._table
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        with self._lock:
+            return self._embed(texts)
+
+    def _embed(self, texts: Sequence[str]) -> np.ndarray:
+        if len(self._ids) > 1_000_000:
+            # Not a chat vocabulary; start over rather than grow without bound
+            self._ids, self._buckets, self._table = {}, [], None
+        ids = self._ids
+        word_ids: List[int] = []
+        lengths = np.zeros(len(texts), dtype=np.int64)
+        for row, text in enumerate(texts):
+            words = WORD_RE.findall(text.lower())
+            word_ids.extend([ids[w] if w in ids else self._add_word(w) for w in words])
+            lengths[row] = len(words)
+
+        buckets = self._bucket_table()[np.asarray(word_ids, dtype=np.int64)]
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        cells = rows[:, None] * self.dimensions + buckets
+        counts = np.bincount(
+            cells[buckets >= 0], minlength=len(texts) * self.dimensions
+        )
+        return counts.reshape(len(texts), self.dimensions).astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def select_turns(scores: np.ndarray, top_k: int, window: int) -> List[int]:
+    """Indices of the `top_k` best scores and `window` neighbours each, in order."""
+    if len(scores) <= top_k:
+        return list(range(len(scores)))
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    selected = set()
+    for index in best:
+        low, high = max(0, index - window), min(len(scores), index + window + 1)
+        selected.update(range(low, high))
+    return sorted(int(i) for i in selected)
+
+
+class TurnRetriever:
+    """
+    Narrows conversations per question (see module docstring). Turn
+    embeddings are cached per conversation text, so the five questions, and
+    reruns in the same process, embed each conversation once.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_EMBED_MODEL,
+        client=None,
+        top_k: int = DEFAULT_TOP_K,
+        window: int = DEFAULT_WINDOW,
+        min_turns: int = MIN_TURNS,
+        batch_size: int = EMBED_BATCH_SIZE,
+        cache_size: int = 1000,
+    ):
+        self.model = model
+        if client is None and model != LOCAL_EMBED_MODEL:
+            from .llm_client import default_client as client
+        self.client = client
+        self.local = HashingEmbedder() if model == LOCAL_EMBED_MODEL else None
+        self.top_k = top_k
+        self.window = window
+        self.min_turns = min_turns
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._questions: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "conversations": 0,
+            "narrowed": 0,
+            "embedded_turns": 0,
+            "cache_hits": 0,
+            "turns": 0,
+            "kept_turns": 0,
+            "tokens": 0,
+            "kept_tokens": 0,
+        }
+
+    def _count(self, **counts: int) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Unit-length embeddings of `texts`, `batch_size` per backend call."""
+        if self.local is not None:
+            return normalize(self.local.embed(texts))
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start : start + self.batch_size])
+            response = self.client.embed(model=self.model, input=batch)
+            vectors.extend(response["embeddings"])
+        return normalize(np.asarray(vectors, dtype=np.float32))
+
+    def turn_embeddings(self, turns: List[Dict]) -> np.ndarray:
+        texts = [str(turn["text"]) for turn in turns]
+        key = hashlib.sha1("\n".join(texts).encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            self._count(cache_hits=1)
+            return cached
+
+        vectors = self.embed(texts)
+        self._count(embedded_turns=len(texts))
+        with self._lock:
+            self._cache[key] = vectors
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vectors
+
+    def question_embeddings(self, qid: str) -> np.ndarray:
+        with self._lock:
+            vectors = self._questions.get(qid)
+        if vectors is None:
+            vectors = self.embed(QUESTION_EXEMPLARS[qid])
+            with self._lock:
+                self._questions[qid] = vectors
+        return vectors
+
+    def scores(self, turns: List[Dict], qid: str) -> np.ndarray:
+        """Each turn's best cosine similarity to one of the question's exemplars."""
+        similarity = self.turn_embeddings(turns) @ self.question_embeddings(qid).T
+        return similarity.max(axis=1)
+
+    def narrow(self, prepared: CompactConversation, qid: str) -> CompactConversation:
+        """The turns of `prepared` worth sending for question `qid`."""
+        turns = prepared.turns
+        if len(turns) <= max(self.min_turns, self.top_k):
+            self._count(
+                conversations=1,
+                turns=len(turns),
+                kept_turns=len(turns),
+                tokens=prepared.compact_tokens,
+                kept_tokens=prepared.compact_tokens,
+            )
+            return prepared
+
+        try:
+            selected = select_turns(self.scores(turns, qid), self.top_k, self.window)
+        except Exception as e:
+            logging.warning(f"Retrieval failed, sending the whole conversation: {e}")
+            return prepared
+        narrowed = CompactConversation(
+            [turns[i] for i in selected],
+            [prepared.sources[i] for i in selected],
+            prepared.original_tokens,
+            aliases=prepared.aliases,
+            urls=prepared.urls,
+        )
+        self._count(
+            conversations=1,
+            narrowed=1,
+            turns=len(turns),
+            kept_turns=len(selected),
+            tokens=prepared.compact_tokens,
+            kept_tokens=narrowed.compact_tokens,
+        )
+        return narrowed
+
+    def stats(self) -> Dict[str, int]:
+        """Counters over every `narrow` call (one per conversation and question)."""
+        with self._lock:
+            return dict(self._stats)
+
+
+def create_retriever(
+    model: Optional[str], client=None, top_k: int = DEFAULT_TOP_K
+) -> Optional[TurnRetriever]:
+    """A TurnRetriever for `model`, or None (no retrieval) when it is empty."""
+    if not model:
+        return None
+    return TurnRetriever(model, client, top_k=top_k)
@@ -0,0 +1,98 @@
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Tuple
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+DEFAULT_PRIORITY = "batch"
+DEFAULT_FLOW = "default"
+
+_current_request: ContextVar = ContextVar(
+    "llm_request", default=(DEFAULT_PRIORITY, DEFAULT_FLOW, 1.0)
+)
+
+
+@contextmanager
+def request_context(
+    priority: str = DEFAULT_PRIORITY, flow: str = DEFAULT_FLOW, weight: float = 1.0
+):
+    """
+    Tag every LLM call made in this context with a priority class and a
+    flow (a client or job) that shares its class's capacity in proportion
+    to `weight`. Worker threads only inherit it when run via
+    `contextvars.copy_context().run`.
+    """
+    previous = _current_request.get()
+    set_request_context(priority, flow, weight)
+    try:
+        yield
+    finally:
+        _current_request.set(previous)
+
+
+def set_request_context(
+    priority: str = DEFAULT_PRIORITY, flow: str = DEFAULT_FLOW, weight: float = 1.0
+) -> None:
+    """Like `request_context`, for the rest of the current context (e.g. a script)."""
+    if priority not in PRIORITIES:
+        raise ValueError(
+            f"Unknown priority {priority!r}, expected one of {sorted(PRIORITIES)}"
+        )
+    _current_request.set((priority, flow, max(weight, 1e-6)))
+
+
+def current_request() -> Tuple[str, str, float]:
+    """(priority, flow, weight) of the calling context."""
+    return _current_request.get()
+
+
+def estimate_cost(prompt: str) -> float:
+    """Rough prompt size in tokens, the unit flows are charged in."""
+    return max(1.0, len(prompt) / 4)
+
+
+class FairQueue:
+    """
+    Orders requests waiting for a slot: strictly by priority class, then by
+    start-time fair queuing across the flows of that class.
+
+    Each request gets a virtual start tag (the later of the class's current
+    virtual time and the flow's previous finish tag) and a finish tag of
+    start + cost / weight. Waiting requests are served in finish tag order,
+    so a flow that has just sent thousands of prompts does not hold back a
+    flow sending its first one, and a flow with weight 2 gets about twice
+    the share of one with weight 1 while both are busy. Not thread-safe on
+    its own; the owning limiter calls it under its lock.
+    """
+
+    def __init__(self):
+        self._virtual_time: Dict[int, float] = {}
+        self._last_finish: Dict[Tuple[int, str], float] = {}
+        self._sequence = itertools.count()
+
+    def tag(self, priority: str, flow: str, weight: float, cost: float) -> tuple:
+        """Sortable tag for a new request: (class, finish, sequence, start)."""
+        rank = PRIORITIES[priority]
+        start = max(
+            self._virtual_time.get(rank, 0.0), self._last_finish.get((rank, flow), 0.0)
+        )
+        finish = start + cost / weight
+        self._last_finish[(rank, flow)] = finish
+        return (rank, finish, next(self._sequence), start)
+
+    def dispatched(self, tag: tuple) -> None:
+        rank, _, _, start = tag
+        virtual_time = max(self._virtual_time.get(rank, 0.0), start)
+        self._virtual_time[rank] = virtual_time
+        if len(self._last_finish) > 1000:
+            # Flows whose finish tag has passed are idle; forget them
+            self._last_finish = {
+                key: finish
+                for key, finish in self._last_finish.items()
+                if finish > self._virtual_time.get(key[0], 0.0)
+            }
+
+
+def priority_name(rank: int) -> str:
+    return next(name for name, value in PRIORITIES.items() if value == rank)
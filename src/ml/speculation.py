@@ -0,0 +1,136 @@
+"""
+Speculative evidence extraction.
+
+Normally a question's evidence prompt is only sent after its YES/NO prompt
+came back YES, so a positive question costs two round trips one after the
+other. For questions that look likely to be YES (a keyword pre-screen of
+the conversation, or an earlier YES verdict) both prompts are sent at
+once, so a positive costs one round trip. Evidence for a question that
+turns out NO is cancelled if it has not started yet and discarded
+otherwise; what discarded evidence cost is counted in SPECULATION_STATS.
+"""
+
+import contextvars
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .llm_client import track_usage
+
+# Cheap signs that a question may be YES. False positives only cost a
+# discarded evidence call; misses only cost the usual second round trip.
+PRESCREEN_PATTERNS: Dict[str, re.Pattern] = {
+    qid: re.compile(pattern, re.IGNORECASE)
+    for qid, pattern in {
+        "Q1": r"\b(?:i'?m|i am|age is)\s+\d{1,2}\b|\b\d{1,2}\s*(?:yo|y/o|years? old)\b"
+        r"|\b(?:\d{1,2}th|ninth|eighth|seventh|sixth) grade\b",
+        "Q2": r"how old|\bage\b|\basl\b|what grade|high school",
+        "Q3": r"\bmeet\b|pick (?:you|u) up|come over|where do (?:you|u) live"
+        r"|hang ?out|my place",
+        "Q4": r"\bgifts?\b|\bbuy\b|\bbought\b|\bpresents?\b|gift ?card|wish ?list"
+        r"|\bsent (?:you|u)\b",
+        "Q5": r"\bpics?\b|\bphotos?\b|\bpictures?\b|\bselfies?\b|\bvideos?\b"
+        r"|\bcam\b|\bsnap",
+    }.items()
+}
+
+# Evidence requests in flight at once; beyond this they queue, and can still
+# be cancelled when their question turns out NO
+MAX_SPECULATIVE = 64
+
+
+def prescreen(turns: List[Dict]) -> Set[str]:
+    """Questions whose pre-screen pattern matches any turn."""
+    text = "\n".join(str(turn["text"]) for turn in turns)
+    return {qid for qid, pattern in PRESCREEN_PATTERNS.items() if pattern.search(text)}
+
+
+def likely_positive(
+    conversation: Dict, history: Optional[Iterable[str]] = None
+) -> Set[str]:
+    """Questions worth speculating on: pre-screen hits and earlier YES verdicts."""
+    return prescreen(conversation["turns"]) | set(history or ())
+
+
+class SpeculationStats:
+    """Thread-safe counters of speculative evidence requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.speculated = 0
+        # Question was YES: the evidence was used and saved a round trip
+        self.used = 0
+        # Question was NO: cancelled before it was sent, or sent and discarded
+        self.cancelled = 0
+        self.discarded = 0
+        self.wasted_calls = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_eval_tokens = 0
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "speculated": self.speculated,
+                "used": self.used,
+                "cancelled": self.cancelled,
+                "discarded": self.discarded,
+                "wasted_calls": self.wasted_calls,
+                "wasted_prompt_tokens": self.wasted_prompt_tokens,
+                "wasted_eval_tokens": self.wasted_eval_tokens,
+            }
+
+
+SPECULATION_STATS = SpeculationStats()
+
+_pool = ThreadPoolExecutor(
+    max_workers=MAX_SPECULATIVE, thread_name_prefix="speculative-evidence"
+)
+
+
+def _with_usage(request: Callable[..., str], *args):
+    with track_usage() as usage:
+        return request(*args), usage
+
+
+def start_speculative(request: Callable[..., str], *args) -> Future:
+    """
+    Start `request(*args)` in the background. It keeps the caller's
+    priority, flow and usage tracking. Resolve it with `use_speculative`
+    or `discard_speculative`.
+    """
+    SPECULATION_STATS.add(speculated=1)
+    ctx = contextvars.copy_context()
+    return _pool.submit(ctx.run, _with_usage, request, *args)
+
+
+def use_speculative(future: Future) -> str:
+    """Wait for a speculative request whose question was YES."""
+    response, _ = future.result()
+    SPECULATION_STATS.add(used=1)
+    return response
+
+
+def _count_waste(future: Future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, usage = future.result()
+    SPECULATION_STATS.add(
+        wasted_calls=usage.calls,
+        wasted_prompt_tokens=usage.prompt_tokens,
+        wasted_eval_tokens=usage.eval_tokens,
+    )
+
+
+def discard_speculative(future: Future) -> None:
+    """Drop a speculative request whose question was NO, without waiting for it."""
+    if future.cancel():
+        SPECULATION_STATS.add(cancelled=1)
+        return
+    SPECULATION_STATS.add(discarded=1)
+    future.add_done_callback(_count_waste)
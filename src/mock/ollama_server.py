@@ -0,0 +1,495 @@
+"""
+Local stand-in for an Ollama server, for benchmarks and load tests that must
+not depend on a real GPU or model.
+
+python3 -m src.mock.ollama_server --port 11435 --latency lognormal:-0.7,0.5 --tokens_per_second 40 --slots 4
+OLLAMA_HOST=http://127.0.0.1:11435 python3 -m src.backend.server
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+# Marker used by LlamaModel._create_prompt
+JSON_ANALYSIS_MARKER = "Provide your analysis in the following JSON format"
+
+
+def parse_latency(spec: str):
+    """
+    Build a sampler from a latency spec in seconds:
+    fixed:S, uniform:LOW,HIGH, normal:MEAN,STD, lognormal:MU,SIGMA, exp:MEAN
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    samplers = {
+        "fixed": lambda rng: values[0],
+        "uniform": lambda rng: rng.uniform(values[0], values[1]),
+        "normal": lambda rng: rng.gauss(values[0], values[1]),
+        "lognormal": lambda rng: rng.lognormvariate(values[0], values[1]),
+        "exp": lambda rng: rng.expovariate(1.0 / values[0]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    return lambda rng: max(0.0, samplers[kind](rng))
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def mock_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """Deterministic unit vector of hashed words; texts sharing words are similar."""
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode()) % dimensions] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def default_response(prompt: str) -> str:
+    """Well-formed negative answer in whatever format the prompt asks for."""
+    if JSON_ANALYSIS_MARKER in prompt:
+        questions = [
+            {
+                "question_number": str(i),
+                "question": f"Question {i}",
+                "answer": "NO",
+                "evidence": "No evidence found in conversation",
+            }
+            for i in range(1, 6)
+        ]
+        return json.dumps({"analysis": {"questions": questions}})
+    return "NO"
+
+
+class MockBehavior:
+    """Latency, throughput, capacity, failures and scripted answers."""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        tokens_per_second: float = 0.0,
+        slots: int = 4,
+        failure_rate: float = 0.0,
+        failure_status: int = 500,
+        script: Optional[List[Dict[str, str]]] = None,
+        seed: Optional[int] = None,
+        prompt_cache: bool = False,
+        max_loaded_models: int = 0,
+        load_seconds: float = 0.0,
+    ):
+        self.sample_latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.slots = threading.BoundedSemaphore(max(1, slots))
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.rules = [
+            (re.compile(rule["match"], re.IGNORECASE | re.DOTALL), rule["response"])
+            for rule in (script or [])
+        ]
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.max_in_flight = 0
+        self.loaded_models: Dict[str, float] = {}
+        # Context size each loaded model was loaded with; another one reloads it
+        self.loaded_num_ctx: Dict[str, Optional[int]] = {}
+        # Like Ollama with limited memory: loading a model beyond
+        # `max_loaded_models` evicts the least recently used one first
+        self.max_loaded_models = max_loaded_models
+        self.load_seconds = load_seconds
+        self._load_lock = threading.Lock()
+        self.model_loads = 0
+
+        # Like Ollama's per-slot KV cache: the longest prefix shared with one
+        # of the last `slots` prompts of the same model is not evaluated again
+        self.prompt_cache = prompt_cache
+        self._cache_size = max(1, slots)
+        self._recent_prompts: Dict[str, List[str]] = {}
+        self.cached_tokens = 0
+
+    def cached_chars(self, model: str, prompt: str) -> int:
+        """Characters of `prompt` served from the cache, and remember it."""
+        if not self.prompt_cache:
+            return 0
+        with self._stats_lock:
+            recent = self._recent_prompts.setdefault(model, [])
+            cached = max(
+                (len(os.path.commonprefix([prompt, other])) for other in recent),
+                default=0,
+            )
+            recent.append(prompt)
+            del recent[: -self._cache_size]
+            self.cached_tokens += cached // 4
+        return cached
+
+    def sample(self) -> Tuple[float, bool]:
+        """Prefill latency for one request and whether it should fail."""
+        with self._rng_lock:
+            return (
+                self.sample_latency(self._rng),
+                self._rng.random() < self.failure_rate,
+            )
+
+    def answer(self, prompt: str) -> str:
+        """First scripted rule whose regex matches the prompt, else a NO."""
+        for pattern, response in self.rules:
+            if pattern.search(prompt):
+                return response
+        return default_response(prompt)
+
+    def output_seconds(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def enter(self, model: str) -> None:
+        with self._stats_lock:
+            self.requests += 1
+            self.queued += 1
+        self.slots.acquire()
+        with self._stats_lock:
+            self.queued -= 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def ensure_loaded(self, model: str, num_ctx: Optional[int] = None) -> float:
+        """
+        Load `model` if it is not loaded with context size `num_ctx`; returns
+        the seconds spent loading.
+        """
+        with self._load_lock:
+            with self._stats_lock:
+                loaded = (
+                    model in self.loaded_models
+                    and self.loaded_num_ctx.get(model) == num_ctx
+                )
+                self.loaded_models[model] = time.time()
+                self.loaded_num_ctx[model] = num_ctx
+                if loaded:
+                    return 0.0
+                self.model_loads += 1
+                if self.max_loaded_models > 0:
+                    while len(self.loaded_models) > self.max_loaded_models:
+                        oldest = min(self.loaded_models, key=self.loaded_models.get)
+                        del self.loaded_models[oldest]
+                        del self.loaded_num_ctx[oldest]
+            # One load at a time, as the weights have to be read in
+            time.sleep(self.load_seconds)
+            return self.load_seconds
+
+    def leave(self, failed: bool) -> None:
+        with self._stats_lock:
+            self.in_flight -= 1
+            if failed:
+                self.failures += 1
+        self.slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "max_in_flight": self.max_in_flight,
+                "cached_tokens": self.cached_tokens,
+                "model_loads": self.model_loads,
+            }
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    behavior: MockBehavior = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _send_json(self, payload: Dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        elif self.path in ("/api/ps", "/api/tags"):
+            models = [
+                {
+                    "name": name,
+                    "model": name,
+                    "digest": "mock",
+                    "size": 0,
+                    "size_vram": 0,
+                    "expires_at": _now(),
+                    "modified_at": _now(),
+                    "details": {},
+                }
+                for name in sorted(self.behavior.loaded_models)
+            ]
+            self._send_json({"models": models})
+        elif self.path == "/mock/stats":
+            self._send_json(self.behavior.stats())
+        elif self.path == "/":
+            self._send_json({"status": "Ollama is running"})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path == "/api/generate":
+            request = self._read_json()
+            self._complete(request, request.get("prompt") or "", chat=False)
+        elif self.path == "/api/chat":
+            request = self._read_json()
+            messages = request.get("messages") or []
+            prompt = "\n".join(m.get("content", "") for m in messages)
+            self._complete(request, prompt, chat=True)
+        elif self.path == "/api/embed":
+            self._embed(self._read_json())
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _embed(self, request: Dict) -> None:
+        behavior = self.behavior
+        model = request.get("model", "")
+        texts = request.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        start = time.perf_counter()
+
+        behavior.enter(model)
+        failed = False
+        try:
+            load = behavior.ensure_loaded(model)
+            prefill, failed = behavior.sample()
+            # One batched forward pass; far cheaper than a generation
+            time.sleep(prefill / 10)
+            if failed:
+                self._send_json(
+                    {"error": "mock failure injected"}, behavior.failure_status
+                )
+                return
+            self._send_json(
+                {
+                    "model": model,
+                    "embeddings": [mock_embedding(text) for text in texts],
+                    "total_duration": int((time.perf_counter() - start) * 1e9),
+                    "load_duration": int(load * 1e9),
+                    "prompt_eval_count": sum(estimate_tokens(t) for t in texts),
+                }
+            )
+        finally:
+            behavior.leave(failed)
+
+    def _chunk(self, model: str, text: str, chat: bool, done: bool) -> Dict:
+        payload = {"model": model, "created_at": _now(), "done": done}
+        if chat:
+            payload["message"] = {"role": "assistant", "content": text}
+        else:
+            payload["response"] = text
+        return payload
+
+    def _complete(self, request: Dict, prompt: str, chat: bool) -> None:
+        behavior = self.behavior
+        model = request.get("model", "")
+        stream = request.get("stream", True)
+        start = time.perf_counter()
+
+        behavior.enter(model)
+        failed = False
+        try:
+            num_ctx = (request.get("options") or {}).get("num_ctx")
+            load = behavior.ensure_loaded(model, num_ctx)
+            prefill, failed = behavior.sample()
+            cached = behavior.cached_chars(model, prompt)
+            if cached:
+                # Only the uncached part of the prompt is prefilled
+                prefill *= 1 - cached / len(prompt)
+            time.sleep(prefill)
+            if failed:
+                self._send_json(
+                    {"error": "mock failure injected"}, behavior.failure_status
+                )
+                return
+
+            text = behavior.answer(prompt)
+            prompt_tokens = estimate_tokens(prompt[cached:])
+            if num_ctx:
+                # Ollama keeps the end of a prompt that does not fit
+                prompt_tokens = min(prompt_tokens, num_ctx)
+            # Keep whitespace attached so the streamed pieces join back exactly
+            pieces = re.findall(r"\S+\s*|\s+", text) or [""]
+            eval_tokens = len(pieces)
+
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                per_piece = behavior.output_seconds(1)
+                for piece in pieces:
+                    time.sleep(per_piece)
+                    self._write_chunk(self._chunk(model, piece, chat, done=False))
+            else:
+                time.sleep(behavior.output_seconds(eval_tokens))
+
+            total = time.perf_counter() - start
+            final = self._chunk(model, "" if stream else text, chat, done=True)
+            final.update(
+                {
+                    "done_reason": "stop",
+                    "total_duration": int(total * 1e9),
+                    "load_duration": int(load * 1e9),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prefill * 1e9),
+                    "eval_count": eval_tokens,
+                    "eval_duration": int(behavior.output_seconds(eval_tokens) * 1e9),
+                }
+            )
+            if stream:
+                self._write_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self._send_json(final)
+        finally:
+            behavior.leave(failed)
+
+    def _write_chunk(self, payload: Dict) -> None:
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def create_server(
+    host: str = "127.0.0.1", port: int = 11435, **behavior_kwargs
+) -> ThreadingHTTPServer:
+    """Create (but do not start) a mock server; port 0 picks a free port."""
+    handler = type(
+        "BoundMockOllamaHandler",
+        (MockOllamaHandler,),
+        {"behavior": MockBehavior(**behavior_kwargs)},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(**kwargs) -> Tuple[ThreadingHTTPServer, str]:
+    """Start a mock server on a background thread and return it with its URL."""
+    server = create_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument(
+        "--latency",
+        default="fixed:0",
+        help="Prefill latency distribution in seconds: fixed:S, uniform:LOW,HIGH, normal:MEAN,STD, lognormal:MU,SIGMA, exp:MEAN",
+    )
+    parser.add_argument(
+        "--tokens_per_second",
+        type=float,
+        default=0.0,
+        help="Output generation speed; 0 returns the whole answer at once",
+    )
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=4,
+        help="Requests processed at once; the rest queue (like OLLAMA_NUM_PARALLEL)",
+    )
+    parser.add_argument("--failure_rate", type=float, default=0.0)
+    parser.add_argument("--failure_status", type=int, default=500)
+    parser.add_argument(
+        "--script",
+        default=None,
+        help='JSON file with [{"match": "<regex on prompt>", "response": "..."}]; first match wins',
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--max_loaded_models",
+        type=int,
+        default=0,
+        help="Models that fit in memory at once; loading another evicts the least recently used (default: 0 = no limit)",
+    )
+    parser.add_argument(
+        "--load_seconds",
+        type=float,
+        default=0.0,
+        help="Time to load a model that is not loaded",
+    )
+    parser.add_argument(
+        "--prompt_cache",
+        action="store_true",
+        help="Reuse the prefix shared with recent prompts, as Ollama's KV cache does",
+    )
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    server = create_server(
+        args.host,
+        args.port,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        slots=args.slots,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        script=script,
+        seed=args.seed,
+        prompt_cache=args.prompt_cache,
+        max_loaded_models=args.max_loaded_models,
+        load_seconds=args.load_seconds,
+    )
+    logging.info(f"Mock Ollama listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+
+from src.client.batch_client import output_paths
+
+
+def test_output_paths_do_not_collide(tmp_path):
+    inputs = [
+        str(tmp_path / "a" / "part1.json"),
+        str(tmp_path / "a" / "part1.jsonl"),
+        str(tmp_path / "b" / "part1.json"),
+    ]
+    outputs = output_paths(inputs, "out")
+    assert outputs == {
+        inputs[0]: os.path.join("out", "a", "part1.json.csv"),
+        inputs[1]: os.path.join("out", "a", "part1.jsonl.csv"),
+        inputs[2]: os.path.join("out", "b", "part1.json.csv"),
+    }
+
+
+def test_output_paths_single_directory(tmp_path):
+    inputs = [str(tmp_path / "part1.json"), str(tmp_path / "part2.json")]
+    assert output_paths(inputs, "out") == {
+        inputs[0]: os.path.join("out", "part1.json.csv"),
+        inputs[1]: os.path.join("out", "part2.json.csv"),
+    }
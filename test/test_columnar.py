@@ -0,0 +1,47 @@
+"""
+python3 -m pytest test
+"""
+
+import pyarrow.parquet as pq
+
+from src.client.columnar import (
+    QUESTION_IDS,
+    ParquetResultWriter,
+    csv_result_row,
+    make_result_row,
+)
+from src.client.csv_analysis_client import ConversationAnalyzer
+
+
+def failing_analyzer(monkeypatch):
+    analyzer = ConversationAnalyzer("llama3.1")
+
+    def fail(conversation):
+        raise RuntimeError("model unreachable")
+
+    monkeypatch.setattr(analyzer, "_ask", fail)
+    return analyzer
+
+
+def test_failed_conversation_has_null_answers(monkeypatch, tmp_path):
+    analyzer = failing_analyzer(monkeypatch)
+    conversation = {"conversation_id": "c1", "turns": []}
+    path = str(tmp_path / "results.parquet")
+    with ParquetResultWriter(path) as writer:
+        writer.write(analyzer.analyze_conversation_columnar(conversation))
+        writer.write(
+            make_result_row("c2", "llama3.1", {"Q1": {"answer": "YES"}}, 0.1)
+        )
+
+    table = pq.read_table(path)
+    assert str(table.schema.field("Q1").type) == "bool"
+    rows = table.to_pylist()
+    assert [rows[0][qid] for qid in QUESTION_IDS] == [None] * 5
+    assert rows[0]["Q1_evidence"] is None and rows[0]["Q1_lines"] is None
+    assert [rows[1][qid] for qid in QUESTION_IDS] == [True] + [False] * 4
+
+
+def test_failed_conversation_is_error_in_csv():
+    row = csv_result_row(make_result_row("c1", "llama3.1", None, 0.0))
+    assert [row[qid] for qid in QUESTION_IDS] == ["ERROR"] * 5
+    assert row["Q1_lines"] == ""
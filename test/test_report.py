@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation.report import (
+    NO,
+    OTHER,
+    YES,
+    bootstrap_confidence_intervals,
+    encode_answers,
+    load_conversation_file,
+)
+from src.client.columnar import ParquetResultWriter, make_result_row
+
+
+def test_encode_answers_strings():
+    column = pd.Series(["YES - said 14", "no", "No", "ERROR", None, "maybe"])
+    assert encode_answers(column).tolist() == [YES, NO, NO, OTHER, OTHER, OTHER]
+
+
+@pytest.mark.parametrize("dtype", [bool, object, "boolean"])
+def test_encode_answers_booleans(dtype):
+    values = [True, False] if dtype is bool else [True, False, None]
+    codes = encode_answers(pd.Series(values, dtype=dtype))
+    assert codes.tolist() == [YES, NO, OTHER][: len(values)]
+
+
+def test_parquet_null_answer_round_trip(tmp_path):
+    path = str(tmp_path / "conversations_part_1.parquet")
+    with ParquetResultWriter(path) as writer:
+        writer.write(make_result_row("c1", "llama3.1", {"Q1": {"answer": "YES"}}, 0.1))
+        writer.write(make_result_row("c2", "llama3.1", None, 0.1))
+
+    conv_df = load_conversation_file(path)
+    assert encode_answers(conv_df["Q1"]).tolist() == [YES, OTHER]
+    assert encode_answers(conv_df["Q2"]).tolist() == [NO, OTHER]
+    assert np.issubdtype(encode_answers(conv_df["Q3"]).dtype, np.uint8)
+
+
+def test_bootstrap_skips_degenerate_resamples():
+    # One positive in 20 rows: many resamples leave it out, so their recall
+    # is undefined rather than 0%
+    labels = np.full((20, 5), NO, dtype=np.uint8)
+    labels[0] = YES
+    predictions = labels.copy()
+
+    ci_df = bootstrap_confidence_intervals(labels, predictions, n_resamples=200)
+    recall = ci_df[(ci_df["Question"] == "Q1") & (ci_df["Metric"] == "recall")]
+    row = recall.iloc[0]
+    assert row["Value"] == "100.00%"
+    assert row["CI_Low"] == row["CI_High"] == "100.00%"
+    assert 0 < row["Degenerate"] < 200